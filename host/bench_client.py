@@ -0,0 +1,72 @@
+"""
+Client benchmark, run against a simulated board (see simulator.py).
+
+Compares the old way of driving a board, a new HTTP connection per call with text compiled on the board
+(/api/type), with pyhid_client: pooled keep-alive connections and text compiled into raw reports on the host.
+
+    python host/bench_client.py --calls 200 --bulk-chars 5000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+
+from simulator import wait_until_listening
+from pyhid_client import PyHIDClient
+
+HOST = "127.0.0.1"
+
+
+def _one_shot(port: int, path: str, body: dict):
+    conn = http.client.HTTPConnection(HOST, port, timeout=60)
+    conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+    conn.getresponse().read()
+    conn.close()
+
+
+def _timed(label: str, calls: int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:>9.1f} ms {elapsed * 1000 / calls:>8.2f} ms/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="short type calls per run")
+    parser.add_argument("--bulk-chars", type=int, default=5000, help="characters in the bulk run")
+    parser.add_argument("--report-interval", type=float, default=0.0, help="seconds per simulated HID report")
+    parser.add_argument("--port", type=int, default=18090)
+    args = parser.parse_args()
+
+    board = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, os.path.join(os.path.dirname(__file__), "simulator.py"), "--port", str(args.port),
+         "--report-interval", str(args.report_interval)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_listening(args.port)
+        text = "The quick brown fox jumps over the lazy dog. " * (args.bulk_chars // 45 + 1)
+        text = text[:args.bulk_chars]
+        with PyHIDClient(HOST, args.port) as client:
+            client.compiler()  # import the layout up front, as the board does
+            _timed("connection per call, /api/type", args.calls,
+                   lambda: [_one_shot(args.port, "/api/type", {"data": "hi"}) for _ in range(args.calls)])
+            _timed("pooled, /api/type", args.calls,
+                   lambda: [client.type_on_board("hi") for _ in range(args.calls)])
+            _timed("pooled, compiled reports", args.calls,
+                   lambda: [client.type("hi", caps_lock=False) for _ in range(args.calls)])
+            _timed(f"bulk {args.bulk_chars} chars, /api/type", 1,
+                   lambda: _one_shot(args.port, "/api/type", {"data": text}))
+            _timed(f"bulk {args.bulk_chars} chars, compiled reports", 1, lambda: client.type(text, caps_lock=False))
+    finally:
+        board.terminate()
+        board.wait()
+
+
+if __name__ == "__main__":
+    main()
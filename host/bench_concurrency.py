@@ -0,0 +1,132 @@
+"""
+Concurrency benchmark, run against simulated boards (see simulator.py).
+
+For each max_connections setting a simulated board is started, then:
+  - `slow` clients trickle their requests in over a couple of seconds (a slow/flaky client),
+  - a `bulk` client types a long string through /api/type,
+  - `fast` clients fire GET /api/logs in a loop and record their latency.
+With a single connection the fast clients queue up behind the slow ones and the bulk paste, with several they only
+wait for their own request.
+
+    python host/bench_concurrency.py --connections 1 4 --fast 4 --slow 2
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from simulator import wait_until_listening
+
+HOST = "127.0.0.1"
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _slow_client(port: int, duration: float, stop: threading.Event):
+    """Sends a GET request a few bytes at a time, well within the server's idle timeout"""
+    request = b"GET /api/logs HTTP/1.1\r\nHost: pyhid\r\nX-Padding: " + b"x" * 32 + b"\r\n\r\n"
+    delay = duration / len(request)
+    while not stop.is_set():
+        try:
+            with socket.create_connection((HOST, port), timeout=10) as sock:
+                for i in range(len(request)):
+                    sock.sendall(request[i:i + 1])
+                    time.sleep(delay)
+                sock.recv(4096)
+        except OSError:
+            time.sleep(0.05)
+
+
+def _bulk_client(port: int, chars: int, results: dict):
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(HOST, port, timeout=120)
+    body = json.dumps({"data": "a" * chars})
+    conn.request("POST", "/api/type", body=body, headers={"Content-Type": "application/json"})
+    conn.getresponse().read()
+    conn.close()
+    results["bulk_s"] = time.perf_counter() - start
+
+
+def _fast_client(port: int, stop: threading.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection(HOST, port, timeout=30)
+            conn.request("GET", "/api/logs")
+            conn.getresponse().read()
+            conn.close()
+        except OSError:
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def bench(port: int, max_connections: int, args) -> dict:
+    """Runs the scenario against a fresh simulated board, returns the fast client latencies (ms) and bulk time"""
+    board = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, os.path.join(os.path.dirname(__file__), "simulator.py"), "--port", str(port),
+         "--max-connections", str(max_connections), "--report-interval", str(args.report_interval)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_listening(port)
+        stop = threading.Event()
+        latencies, results = [], {}
+        threads = [
+            threading.Thread(target=_slow_client, args=(port, args.slow_seconds, stop)) for _ in range(args.slow)
+        ]
+        threads += [threading.Thread(target=_fast_client, args=(port, stop, latencies)) for _ in range(args.fast)]
+        bulk = threading.Thread(target=_bulk_client, args=(port, args.bulk_chars, results))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        bulk.start()
+        time.sleep(args.duration)
+        stop.set()
+        bulk.join()
+        return {
+            "max_connections": max_connections,
+            "requests": len(latencies),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "max_ms": max(latencies) if latencies else float("nan"),
+            "bulk_s": results.get("bulk_s", float("nan")),
+        }
+    finally:
+        board.terminate()
+        board.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--fast", type=int, default=4, help="clients measuring request latency")
+    parser.add_argument("--slow", type=int, default=2, help="clients trickling their requests in")
+    parser.add_argument("--slow-seconds", type=float, default=2.0, help="how long a slow client takes per request")
+    parser.add_argument("--bulk-chars", type=int, default=2000, help="characters typed by the bulk client")
+    parser.add_argument("--report-interval", type=float, default=0.001, help="seconds per simulated HID report")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds to measure for")
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    print(f"{'max_connections':>15} {'requests':>8} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8} {'bulk_s':>7}")
+    for i, max_connections in enumerate(args.connections):
+        row = bench(args.port + i, max_connections, args)
+        print(
+            f"{row['max_connections']:>15} {row['requests']:>8} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+            f"{row['max_ms']:>8.1f} {row['bulk_s']:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Fleet fan-out benchmark, run against simulated boards (see simulator.py).
+
+For each fleet size, that many simulated boards are started and the same text is typed on all of them, `rounds`
+times: one board after the other with PyHIDClient, then fanned out with the fleet controller at each max_parallel
+setting. A board that is not listening (a dead port) is added to the fleet to show it only costs its own timeout.
+
+    python host/bench_fleet.py --boards 1 8 32 --max-parallel 4 32
+"""
+
+import argparse
+import asyncio
+import time
+
+from pyhid_client import PyHIDClient
+from pyhid_client.fleet import Fleet, simulated_fleet, summarise
+
+
+def _sequential(inventory: list, text: str, rounds: int) -> float:
+    """Types on one board after the other, returns the mean time per round (ms)"""
+    clients = [PyHIDClient(board["host"], board["port"]) for board in inventory]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for client in clients:
+            client.type(text, caps_lock=False)
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+    return elapsed * 1000 / rounds
+
+
+async def _fan_out(inventory: list, text: str, rounds: int, max_parallel: int, timeout: float) -> tuple:
+    """Types on every board at once, returns (mean time per round (ms), summary of the last round)"""
+    fleet = Fleet.from_inventory(inventory, max_parallel=max_parallel, timeout=timeout, retries=0)
+    await fleet.type(text)  # compile the text and open the connections, as a long running controller would have
+    start = time.perf_counter()
+    for _ in range(rounds):
+        round_start = time.perf_counter()
+        results = await fleet.type(text)
+    summary = summarise(results, (time.perf_counter() - round_start) * 1000)
+    elapsed = time.perf_counter() - start
+    fleet.close()
+    return elapsed * 1000 / rounds, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boards", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-parallel", type=int, nargs="+", default=[4, 32])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--chars", type=int, default=200, help="characters typed per round")
+    parser.add_argument("--report-interval", type=float, default=0.0005, help="seconds per simulated HID report")
+    parser.add_argument("--timeout", type=float, default=1.0, help="per board timeout")
+    parser.add_argument("--base-port", type=int, default=18800)
+    args = parser.parse_args()
+    text = ("pyHID fleet " * (args.chars // 12 + 1))[:args.chars]
+
+    print(f"{'boards':>6} {'mode':>16} {'round_ms':>9} {'ok':>4} {'failed':>6} {'p50_ms':>8} {'p95_ms':>8}")
+    for count in args.boards:
+        with simulated_fleet(count, args.base_port, args.report_interval) as inventory:
+            print(f"{count:>6} {'sequential':>16} {_sequential(inventory, text, args.rounds):>9.1f}")
+            for max_parallel in args.max_parallel:
+                round_ms, summary = asyncio.run(_fan_out(inventory, text, args.rounds, max_parallel, args.timeout))
+                print(
+                    f"{count:>6} {f'parallel={max_parallel}':>16} {round_ms:>9.1f} {summary['ok']:>4} "
+                    f"{summary['failed']:>6} {summary['p50_ms']:>8} {summary['p95_ms']:>8}"
+                )
+            dead = inventory + [{"name": "dead", "host": "10.255.255.1", "port": 80}]
+            round_ms, summary = asyncio.run(_fan_out(dead, text, 1, max(args.max_parallel), args.timeout))
+            print(
+                f"{count:>6} {'+1 unreachable':>16} {round_ms:>9.1f} {summary['ok']:>4} {summary['failed']:>6} "
+                f"{summary['p50_ms']:>8} {summary['p95_ms']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
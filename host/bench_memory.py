@@ -0,0 +1,386 @@
+"""
+Per-endpoint memory harness: how many bytes each route of src/code.py allocates per request, on CPython.
+
+The real code.py is booted in this process on the simulated CircuitPython modules (see simulator.py), with a fake
+socket pool in place of the network, and stopped just before its main loop. Requests are then fed through the
+server's poll() as code.py's loop would, one at a time, and measured with tracemalloc:
+
+  - peak: the most memory allocated at once while the request was read, handled, its HID job run and the response
+    sent, over what was allocated before it,
+  - retained: what is still allocated after it (and a gc.collect()),
+  - growth: in a separate run of --iterations requests (after --warmup ones), how much memory grows per request.
+    Anything above zero is a leak, or a cache that never stops growing.
+
+gc.mem_free() is emulated as --heap-cap minus the memory allocated since boot, so the HID queue's admission control
+(min_free_memory) sees a board with that much heap, and rows whose peak goes over it are flagged.
+
+The numbers are CPython's object sizes, larger than CircuitPython's, so compare them between commits rather than
+with a board's free heap: save a run with --json and pass it to --compare on the next one, which prints the changes
+and exits with status 1 if anything grew by more than --tolerance or started leaking.
+
+    python host/bench_memory.py
+    python host/bench_memory.py --sizes 16 4096 --iterations 5000 --json memory.json
+    python host/bench_memory.py --compare memory.json
+
+job_events follows a detached /api/type job from its 202 to the done event, the typing included. hard_reset and
+disable_boot_keyboard are left out, they reset the board or change its USB devices.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from array import array
+from collections import deque
+from errno import EAGAIN
+
+from simulator import SRC_DIR, install_simulated_modules, prepare_device_dir
+
+SKIPPED = ("hard_reset", "disable_boot_keyboard")
+# growth per request (bytes) reported as a leak, and the change in peak/retained bytes --compare lets through on top
+# of --tolerance, what comes and goes with the app's bounded state (the last few jobs, dicts being resized)
+LEAK_BYTES = 1.0
+SLACK_BYTES = 256
+_TEXT = "The quick brown fox jumps over the lazy dog. "
+_RECORDS = (bytes((0, 0, 0, 0, 4, 0, 0, 0, 0, 0)), bytes(10))  # "a" pressed, released
+_SCRIPT = b"PHB1\x00\x01"  # a script (see src/lib/hid_script.py) of a single TEXT op, default layout
+
+
+def _text(size: int) -> str:
+    return (_TEXT * (size // len(_TEXT) + 1))[:size]
+
+
+# endpoint name -> (body for a payload size, None for a GET, whether the size matters, is the body binary)
+CASES = {
+    "type": (lambda size: {"data": _text(size)}, True, False),
+    "type_keycodes": (lambda size: {"data": ["A"] * size, "separate": True}, True, False),
+    "raw_reports": (lambda size: b"".join(_RECORDS[i % 2] for i in range(size)), True, True),
+    "script": (lambda size: _SCRIPT + size.to_bytes(2, "little") + _text(size).encode(), True, True),
+    "keys_press": (lambda size: {"data": ["SHIFT", "W"]}, False, False),
+    "keys_release": (lambda size: {}, False, False),
+    "pointer": (lambda size: {"x": 0.5, "y": 0.25, "click": "LEFT"}, False, False),
+    "server_timing": (lambda size: {"enabled": False}, False, False),
+    "logs": (None, False, False),
+    "startup_profile": (None, False, False),
+    "watchdog": (None, False, False),
+    "queue": (None, False, False),
+    "clock": (None, False, False),
+    "keys": (None, False, False),
+    "leds": (None, False, False),
+    "reload_config": (None, False, False),
+    "health": (None, False, False),
+    "job_events": (None, False, False),
+    # last, recording adds its own cost to every request
+    "session_record": (lambda size: {"record": True}, False, False),
+    "session": (None, False, False),
+}
+# endpoint name -> the (endpoint, body) of the request detached with ?detach=1 before each of its requests, whose job
+# it is then given as ?job=
+FOLLOWS = {"job_events": ("type", {"data": _text(16)})}
+
+
+class _Booted(Exception):
+    """Raised by the server's start(), stops code.py before its main loop"""
+
+
+class _FakeConnection:
+    """An accepted connection: hands out the request, counts the response (only its status line is kept)"""
+
+    def __init__(self, request: bytes, keep_response: bool = False):
+        self._request = memoryview(request)
+        self._offset = 0
+        self.status = b""
+        self.response = bytearray() if keep_response else None
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        """Returns as much of the request as fits, then EAGAIN as the client waits for the response"""
+        length = min(nbytes or len(buffer), len(self._request) - self._offset)
+        if not length:
+            raise OSError(EAGAIN, "EAGAIN")
+        buffer[:length] = self._request[self._offset:self._offset + length]
+        self._offset += length
+        return length
+
+    def send(self, data) -> int:
+        """Takes the whole buffer"""
+        if not self.status:
+            self.status = bytes(data[9:12])
+        if self.response is not None:
+            self.response += data
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeSocketPool:
+    """Takes the place of socketpool: the listening socket accepts the connections queued in `pending`"""
+
+    AF_INET = 2
+    SOCK_STREAM = 1
+
+    def __init__(self):
+        self.pending = deque()
+
+    def getaddrinfo(self, host: str, port: int) -> list:
+        return [(self.AF_INET, self.SOCK_STREAM, 0, "", (host, port))]
+
+    def socket(self, *args):  # pylint: disable=unused-argument
+        return self
+
+    def bind(self, address):
+        pass
+
+    def listen(self, backlog: int):
+        pass
+
+    def setblocking(self, flag: bool):
+        pass
+
+    def close(self):
+        pass
+
+    def accept(self):
+        if not self.pending:
+            raise OSError(EAGAIN, "EAGAIN")
+        return self.pending.popleft(), ("127.0.0.1", 50000)
+
+
+class Board:
+    """code.py booted in this process, ready to be sent requests"""
+
+    def __init__(self, heap_cap: int):
+        self.heap_cap = heap_cap
+        self.pool = _FakeSocketPool()
+        device_dir = tempfile.mkdtemp(prefix="pyhid-memory-")
+        prepare_device_dir(device_dir, 80, {"absolute_mouse": True, "max_connections": 4, "keep_alive_timeout": 0})
+        devices = install_simulated_modules(absolute_mouse=True)
+        for device in devices:
+            device.reports = deque(maxlen=1)  # only the last report, the simulated Caps Lock LED looks at it
+        gc.mem_free = self._mem_free
+        self.namespace = self._boot(device_dir)
+        self.server = self.namespace["server"]
+        self.endpoints = self.namespace["API_ENDPOINTS"]
+        self._key_state = self.namespace["KEY_STATE"]
+        self._get_keyboard = self.namespace["get_keyboard"]
+
+    def _mem_free(self) -> int:
+        return self.heap_cap - tracemalloc.get_traced_memory()[0]
+
+    def _boot(self, device_dir: str) -> dict:
+        import create_server
+        from concurrent_server import ConcurrentServer
+
+        class _HarnessServer(ConcurrentServer):
+            def start(self, host: str, port: int = 80):
+                super().start(host, port)
+                raise _Booted()
+
+        def get_server(config_file_path: str, static_file_path: str = "/static", debug: bool = False,
+                       max_connections: int = 1, keep_alive_timeout: float = 0) -> tuple:
+            # pylint: disable=unused-argument
+            server = _HarnessServer(
+                self.pool, static_file_path, debug=debug, max_connections=max_connections,
+                keep_alive_timeout=keep_alive_timeout,
+            )
+            return server, "127.0.0.1"
+
+        create_server.SUPPORTED_DEVICES["host"] = get_server
+        os.chdir(device_dir)
+        code_path = os.path.join(SRC_DIR, "code.py")
+        with open(code_path, encoding="utf-8") as code_file:
+            code = compile(code_file.read(), code_path, "exec")
+        namespace = {"__name__": "__main__", "__file__": code_path}
+        try:
+            exec(code, namespace)  # pylint: disable=exec-used
+        except _Booted:
+            pass
+        return namespace
+
+    def request(self, raw: bytes) -> int:
+        """Sends a raw HTTP request, polling as code.py's loop does until it has been answered. Returns the status."""
+        conn = _FakeConnection(raw)
+        self.pool.pending.append(conn)
+        while not conn.closed:
+            self.server.poll()
+            self._key_state.poll(self._get_keyboard)
+        return int(conn.status or 0)
+
+    def detach(self, raw: bytes) -> int:
+        """Sends a raw HTTP request with ?detach=1 in its path, returns the id of the job it queued"""
+        conn = _FakeConnection(raw, keep_response=True)
+        self.pool.pending.append(conn)
+        while not conn.closed:
+            self.server.poll()
+        return json.loads(conn.response[conn.response.find(b"\r\n\r\n") + 4:])["job"]
+
+
+def raw_request(method: str, path: str, body, binary: bool) -> bytes:
+    """An HTTP request as a client would send it"""
+    if body is None:
+        return f"{method} {path} HTTP/1.1\r\nHost: pyhid\r\nConnection: close\r\n\r\n".encode()
+    body = body if binary else json.dumps(body).encode()
+    content_type = "application/octet-stream" if binary else "application/json"
+    headers = (
+        f"{method} {path} HTTP/1.1\r\nHost: pyhid\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    )
+    return headers.encode() + body
+
+
+def measure(board: Board, raw: bytes, repeat: int, prepare=None) -> dict:
+    """
+    Sends raw `repeat` times, returns the status, the largest peak allocation and the smallest retained one: a leak
+    retains memory every time, caches only some of the time (CPython's type attribute cache, for one, keeps the
+    names getattr looked up until they are pushed out). If given, prepare() is called (unmeasured) before every
+    request and returns the request to send in place of raw.
+    """
+    result = {"status": None, "peak": 0, "retained": None}
+    for _ in range(repeat):
+        if prepare is not None:
+            raw = prepare()
+        gc.collect()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result["status"] = board.request(raw)
+        peak = tracemalloc.get_traced_memory()[1]
+        gc.collect()
+        result["peak"] = max(result["peak"], peak - before)
+        retained = tracemalloc.get_traced_memory()[0] - before
+        result["retained"] = retained if result["retained"] is None else min(result["retained"], retained)
+    return result
+
+
+def growth(  # pylint: disable=too-many-arguments
+    board: Board, raw: bytes, warmup: int, iterations: int, *, samples: int = 40, prepare=None,
+) -> float:
+    """
+    Bytes of memory growth per request over `iterations` requests, after `warmup` requests. Memory is sampled every
+    iterations / samples requests, and the lowest sample of the first quarter compared with the lowest of the last:
+    what the app keeps for a while (the last few jobs, a dict before it is resized) makes memory go up and down by
+    more than a small leak adds in a few thousand requests. prepare is as for measure, counted in the growth.
+    """
+    for _ in range(warmup):
+        board.request(raw if prepare is None else prepare())
+    every = max(1, iterations // samples)
+    memory = array("q", bytes(8 * samples))  # preallocated, so the samples themselves do not show up
+    for sample in range(samples):
+        for _ in range(every):
+            board.request(raw if prepare is None else prepare())
+        gc.collect()
+        memory[sample] = tracemalloc.get_traced_memory()[0]
+    quarter = max(1, samples // 4)
+    first, last = min(memory[:quarter]), min(memory[-quarter:])
+    return (last - first) / ((samples - quarter) * every)
+
+
+def _follow(board: Board, path: str, detached: str, body: dict):
+    """Returns the prepare() for an endpoint following a job: it detaches a job, the request then follows it"""
+    detach = raw_request("POST", board.endpoints[detached] + "?detach=1", body, False)
+    return lambda: raw_request("GET", f"{path}?job={board.detach(detach)}", None, False)
+
+
+def run(args) -> list:
+    """Measures every endpoint, returns the rows of the table"""
+    board = Board(args.heap_cap)
+    tracemalloc.start()
+    rows = []
+    for name, (make_body, sized, binary) in CASES.items():
+        if args.endpoint and name not in args.endpoint:
+            continue
+        method = "GET" if make_body is None else "POST"
+        path = board.endpoints[name]
+        prepare = _follow(board, path, *FOLLOWS[name]) if name in FOLLOWS else None
+        for size in args.sizes if sized else (None,):
+            body = None if make_body is None else make_body(size or 0)
+            raw = raw_request(method, path, body, binary) if prepare is None else prepare()
+            row = {"endpoint": name, "method": method, "size": size, "request_bytes": len(raw)}
+            row.update(measure(board, raw, args.repeat, prepare))
+            row["growth"] = None
+            if size == (args.sizes[0] if sized else None) and args.iterations:
+                row["growth"] = round(growth(board, raw, args.warmup, args.iterations, prepare=prepare), 2)
+            row["over_cap"] = row["peak"] > args.heap_cap
+            rows.append(row)
+    tracemalloc.stop()
+    return rows
+
+
+def _key(row: dict) -> tuple:
+    return row["endpoint"], row["size"]
+
+
+def print_table(rows: list, baseline: list = None):
+    """Prints the rows, with the change from baseline's (same endpoint and size) if given"""
+    before = {_key(row): row for row in baseline or ()}
+    print(f"{'endpoint':<16} {'method':<6} {'size':>6} {'req_B':>7} {'status':>6} {'peak_B':>9} {'retained_B':>10} "
+          f"{'growth_B/req':>12}")
+    for row in rows:
+        growth_text = "-" if row["growth"] is None else f"{row['growth']:.2f}"
+        line = (
+            f"{row['endpoint']:<16} {row['method']:<6} {row['size'] if row['size'] is not None else '-':>6} "
+            f"{row['request_bytes']:>7} {row['status']:>6} {row['peak']:>9} {row['retained']:>10} {growth_text:>12}"
+        )
+        old = before.get(_key(row))
+        if old:
+            line += f"  peak {row['peak'] - old['peak']:+d}, retained {row['retained'] - old['retained']:+d}"
+        if row["over_cap"]:
+            line += "  OVER HEAP CAP"
+        print(line)
+
+
+def regressions(rows: list, baseline: list, tolerance: float) -> list:
+    """Describes every row whose peak or retained memory grew by more than tolerance (a fraction), or that leaks"""
+    before = {_key(row): row for row in baseline}
+    problems = []
+    for row in rows:
+        old = before.get(_key(row))
+        if old is None:
+            continue
+        for field in ("peak", "retained"):
+            if row[field] > old[field] * (1 + tolerance) + SLACK_BYTES:
+                problems.append(f"{row['endpoint']} ({row['size']}): {field} {old[field]} -> {row[field]} bytes")
+        if (row["growth"] or 0) > LEAK_BYTES >= (old["growth"] or 0):
+            problems.append(f"{row['endpoint']}: grows by {row['growth']} bytes per request")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 256, 2048],
+                        help="payload sizes (characters, key combos or records) for the endpoints that take them")
+    parser.add_argument("--endpoint", nargs="+", choices=list(CASES), help="only these endpoints")
+    parser.add_argument("--repeat", type=int, default=3, help="requests per row, the largest allocations are kept")
+    parser.add_argument("--iterations", type=int, default=5000, help="requests in the growth run, 0 to skip it")
+    parser.add_argument("--warmup", type=int, default=500, help="requests before the growth run")
+    parser.add_argument("--heap-cap", type=int, default=64 * 1024, help="emulated free heap after boot (bytes)")
+    parser.add_argument("--json", help="save the rows here")
+    parser.add_argument("--compare", help="rows saved by an earlier run, to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="growth allowed by --compare (fraction)")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    rows = run(args)
+    os.chdir(cwd)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    print_table(rows, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as rows_file:
+            json.dump(rows, rows_file, indent=1)
+    problems = regressions(rows, baseline, args.tolerance) if baseline else []
+    for problem in problems:
+        print("REGRESSION", problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
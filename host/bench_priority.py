@@ -0,0 +1,150 @@
+"""
+Key combo latency while a bulk paste is being typed, run against simulated boards (see simulator.py).
+
+For each priority_combos setting a simulated board is started, a `bulk` client types a long string through
+/api/type and meanwhile a combo client sends ESCAPE through /api/keycodes every `interval` seconds, recording how
+long each request takes. Afterwards the recorded HID reports are checked: every combo must have been pressed with
+no other key held down, and the paste must have been typed completely and in order.
+
+    python host/bench_priority.py --priority-combos 0 4
+
+Exits with status 1 if any row has problems: a board that did not start, a paste that failed or typed nothing, no
+combo sent while it was typed, or combos and paste getting in each other's way.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from simulator import wait_until_listening
+
+HOST = "127.0.0.1"
+ESCAPE = 0x29
+KEY_A = 0x04
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _post(port: int, path: str, body: dict, timeout: float = 120) -> float:
+    """POSTs body as json, returns the time taken in ms"""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(HOST, port, timeout=timeout)
+    conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"{path} returned {response.status}")
+    return (time.perf_counter() - start) * 1000
+
+
+def _reports(port: int) -> list:
+    conn = http.client.HTTPConnection(HOST, port, timeout=30)
+    conn.request("GET", "/sim/reports")
+    reports = json.loads(conn.getresponse().read())["reports"]
+    conn.close()
+    return [bytes.fromhex(report) for device, _, report in reports if device == "keyboard"]
+
+
+def check_reports(reports: list, chars: int, combos: int) -> list:
+    """Returns a list of problems found in the keyboard reports, empty if the combos never overlapped the paste"""
+    problems = []
+    escapes = typed = 0
+    for report in reports:
+        keys = [key for key in report[2:] if key]
+        if ESCAPE in keys:
+            escapes += 1
+            if keys != [ESCAPE] or report[0]:
+                problems.append(f"combo pressed along with other keys: {report.hex()}")
+        elif KEY_A in keys:
+            typed += 1
+    if not combos:
+        problems.append("no combos sent while the paste was typed")
+    if escapes != combos:
+        problems.append(f"{escapes} combos pressed, {combos} sent")
+    if not typed or typed != chars:
+        problems.append(f"{typed} characters typed, {chars} sent")
+    return problems
+
+
+def bench(port: int, priority_combos: int, args) -> dict:
+    """Runs the scenario against a fresh simulated board, returns the combo latencies (ms) and paste time"""
+    board = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, os.path.join(os.path.dirname(__file__), "simulator.py"), "--port", str(port),
+         "--max-connections", "4", "--report-interval", str(args.report_interval),
+         "--config", json.dumps({"defaults": {"priority_combos": priority_combos}})],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_listening(port)
+        results = {}
+
+        def _bulk():
+            try:
+                results["bulk_ms"] = _post(port, "/api/type", {"data": "a" * args.bulk_chars})
+            except (OSError, RuntimeError, http.client.HTTPException) as error:
+                results["bulk_error"] = f"paste failed: {error}"
+
+        bulk = threading.Thread(target=_bulk)
+        bulk.start()
+        latencies = []
+        time.sleep(args.interval)
+        while bulk.is_alive() and len(latencies) < args.combos:
+            latencies.append(_post(port, "/api/keycodes", {"data": ["ESCAPE"]}))
+            time.sleep(args.interval)
+        bulk.join()
+        problems = check_reports(_reports(port), args.bulk_chars, len(latencies))
+        if "bulk_error" in results:
+            problems.insert(0, results["bulk_error"])
+        return {
+            "priority_combos": priority_combos,
+            "combos": len(latencies),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "max_ms": max(latencies) if latencies else float("nan"),
+            "bulk_s": results.get("bulk_ms", float("nan")) / 1000,
+            "problems": problems,
+        }
+    finally:
+        board.terminate()
+        board.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--priority-combos", type=int, nargs="+", default=[0, 4])
+    parser.add_argument("--bulk-chars", type=int, default=2000, help="characters typed by the bulk client")
+    parser.add_argument("--combos", type=int, default=10, help="combos sent during the paste, at most")
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between combos")
+    parser.add_argument("--report-interval", type=float, default=0.001, help="seconds per simulated HID report")
+    parser.add_argument("--port", type=int, default=18100)
+    args = parser.parse_args()
+
+    print(f"{'priority_combos':>15} {'combos':>6} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8} {'bulk_s':>7}  problems")
+    failed = False
+    for i, priority_combos in enumerate(args.priority_combos):
+        try:
+            row = bench(args.port + i, priority_combos, args)
+        except (OSError, RuntimeError, http.client.HTTPException) as error:
+            row = {"priority_combos": priority_combos, "combos": 0, "bulk_s": float("nan"), "problems": [str(error)]}
+            row["p50_ms"] = row["p95_ms"] = row["max_ms"] = float("nan")
+        failed = failed or bool(row["problems"])
+        print(
+            f"{row['priority_combos']:>15} {row['combos']:>6} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+            f"{row['max_ms']:>8.1f} {row['bulk_s']:>7.2f}  {'; '.join(row['problems']) or 'none'}"
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Start skew benchmark for scheduled jobs, run against simulated boards (see simulator.py).
+
+Each simulated board's clock is set ahead of the host's by a random offset (up to --max-offset seconds). The same key
+combo is then sent to every board `rounds` times: fanned out as soon as possible, and scheduled with execute_at
+--in-ms ahead after syncing the boards' clocks. The skew of a round is the time between the first and the last
+board's first HID report, taken from the simulators' own report timestamps (host time), so it does not rely on
+the boards' clocks or on the offset estimates.
+
+    python host/bench_sync.py --boards 4 16 --rounds 10
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from pyhid_client.fleet import Fleet, simulated_fleet, summarise
+
+COMBO = ["CONTROL", "ALT", "F1"]
+
+
+async def _first_reports(fleet: Fleet) -> list:
+    """Returns each board's first recorded report time (host ns) since the last call"""
+    results = await fleet.get("/sim/reports")
+    return [result.body["reports"][0][1] for result in results if result.ok and result.body["reports"]]
+
+
+async def _round(fleet: Fleet, in_ms: float) -> tuple:
+    """Sends the combo to every board, returns (skew from report timestamps (ms), skew from started_ns (ms))"""
+    await _first_reports(fleet)
+    at = None if in_ms is None else time.monotonic_ns() + int(in_ms * 1_000_000)
+    results = await fleet.keycodes([COMBO], at=at)
+    if not all(result.ok for result in results):
+        raise RuntimeError([result.as_dict() for result in results if not result.ok])
+    first = await _first_reports(fleet)
+    return (max(first) - min(first)) / 1_000_000, summarise(results)["skew_ms"]
+
+
+async def _bench(inventory: list, rounds: int, in_ms: float) -> dict:
+    fleet = Fleet.from_inventory(inventory, max_parallel=len(inventory), timeout=in_ms / 1000 + 5)
+    await fleet.keycodes([COMBO])  # open the connections
+    synced = await fleet.sync_clocks()
+    unscheduled = [(await _round(fleet, None))[0] for _ in range(rounds)]
+    scheduled, reported = zip(*[await _round(fleet, in_ms) for _ in range(rounds)])
+    fleet.close()
+    return {
+        "round_trip_us": max(result.body["round_trip_us"] for result in synced),
+        "unscheduled": unscheduled,
+        "scheduled": scheduled,
+        "reported": reported,
+    }
+
+
+def _stats(values) -> str:
+    return f"{statistics.median(values):>8.3f} {max(values):>8.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boards", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--in-ms", type=float, default=200, help="how far ahead scheduled rounds are sent")
+    parser.add_argument("--max-offset", type=float, default=1000.0, help="largest simulated clock offset (s)")
+    parser.add_argument("--base-port", type=int, default=18900)
+    args = parser.parse_args()
+    rng = random.Random(37)
+
+    print(f"{'boards':>6} {'max_rtt_us':>10} {'mode':>12} {'p50_ms':>8} {'max_ms':>8}")
+    for count in args.boards:
+        offsets = [rng.uniform(0, args.max_offset) for _ in range(count)]
+        with simulated_fleet(count, args.base_port, clock_offsets=offsets) as inventory:
+            result = asyncio.run(_bench(inventory, args.rounds, args.in_ms))
+        for mode in ("unscheduled", "scheduled", "reported"):
+            print(f"{count:>6} {result['round_trip_us']:>10} {mode:>12} {_stats(result[mode])}")
+
+
+if __name__ == "__main__":
+    main()
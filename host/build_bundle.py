@@ -0,0 +1,239 @@
+"""
+Builds a deployment bundle of src/ with the lib modules precompiled to .mpy, so the board no longer compiles them
+from source at every boot, and compares start up profiles.
+
+    python host/build_bundle.py build --mpy-cross ~/mpy-cross-9.2 --out build/bundle
+    python host/build_bundle.py build --mpy-cross ~/mpy-cross-9.2 --freeze-config
+    python host/build_bundle.py profile 192.168.1.50 --save mpy.json --compare py.json
+
+build:
+  - only the modules of src/lib that code.py and boot.py import (directly or not, lazily imported layouts
+    included) go in the bundle, the others (the keycode_win_* modules) are left out,
+  - each is compiled with mpy-cross, which has to be the one for the board's CircuitPython version (from
+    https://adafruit-circuitpython.s3.amazonaws.com/index.html?prefix=bin/mpy-cross/), or copied as is with
+    --no-compile. code.py and boot.py stay as source, CircuitPython runs them from source only,
+  - --freeze-config compiles the JSON config files into a frozen_config module read in their place (see
+    lib/config_files.py), and leaves the files out. Changing the config then takes a new bundle,
+    /api/reload_config has nothing new to read.
+Copy the bundle's contents to CIRCUITPY, removing the lib/*.py files it replaces (a .py is imported ahead of the
+.mpy of the same name). adafruit_hid, adafruit_httpserver and config_utils are not part of it, --extra compiles
+more modules or packages into lib (e.g. the submodules' checkouts).
+
+profile: fetches /api/startup, which times each module's import (and each layout's) as a phase of its own, with the
+free heap after it. Save a profile of a board running from source and compare it with one running the bundle.
+"""
+
+import argparse
+import ast
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(HOST_DIR), "src")
+LIB_DIR = os.path.join(SRC_DIR, "lib")
+ENTRY_POINTS = ("code.py", "boot.py")
+CONFIG_DIR = "config"
+STATIC_DIR = "static"  # the web console, see build_console.py
+FROZEN_CONFIG = "frozen_config"
+
+
+def imported_names(path: str) -> set:
+    """Every module name imported anywhere in a source file, inside functions too"""
+    with open(path, encoding="utf-8") as source:
+        tree = ast.parse(source.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+        elif (isinstance(node, ast.Call) and getattr(node.func, "attr", None) == "imports"
+              and node.args and isinstance(node.args[0], ast.Tuple)):
+            # PROFILE.imports((...)) in code.py
+            names.update(arg.value for arg in node.args[0].elts if isinstance(arg, ast.Constant))
+    return names
+
+
+def used_modules(lib_dir: str = LIB_DIR) -> list:
+    """The lib modules code.py and boot.py need, following imports from module to module"""
+    available = {name[:-3] for name in os.listdir(lib_dir) if name.endswith(".py")}
+    pending = [os.path.join(SRC_DIR, name) for name in ENTRY_POINTS]
+    used = set()
+    while pending:
+        for name in imported_names(pending.pop()):
+            module = name.split(".")[0]
+            if module in available and module not in used:
+                used.add(module)
+                pending.append(os.path.join(lib_dir, module + ".py"))
+    return sorted(used)
+
+
+def _compile(mpy_cross: str, source: str, target: str, name: str):
+    if mpy_cross is None:
+        shutil.copyfile(source, target[:-4] + ".py")
+        return
+    result = subprocess.run([mpy_cross, "-o", target, "-s", name, source], capture_output=True, text=True, check=False)
+    if result.returncode:
+        raise SystemExit(f"mpy-cross failed on {source}:\n{result.stderr or result.stdout}")
+
+
+def _extra_sources(path: str):
+    """Yields (source, path within lib) for a module or package to add to the bundle"""
+    if os.path.isfile(path):
+        yield path, os.path.basename(path)
+        return
+    package_parent = os.path.dirname(os.path.abspath(path))
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name.endswith(".py"):
+                source = os.path.join(root, name)
+                yield source, os.path.relpath(source, package_parent)
+
+
+def freeze_config(config_dir: str, target: str):
+    """Writes a module with the contents of every JSON file in config_dir, keyed by their path as code.py uses it"""
+    configs = {}
+    for name in sorted(os.listdir(config_dir)):
+        if name.endswith(".json"):
+            with open(os.path.join(config_dir, name), encoding="utf-8") as config_file:
+                configs[f"{CONFIG_DIR}/{name}"] = json.load(config_file)
+    with open(target, "w", encoding="utf-8") as module:
+        module.write(f'"""Generated by host/build_bundle.py from {CONFIG_DIR}/*.json, edit those and rebuild"""\n\n')
+        module.write(f"CONFIGS = {configs!r}\n")
+
+
+def build(args) -> list:
+    """Builds the bundle in args.out, returns a row (module, source bytes, bundled bytes) per bundled lib file"""
+    mpy_cross = None
+    if not args.no_compile:
+        mpy_cross = shutil.which(args.mpy_cross)
+        if mpy_cross is None:
+            raise SystemExit(f"{args.mpy_cross} not found, pass --mpy-cross (or --no-compile to copy sources)")
+        version = subprocess.run([mpy_cross, "--version"], capture_output=True, text=True, check=False)
+        print(version.stdout.strip() or version.stderr.strip())
+    if os.path.exists(args.out):
+        shutil.rmtree(args.out)
+    out_lib = os.path.join(args.out, "lib")
+    os.makedirs(out_lib)
+    for name in ENTRY_POINTS:
+        shutil.copyfile(os.path.join(SRC_DIR, name), os.path.join(args.out, name))
+    shutil.copytree(os.path.join(SRC_DIR, "boot_kbd"), os.path.join(args.out, "boot_kbd"))
+    if os.path.isdir(os.path.join(SRC_DIR, STATIC_DIR)):
+        shutil.copytree(os.path.join(SRC_DIR, STATIC_DIR), os.path.join(args.out, STATIC_DIR))
+
+    sources = [(os.path.join(LIB_DIR, module + ".py"), module + ".py") for module in used_modules()]
+    if args.freeze_config:
+        frozen = os.path.join(args.out, FROZEN_CONFIG + ".py")
+        freeze_config(os.path.join(SRC_DIR, CONFIG_DIR), frozen)
+        sources.append((frozen, FROZEN_CONFIG + ".py"))
+    else:
+        shutil.copytree(os.path.join(SRC_DIR, CONFIG_DIR), os.path.join(args.out, CONFIG_DIR))
+    for extra in args.extra or ():
+        sources.extend(_extra_sources(extra))
+
+    rows = []
+    for source, relative in sources:
+        target = os.path.join(out_lib, relative[:-3] + ".mpy")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _compile(mpy_cross, source, target, relative)
+        bundled = target if mpy_cross else target[:-4] + ".py"
+        rows.append((relative, os.path.getsize(source), os.path.getsize(bundled)))
+    if args.freeze_config:
+        os.remove(frozen)
+    return rows
+
+
+def _print_build(rows: list, skipped: list):
+    print(f"{'module':<32} {'source_B':>9} {'bundled_B':>9}")
+    for relative, source_size, bundled_size in rows:
+        print(f"{relative:<32} {source_size:>9} {bundled_size:>9}")
+    print(f"{'total':<32} {sum(row[1] for row in rows):>9} {sum(row[2] for row in rows):>9}")
+    print("left out:", ", ".join(skipped) or "nothing")
+
+
+def fetch_profile(host: str, port: int) -> list:
+    """The board's start up phases, from /api/startup"""
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.request("GET", "/api/startup")
+    response = conn.getresponse()
+    body = json.loads(response.read())
+    conn.close()
+    if response.status != 200:
+        raise SystemExit(f"/api/startup returned {response.status}: {body}")
+    return body["phases"]
+
+
+def _heap_used(phases: list) -> dict:
+    """phase -> heap it took (the drop in free heap over it), None where the board does not report free heap"""
+    used, previous = {}, None
+    for phase in phases:
+        free = phase["mem_free"]
+        used[phase["phase"]] = previous - free if previous is not None and free is not None else None
+        previous = free
+    return used
+
+
+def print_profile(phases: list, baseline: list = None):
+    """Prints each phase's time and heap, next to the baseline's if given"""
+    used = _heap_used(phases)
+    old = {phase["phase"]: phase for phase in baseline or ()}
+    old_used = _heap_used(baseline or [])
+
+    def _num(value, digits: int = 1) -> str:
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    header = f"{'phase':<34} {'ms':>8} {'heap_B':>8} {'free_B':>8}"
+    print(header + (f" {'base_ms':>8} {'base_heap_B':>11}" if baseline else ""))
+    for phase in phases:
+        name = phase["phase"]
+        line = f"{name:<34} {phase['ms']:>8.1f} {_num(used[name], 0):>8} {_num(phase['mem_free'], 0):>8}"
+        if baseline:
+            line += f" {_num(old.get(name, {}).get('ms')):>8} {_num(old_used.get(name), 0):>11}"
+        print(line)
+    last = phases[-1] if phases else None
+    if last:
+        summary = f"total {last['at_ms']:.1f} ms to {last['phase']}, {_num(last['mem_free'], 0)} B free"
+        if baseline:
+            summary += f" (baseline {baseline[-1]['at_ms']:.1f} ms, {_num(baseline[-1]['mem_free'], 0)} B free)"
+        print(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="build a bundle")
+    build_parser.add_argument("--out", default=os.path.join("build", "bundle"))
+    build_parser.add_argument("--mpy-cross", default="mpy-cross", help="the board's CircuitPython version's mpy-cross")
+    build_parser.add_argument("--no-compile", action="store_true", help="copy the sources rather than compiling them")
+    build_parser.add_argument("--freeze-config", action="store_true", help="compile the JSON configs into a module")
+    build_parser.add_argument("--extra", nargs="+", help="more modules or packages to compile into lib")
+    profile_parser = commands.add_parser("profile", help="show a board's start up profile")
+    profile_parser.add_argument("host")
+    profile_parser.add_argument("--port", type=int, default=80)
+    profile_parser.add_argument("--save", help="save the profile here")
+    profile_parser.add_argument("--compare", help="a saved profile to show alongside")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        rows = build(args)
+        used = set(used_modules())
+        skipped = sorted(name[:-3] for name in os.listdir(LIB_DIR) if name.endswith(".py") and name[:-3] not in used)
+        _print_build(rows, skipped)
+        return
+    phases = fetch_profile(args.host, args.port)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as profile_file:
+            baseline = json.load(profile_file)
+    print_profile(phases, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as profile_file:
+            json.dump(phases, profile_file, indent=1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Builds the web console (host/console) into the board's static directory (src/static): every asset gzipped, and a
+manifest.json that lib/static_files.py serves them from (see there).
+
+    python host/build_console.py                  # writes src/static
+    python host/build_console.py --out build/static
+
+The assets the page loads are referenced as name?v=<etag>, so browsers can cache them for a year and still pick up
+a new build, the page itself is revalidated (a 304 while unchanged). The output only changes with the sources
+(gzip timestamps are zeroed), rebuild and commit it together with them.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+CONSOLE_DIR = os.path.join(HOST_DIR, "console")
+STATIC_DIR = os.path.join(os.path.dirname(HOST_DIR), "src", "static")
+PAGE = "index.html"
+CONTENT_TYPES = {".html": "text/html", ".js": "text/javascript", ".css": "text/css", ".svg": "image/svg+xml"}
+PAGE_CACHE = "no-cache"
+ASSET_CACHE = "public, max-age=31536000, immutable"
+
+
+def _gzip(data: bytes) -> tuple:
+    """(gzipped data, strong ETag of it)"""
+    packed = gzip.compress(data, compresslevel=9, mtime=0)
+    return packed, '"' + hashlib.sha256(packed).hexdigest()[:16] + '"'
+
+
+def _versioned(page: str, etags: dict) -> str:
+    """The page with every src="asset"/href="asset" it loads pointed at asset?v=<etag>"""
+    def version(match):
+        name = match.group(2)
+        if name not in etags:
+            return match.group(0)
+        return f'{match.group(1)}="{name}?v={etags[name].strip(chr(34))}"'
+    return re.sub(r'\b(src|href)="([^"?#:]+)"', version, page)
+
+
+def build(out: str) -> list:
+    """Writes the gzipped console and its manifest to out, returns a row (file, source bytes, gzipped bytes) each"""
+    assets = sorted(name for name in os.listdir(CONSOLE_DIR) if name != PAGE)
+    unknown = [name for name in assets if os.path.splitext(name)[1] not in CONTENT_TYPES]
+    if unknown:
+        raise SystemExit(f"No content type for {unknown}, add it to CONTENT_TYPES")
+    os.makedirs(out, exist_ok=True)
+    for name in os.listdir(out):
+        if name.endswith(".gz"):
+            os.remove(os.path.join(out, name))
+
+    files, etags, rows = {}, {}, []
+
+    def write(name: str, data: bytes, url_paths: tuple, cache: str):
+        packed, etag = _gzip(data)
+        with open(os.path.join(out, name + ".gz"), "wb") as target:
+            target.write(packed)
+        entry = {"file": name + ".gz", "type": CONTENT_TYPES[os.path.splitext(name)[1]], "etag": etag, "cache": cache}
+        for url_path in url_paths:
+            files[url_path] = entry
+        etags[name] = etag
+        rows.append((name, len(data), len(packed)))
+
+    for name in assets:
+        with open(os.path.join(CONSOLE_DIR, name), "rb") as source:
+            write(name, source.read(), ("/" + name,), ASSET_CACHE)
+    with open(os.path.join(CONSOLE_DIR, PAGE), encoding="utf-8") as source:
+        write(PAGE, _versioned(source.read(), etags).encode(), ("/", "/" + PAGE), PAGE_CACHE)
+    with open(os.path.join(out, "manifest.json"), "w", encoding="utf-8") as manifest:
+        json.dump({"files": dict(sorted(files.items()))}, manifest, indent=4)
+        manifest.write("\n")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=STATIC_DIR, help="the board's static directory")
+    args = parser.parse_args()
+    rows = build(args.out)
+    print(f"{'file':<20} {'source_B':>9} {'gzip_B':>9}")
+    for name, source_size, packed_size in rows:
+        print(f"{name:<20} {source_size:>9} {packed_size:>9}")
+    print(f"{'total':<20} {sum(row[1] for row in rows):>9} {sum(row[2] for row in rows):>9}")
+
+
+if __name__ == "__main__":
+    main()
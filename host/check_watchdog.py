@@ -0,0 +1,110 @@
+"""
+Checks the watchdog on a simulated board (see simulator.py): a request is stalled for longer than the watchdog
+timeout (GET /sim/stall), the board has to reset and come back, and /api/watchdog then has to report what it was
+doing.
+
+    RAISE mode  the breadcrumb is persisted to nvm before the reset, last_stall is the stalled route and phase
+    RESET mode  the hardware resets the board straight away, only the reset reason says why
+
+    python host/check_watchdog.py
+    python host/check_watchdog.py --timeout 2 --mode raise
+
+The board is waited on for up to --startup seconds, at boot and again after the reset, retrying until it answers
+(a loaded machine can take a while to import everything), and given up on at once if the simulator exits. Exits with
+status 1 if the board did not start, did not reset or reported something else.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from simulator import wait_until_listening
+
+HOST = "127.0.0.1"
+STALL = "/sim/stall"
+
+
+def _get(port: int, path: str, timeout: float = 30) -> dict:
+    conn = http.client.HTTPConnection(HOST, port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def _expected(mode: str) -> dict:
+    if mode == "raise":
+        return {"reset_reason": "SOFTWARE", "last_stall": {"route": STALL, "phase": "handler"}}
+    return {"reset_reason": "WATCHDOG", "last_stall": None}
+
+
+def _wait_for_board(board: subprocess.Popen, port: int, startup: float) -> str:
+    """Waits for the simulated board to answer, returns why it did not within `startup` seconds, None if it did"""
+    deadline = time.monotonic() + startup
+    while time.monotonic() < deadline:
+        if board.poll() is not None:
+            return f"the simulator exited with status {board.returncode}"
+        try:
+            wait_until_listening(port, timeout=min(1.0, max(0.1, deadline - time.monotonic())))
+            return None
+        except TimeoutError:
+            pass
+    return f"the board did not answer on port {port} within {startup} s"
+
+
+def check(port: int, mode: str, timeout: float, startup: float = 30) -> list:
+    """Stalls a simulated board in `mode`, returns what /api/watchdog got wrong after the reset, if anything"""
+    config = {"watchdog": {"timeout": timeout, "mode": mode}}
+    with tempfile.TemporaryDirectory(prefix="pyhid-watchdog-") as device_dir:
+        board = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, os.path.join(os.path.dirname(__file__), "simulator.py"), "--port", str(port),
+             "--config", json.dumps(config), "--device-dir", device_dir],
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            problem = _wait_for_board(board, port, startup)
+            if problem:
+                return [problem]
+            before = _get(port, "/api/watchdog")
+            if not before["enabled"]:
+                return [f"watchdog not enabled: {before}"]
+            try:
+                _get(port, f"{STALL}?seconds={timeout * 4}", timeout=timeout * 8)
+                return ["the stalled request was answered, the watchdog did not fire"]
+            except (OSError, http.client.HTTPException):
+                pass  # the board reset with the request unanswered
+            problem = _wait_for_board(board, port, startup)
+            if problem:
+                return [f"after the reset, {problem}"]
+            after = _get(port, "/api/watchdog")
+        finally:
+            board.terminate()
+            board.wait()
+    return [
+        f"{key}: {after[key]!r}, expected {value!r}" for key, value in _expected(mode).items() if after[key] != value
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", nargs="+", default=["raise", "reset"], choices=["raise", "reset"])
+    parser.add_argument("--timeout", type=float, default=1.0, help="watchdog timeout, seconds")
+    parser.add_argument("--port", type=int, default=18097)
+    parser.add_argument("--startup", type=float, default=30, help="seconds the board has to start (or restart) in")
+    args = parser.parse_args()
+    failed = False
+    for mode in args.mode:
+        problems = check(args.port, mode, args.timeout, args.startup)
+        print(f"{mode:<6} {'ok' if not problems else '; '.join(problems)}")
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+// The board's API paths, as in the "api_endpoints" of pyhid_config.json
+const API = {
+  type: "/api/type",
+  keycodes: "/api/keycodes",
+  pointer: "/api/pointer",
+  health: "/api/health",
+  queue: "/api/queue",
+  leds: "/api/leds",
+};
+const METRICS_INTERVAL_MS = 2000;
+
+const $ = (id) => document.getElementById(id);
+
+function log(message) {
+  const line = `${new Date().toLocaleTimeString()} ${message}\n`;
+  $("log").textContent = (line + $("log").textContent).slice(0, 4000);
+}
+
+async function post(path, body) {
+  try {
+    const response = await fetch(path, {
+      method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify(body),
+    });
+    const result = await response.json();
+    log(`${path} ${response.status} ${result.error || ""}`);
+    return result;
+  } catch (error) {
+    log(`${path} failed: ${error}`);
+    return null;
+  }
+}
+
+function keys(text) {
+  return text.trim().toUpperCase().split(/[\s+]+/).filter(Boolean);
+}
+
+$("type").onclick = () => {
+  const body = { data: $("text").value };
+  if ($("layout").value) body.layout = $("layout").value;
+  if ($("unicode").value) body.unicode = $("unicode").value;
+  post(API.type, body);
+};
+
+for (const button of $("combos").querySelectorAll("button")) {
+  button.onclick = () => post(API.keycodes, { data: keys(button.dataset.keys) });
+}
+$("send-combo").onclick = () => post(API.keycodes, { data: keys($("combo").value) });
+
+function place(event, click) {
+  const pad = $("pad").getBoundingClientRect();
+  const fraction = (value) => Math.min(1, Math.max(0, Math.round(value * 1000) / 1000));
+  const body = {
+    x: fraction((event.clientX - pad.left) / pad.width), y: fraction((event.clientY - pad.top) / pad.height),
+  };
+  if (click) body.click = click;
+  post(API.pointer, body);
+}
+$("pad").onclick = (event) => place(event, "LEFT");
+$("pad").oncontextmenu = (event) => {
+  event.preventDefault();
+  place(event, "RIGHT");
+};
+
+async function getJSON(path) {
+  const response = await fetch(path, { cache: "no-store" });
+  return response.json();
+}
+
+async function refreshMetrics() {
+  try {
+    const [health, queue, leds] = await Promise.all([getJSON(API.health), getJSON(API.queue), getJSON(API.leds)]);
+    $("status").textContent = health.ready ? "ready" : "not ready";
+    $("status").className = health.ready ? "up" : "down";
+    const rows = {
+      "network link": health.link ? "up" : "down",
+      "usb": health.usb ? "connected" : "disconnected",
+      "queue depth": queue.depth,
+      "queued reports": queue.queued_cost,
+      "drain rate": `${queue.drain_rate} reports/s`,
+      "rejected": queue.rejected,
+      "free memory": health.mem_free === null ? "-" : `${health.mem_free} B`,
+      "leds": Object.keys(leds).filter((led) => leds[led] === true).join(", ") || "none",
+    };
+    $("metrics").innerHTML = Object.entries(rows).map(([name, value]) => `<tr><td>${name}</td><td>${value}</td></tr>`)
+      .join("");
+  } catch (error) {
+    $("status").textContent = "unreachable";
+    $("status").className = "down";
+  }
+}
+refreshMetrics();
+setInterval(refreshMetrics, METRICS_INTERVAL_MS);
@@ -0,0 +1,176 @@
+"""
+Decodes HID report descriptors, and reports with them, to check what a board's devices actually send.
+
+By default the absolute pointer's descriptor (src/lib/absolute_mouse.py) is decoded and its input report layout
+printed. Reports can then be decoded given as hex, or fetched from a simulated board (see simulator.py, started
+with {"absolute_mouse": true} in its config):
+
+    python host/hid_descriptor.py
+    python host/hid_descriptor.py --decode 010040ff3f00
+    python host/hid_descriptor.py --port 8080
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "lib")
+
+MAIN_INPUT = 0x8
+MAIN_OUTPUT = 0x9
+MAIN_FEATURE = 0xB
+
+USAGE_NAMES = {
+    (0x01, 0x01): "Pointer", (0x01, 0x02): "Mouse", (0x01, 0x06): "Keyboard",
+    (0x01, 0x30): "X", (0x01, 0x31): "Y", (0x01, 0x38): "Wheel",
+}
+
+
+def usage_name(usage_page: int, usage: int) -> str:
+    """A readable name for a usage, buttons are numbered"""
+    if usage_page == 0x09:
+        return f"Button {usage}"
+    return USAGE_NAMES.get((usage_page, usage), f"0x{usage_page:02x}:0x{usage:02x}")
+
+
+def _signed(value: int, bits: int) -> int:
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+
+def items(descriptor: bytes):
+    """Yields the descriptor's short items as (type, tag, unsigned data, data size in bytes)"""
+    offset = 0
+    while offset < len(descriptor):
+        prefix = descriptor[offset]
+        if prefix == 0xFE:  # a long item, skipped
+            offset += 3 + descriptor[offset + 1]
+            continue
+        size = (0, 1, 2, 4)[prefix & 0x3]
+        data = int.from_bytes(descriptor[offset + 1:offset + 1 + size], "little")
+        yield (prefix >> 2) & 0x3, prefix >> 4, data, size
+        offset += 1 + size
+
+
+# global item tag -> the state it sets as is
+_GLOBAL_TAGS = {0x0: "usage_page", 0x7: "report_size", 0x8: "report_id", 0x9: "report_count"}
+
+
+def _apply_global(state: dict, stack: list, tag: int, data: int, size: int):
+    if tag in _GLOBAL_TAGS:
+        state[_GLOBAL_TAGS[tag]] = data
+    elif tag == 0x1:
+        state["logical_min"] = _signed(data, size * 8) if size else 0
+    elif tag == 0x2:
+        state["logical_max"] = _signed(data, size * 8) if size and state["logical_min"] < 0 else data
+    elif tag == 0xA:
+        stack.append(dict(state))
+    elif tag == 0xB:
+        state.update(stack.pop())
+
+
+def fields(descriptor: bytes) -> list:
+    """
+    Returns the descriptor's report fields, in order, as dicts: kind (input/output/feature), report_id, bit_offset
+    (within the report, after the report id byte), size and count (bits per value, values), usages, logical_min,
+    logical_max, constant, relative.
+    """
+    state = {"usage_page": 0, "logical_min": 0, "logical_max": 0, "report_size": 0, "report_id": None,
+             "report_count": 0}
+    stack = []
+    usages, usage_min = [], None
+    offsets = {}  # (kind, report id) -> next bit offset
+    result = []
+    for item_type, tag, data, size in items(descriptor):
+        if item_type == 1:  # global
+            _apply_global(state, stack, tag, data, size)
+        elif item_type == 2:  # local
+            page = data >> 16 if size == 4 else state["usage_page"]
+            if tag == 0x0:
+                usages.append((page, data & 0xFFFF))
+            elif tag == 0x1:
+                usage_min = data
+            elif tag == 0x2 and usage_min is not None:
+                usages.extend((page, usage) for usage in range(usage_min, data + 1))
+        elif item_type == 0:  # main
+            if tag in (MAIN_INPUT, MAIN_OUTPUT, MAIN_FEATURE):
+                kind = {MAIN_INPUT: "input", MAIN_OUTPUT: "output", MAIN_FEATURE: "feature"}[tag]
+                key = (kind, state["report_id"])
+                offset = offsets.get(key, 0)
+                result.append({
+                    "kind": kind, "report_id": state["report_id"], "bit_offset": offset,
+                    "size": state["report_size"], "count": state["report_count"],
+                    "usages": [usage_name(*usage) for usage in usages],
+                    "logical_min": state["logical_min"], "logical_max": state["logical_max"],
+                    "constant": bool(data & 0x1), "relative": bool(data & 0x4),
+                })
+                offsets[key] = offset + state["report_size"] * state["report_count"]
+            usages, usage_min = [], None
+    return result
+
+
+def report_length(descriptor_fields: list, report_id: int = None, kind: str = "input") -> int:
+    """The length in bytes of a report (without its report id byte)"""
+    bits = sum(
+        field["size"] * field["count"] for field in descriptor_fields
+        if field["kind"] == kind and field["report_id"] == report_id
+    )
+    return (bits + 7) // 8
+
+
+def decode(report: bytes, descriptor_fields: list, report_id: int = None) -> dict:
+    """Decodes an input report (without its report id byte) into {usage name: value}, padding is left out"""
+    value_bits = int.from_bytes(report, "little")
+    values = {}
+    for field in descriptor_fields:
+        if field["kind"] != "input" or field["report_id"] != report_id or field["constant"]:
+            continue
+        for i in range(field["count"]):
+            raw = (value_bits >> (field["bit_offset"] + i * field["size"])) & ((1 << field["size"]) - 1)
+            value = _signed(raw, field["size"]) if field["logical_min"] < 0 else raw
+            name = field["usages"][min(i, len(field["usages"]) - 1)] if field["usages"] else f"field {i}"
+            values[name] = value
+    return values
+
+
+def _absolute_mouse():
+    sys.path.append(LIB_DIR)
+    import absolute_mouse  # pylint: disable=import-outside-toplevel
+    return absolute_mouse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--decode", nargs="+", metavar="HEX", help="absolute pointer reports to decode")
+    parser.add_argument("--port", type=int, help="decode the reports recorded by the simulated board on this port")
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args()
+    absolute_mouse = _absolute_mouse()
+    descriptor_fields = fields(absolute_mouse.REPORT_DESCRIPTOR)
+    report_id = absolute_mouse.REPORT_ID
+    length = report_length(descriptor_fields, report_id)
+    if length != absolute_mouse.REPORT_LENGTH:
+        raise SystemExit(f"The descriptor's report is {length} bytes, REPORT_LENGTH is {absolute_mouse.REPORT_LENGTH}")
+
+    reports = [bytes.fromhex(report) for report in args.decode or ()]
+    if args.port:
+        conn = http.client.HTTPConnection(args.host, args.port, timeout=5)
+        conn.request("GET", "/sim/reports")
+        recorded = json.loads(conn.getresponse().read())["reports"]
+        conn.close()
+        reports += [bytes.fromhex(report) for device, _, report in recorded if device == "absolute_mouse"]
+    if not reports:
+        print(f"report id {report_id}, {length} bytes")
+        for field in descriptor_fields:
+            print(json.dumps(field))
+        return
+    for report in reports:
+        values = decode(report, descriptor_fields, report_id)
+        for axis in ("X", "Y"):
+            values[f"{axis} (fraction)"] = round(values[axis] / absolute_mouse.LOGICAL_MAX, 5)
+        print(report.hex(), json.dumps(values))
+
+
+if __name__ == "__main__":
+    main()
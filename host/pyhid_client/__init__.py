@@ -0,0 +1,20 @@
+"""
+A CPython client for pyHID boards.
+
+    from pyhid_client import PyHIDClient
+
+    with PyHIDClient("192.168.1.50") as board:
+        board.type("Hello from the host\n")        # compiled here, sent as raw reports
+        with board.batch(layout="de-DE") as batch:  # several operations, as few requests as possible
+            batch.type("Grüße")
+            batch.combo(["CONTROL", "S"])
+        board.keycodes(["CONTROL", "ALT", "DELETE"])  # through /api/keycodes, preempts anything being typed
+
+Run from the host directory (or put it on sys.path). Needs adafruit-circuitpython-hid, the layouts come from
+src/lib in this repo.
+"""
+
+from .client import PyHIDClient, PyHIDError, ReportBatch
+from .compiler import ReportCompiler, delay_records, pointer_record, record
+from .decoder import ReportDecoder, verify
+from .ducky import DuckyScriptError, compile_script, disassemble
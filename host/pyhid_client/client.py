@@ -0,0 +1,390 @@
+"""
+HTTP client for a pyHID board, with a pool of keep-alive connections and safe retries.
+
+Text is compiled into HID reports on the host (see compiler.py) and sent through /api/reports in batches, so the
+board only has to pump reports out. The board's own endpoints (/api/type, /api/keycodes, ...) can be used as well.
+
+Retries never risk typing something twice:
+  - a 429 (the board's HID queue is full) is retried after its Retry-After, the board did nothing with the request,
+  - a pooled connection the board has closed (an idle keep-alive connection timing out) is noticed before anything
+    is written to it and replaced by a fresh one,
+  - a failure to connect is retried, nothing was sent,
+  - GET requests, and requests the caller marks idempotent, are retried on any connection error. Anything else (e.g.
+    a POST whose connection drops once written, which the board may have acted on) raises.
+"""
+
+import http.client
+import json
+import queue
+import select
+import socket
+import threading
+import time
+
+from .compiler import RECORD_SIZE, ReportCompiler, split_point
+from .ducky import compile_script
+
+# Errors that mean the server closed a kept alive connection before reading our request
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class _NotConnected(Exception):
+    """Connecting failed, nothing was sent"""
+
+
+class _StaleConnection(Exception):
+    """A pooled connection failed once the request was written to it, the board may or may not have read it"""
+
+
+def _closed_by_peer(conn) -> bool:
+    """True if an idle connection has been closed at the other end (it reads as EOF, or the socket has an error)"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+        return bool(readable) and not conn.sock.recv(1, socket.MSG_PEEK)
+    except OSError:
+        return True
+
+
+class PyHIDError(Exception):
+    """A request the board answered with an error status"""
+
+    def __init__(self, status: int, body: dict):
+        super().__init__(f"{status}: {body.get('error', body)}")
+        self.status = status
+        self.body = body
+
+
+class ReportBatch:
+    """
+    Collects compiled records and sends them through /api/reports, `batch_reports` at a time.
+    Use as a context manager (see PyHIDClient.batch) so whatever is left is sent at the end.
+    """
+
+    def __init__(self, client, layout: str = None):
+        self._client = client
+        self._compiler = client.compiler(layout)
+        self._records = bytearray()
+
+    def type(self, text: str, wait: float = None, caps_lock: bool = False) -> "ReportBatch":
+        """Adds text, typed with the batch's layout (see ReportCompiler.text for caps_lock)"""
+        return self.add(self._compiler.text(text, wait, caps_lock))
+
+    def combo(self, keys, wait: float = None) -> "ReportBatch":
+        """Adds a key combo, e.g. ["CONTROL", "ALT", "DELETE"]"""
+        return self.add(self._compiler.combo(keys, wait))
+
+    def add(self, records: bytes) -> "ReportBatch":
+        """Adds raw records, sending full batches as soon as there are enough of them"""
+        self._records += records
+        batch_size = self._client.batch_reports * RECORD_SIZE
+        while len(self._records) >= batch_size:
+            split = split_point(self._records, batch_size)
+            self._client.send_reports(bytes(self._records[:split]))
+            del self._records[:split]
+        return self
+
+    def flush(self):
+        """Sends whatever has not been sent yet"""
+        if self._records:
+            self._client.send_reports(bytes(self._records))
+            self._records = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.flush()
+
+
+class PyHIDClient:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    A client for one board. Safe to share between threads, each request borrows a connection from the pool.
+    `batch_reports` is the number of records per /api/reports request, keep it within the board's max_reports.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, host: str, port: int = 80, *, pool_size: int = 4, timeout: float = 30.0, retries: int = 3,
+        batch_reports: int = 1024, layout: str = "en-US",
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.batch_reports = batch_reports
+        self.layout = layout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._compilers = {}
+        self._compilers_lock = threading.Lock()
+
+    def compiler(self, layout: str = None) -> ReportCompiler:
+        """Returns the (cached) report compiler for a layout, the client's default layout if None"""
+        layout = layout or self.layout
+        with self._compilers_lock:
+            compiler = self._compilers.get(layout)
+            if compiler is None:
+                compiler = self._compilers[layout] = ReportCompiler(layout)
+        return compiler
+
+    def _connection(self):
+        """Returns (connection, reused), a pooled connection still open at the board's end if there is one"""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+            if not _closed_by_peer(conn):
+                return conn, True
+            conn.close()
+
+    def _release(self, conn, response):
+        """Puts a connection back in the pool, unless the board closed it"""
+        if response.will_close:
+            conn.close()
+            return
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _send(self, method: str, path: str, body, headers: dict):
+        """Sends a single request, returns (response, body)."""
+        conn, reused = self._connection()
+        if conn.sock is None:
+            try:
+                conn.connect()
+            except OSError as error:
+                conn.close()
+                raise _NotConnected() from error
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except _STALE_CONNECTION_ERRORS as error:
+            conn.close()
+            if reused:
+                raise _StaleConnection() from error
+            raise
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        self._release(conn, response)
+        return response, data
+
+    def request(
+        self, method: str, path: str, body=None, content_type: str = "application/json", idempotent: bool = None,
+    ):
+        """
+        Sends a request and returns the decoded JSON response, raises PyHIDError for an error status.
+        A request is only resent after a connection error if it is idempotent, by default only GET requests are.
+        """
+        if idempotent is None:
+            idempotent = method == "GET"
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        headers = {"Content-Type": content_type, "Connection": "keep-alive"}
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response, data = self._send(method, path, body, headers)
+            except _StaleConnection as error:
+                # The rest of the pool has most likely been idle for as long, start afresh
+                self.close()
+                if not idempotent:
+                    raise error.__cause__
+                if attempt > self.retries:
+                    raise
+                continue
+            except _NotConnected as error:
+                if attempt > self.retries:
+                    raise error.__cause__
+                time.sleep(0.1 * attempt)
+                continue
+            except (OSError, http.client.HTTPException):
+                if not idempotent or attempt > self.retries:
+                    raise
+                continue
+            result = json.loads(data) if data else {}
+            if response.status == 429 and attempt <= self.retries:
+                time.sleep(float(response.getheader("Retry-After") or 1))
+                continue
+            if response.status >= 400:
+                raise PyHIDError(response.status, result)
+            return result
+
+    def get(self, path: str) -> dict:
+        """GETs one of the board's endpoints"""
+        return self.request("GET", path)
+
+    def send_reports(self, records: bytes, execute_at: int = None) -> dict:
+        """
+        Sends compiled records through /api/reports as they are (see ReportBatch for batching), scheduled for
+        execute_at (device time, see clock_offset) if given.
+        """
+        path = "/api/reports" if execute_at is None else f"/api/reports?execute_at={execute_at}"
+        return self.request("POST", path, records, "application/octet-stream")
+
+    def batch(self, layout: str = None) -> ReportBatch:
+        """Returns a ReportBatch, for several type/combo calls sent as few requests as possible"""
+        return ReportBatch(self, layout)
+
+    def type(self, text: str, layout: str = None, wait: float = None, caps_lock: bool = None):
+        """
+        Types text, compiled on the host and sent as raw reports. Letters are compiled for the board's Caps Lock
+        state, asked for first (one more request) unless caps_lock says what it is.
+        """
+        if caps_lock is None:
+            caps_lock = self.leds()["caps_lock"]
+        with self.batch(layout) as batch:
+            batch.type(text, wait, caps_lock)
+
+    def run_script(self, script, layout: str = None, execute_at: int = None) -> dict:
+        """
+        Runs a script on the board through /api/script: DuckyScript source (compiled here for `layout`, the client's
+        default layout if None) or an already compiled script (bytes). Returns once the script has finished.
+        """
+        if isinstance(script, str):
+            script = compile_script(script, layout or self.layout)
+        path = "/api/script" if execute_at is None else f"/api/script?execute_at={execute_at}"
+        return self.request("POST", path, script, "application/octet-stream")
+
+    def type_on_board(self, text: str, layout: str = None, wait: float = None, unicode: str = None) -> dict:
+        """
+        Types text through /api/type, compiled by the board. `unicode` (windows, windows_hex, linux or macos) types
+        the characters the layout has no key for with the host's Unicode input.
+        """
+        body = {"data": text}
+        if layout:
+            body["layout"] = layout
+        if wait:
+            body["wait"] = wait
+        if unicode:
+            body["unicode"] = unicode
+        return self.request("POST", "/api/type", body)
+
+    def keycodes(self, data: list, separate: bool = False, wait: float = None, execute_at: int = None) -> dict:
+        """Sends key combos through /api/keycodes. Short requests preempt text being typed, unlike raw reports."""
+        body = {"data": data, "separate": separate}
+        if wait:
+            body["wait"] = wait
+        if execute_at is not None:
+            body["execute_at"] = execute_at
+        return self.request("POST", "/api/keycodes", body)
+
+    def press(self, keys: list, hold: float = None) -> dict:
+        """Presses keys and keeps them held until release() or for `hold` seconds (the board caps it at max_hold)"""
+        body = {"data": keys}
+        if hold:
+            body["hold"] = hold
+        return self.request("POST", "/api/keys/press", body)
+
+    def release(self, keys: list = None) -> dict:
+        """Releases held keys, every key if None"""
+        return self.request("POST", "/api/keys/release", {} if keys is None else {"data": keys}, idempotent=True)
+
+    def place_pointer(self, x: float, y: float, click: str = None) -> dict:
+        """Places the pointer at (x, y), fractions of the screen, and clicks there (LEFT/RIGHT/MIDDLE) if asked to"""
+        body = {"x": x, "y": y}
+        if click:
+            body["click"] = click
+        return self.request("POST", "/api/pointer", body)
+
+    def leds(self) -> dict:
+        """Returns the keyboard LEDs (num_lock, caps_lock, scroll_lock, compose) as last set by the host"""
+        return self.get("/api/leds")
+
+    def key_state(self) -> dict:
+        """Returns the keys held on the board"""
+        return self.get("/api/keys")
+
+    def clock_offset(self, samples: int = 8) -> tuple:
+        """
+        Estimates the board's clock offset from /api/clock, NTP style: the board's time is taken to be that of the
+        middle of the exchange with the shortest round trip. Returns (offset_ns, round_trip_ns), where board time is
+        time.monotonic_ns() + offset_ns, give or take half the round trip.
+        """
+        offset_ns = best_ns = None
+        for _ in range(samples):
+            sent_ns = time.monotonic_ns()
+            device_ns = self.get("/api/clock")["monotonic_ns"]
+            round_trip_ns = time.monotonic_ns() - sent_ns
+            if best_ns is None or round_trip_ns < best_ns:
+                offset_ns, best_ns = device_ns - (sent_ns + round_trip_ns // 2), round_trip_ns
+        return offset_ns, best_ns
+
+    def record_session(self, record: bool = True, capacity: int = None) -> dict:
+        """Starts (or stops) recording the board's API requests, see host/replay.py"""
+        body = {"record": record}
+        if capacity:
+            body["capacity"] = capacity
+        return self.request("POST", "/api/session/record", body)
+
+    def download_session(self) -> bytes:
+        """Returns (and clears) the board's recorded session log"""
+        response, data = self._send("GET", "/api/session", None, {"Connection": "keep-alive"})
+        if response.status >= 400:
+            raise PyHIDError(response.status, json.loads(data) if data else {})
+        return data
+
+    def submit(self, path: str, body=None, content_type: str = "application/json") -> int:
+        """
+        Queues a HID request (POST path?detach=1) without waiting for it to be typed, returns its job id for
+        job_events(). Nothing is typed twice: a 429 is retried, the board did nothing with the request.
+        """
+        separator = "&" if "?" in path else "?"
+        return self.request("POST", f"{path}{separator}detach=1", body, content_type)["job"]
+
+    def job_events(self, job_id: int, interval_ms: int = None):
+        """
+        Yields (event, data) for a job's server-sent events (progress, then done or error) until it has finished,
+        over a connection of its own, the board closes it at the end of the stream.
+        """
+        path = f"/api/events?job={job_id}" + (f"&interval={interval_ms}" if interval_ms else "")
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request("GET", path, headers={"Accept": "text/event-stream"})
+            response = conn.getresponse()
+            if response.status != 200:
+                data = response.read()
+                raise PyHIDError(response.status, json.loads(data) if data else {})
+            event = None
+            for line in response:
+                line = line.rstrip(b"\r\n")
+                if line.startswith(b"event: "):
+                    event = line[7:].decode()
+                elif line.startswith(b"data: "):
+                    yield event, json.loads(line[6:])
+                    if event in ("done", "error"):
+                        return
+        finally:
+            conn.close()
+
+    def queue_status(self) -> dict:
+        """Returns the state of the board's HID queue"""
+        return self.get("/api/queue")
+
+    def health(self) -> dict:
+        """Returns the board's health check, its 503 (network link or USB down) included rather than raised"""
+        try:
+            return self.get("/api/health")
+        except PyHIDError as error:
+            if error.status != 503:
+                raise
+            return error.body
+
+    def close(self):
+        """Closes every pooled connection"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
@@ -0,0 +1,174 @@
+"""
+Compiles text and key combos into raw HID report records on the host, for POST /api/reports.
+
+The reports are produced by the same adafruit_hid Keyboard and layout classes the board uses (this project's
+keyboard_layout_win_* layouts included, found through SUPPORTED_KEYBOARDS), so they are exactly what /api/type or
+/api/keycodes would have sent, minus the work on the board.
+
+    requirements (pip): adafruit-circuitpython-hid
+"""
+
+import os
+import sys
+import types
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src", "lib")
+
+# The record format of /api/reports, as in src/lib/raw_reports.py
+RECORD_SIZE = 10
+KEYBOARD = 0
+MOUSE = 1
+ABSOLUTE_MOUSE = 2
+MAX_DELAY_MS = 255
+# The absolute pointer's axis range, as in src/lib/absolute_mouse.py
+POINTER_MAX = 32767
+_RELEASED = bytes(8)
+
+
+def _install_shims():
+    """adafruit_hid imports a couple of CircuitPython only modules, stand-ins are installed for any that are missing"""
+    shims = (
+        ("micropython", {"const": lambda value: value}),
+        ("usb_hid", {"Device": type("Device", (), {})}),
+    )
+    for name, attributes in shims:
+        try:
+            __import__(name)
+        except ImportError:
+            module = types.ModuleType(name)
+            module.__dict__.update(attributes)
+            sys.modules[name] = module
+    if LIB_DIR not in sys.path:
+        sys.path.append(LIB_DIR)
+
+
+def record(report: bytes, device: int = KEYBOARD, delay_ms: int = 0) -> bytes:
+    """Returns a single /api/reports record, mouse reports (4 or 6 bytes) are padded to 8"""
+    if not 0 <= delay_ms <= MAX_DELAY_MS:
+        raise ValueError(f"A record's delay must be 0-{MAX_DELAY_MS} ms, split longer delays with delay_records")
+    return bytes((device, delay_ms)) + bytes(report).ljust(8, b"\x00")
+
+
+def pointer_record(x: float, y: float, buttons: int = 0, delay_ms: int = 0) -> bytes:
+    """
+    Returns an absolute pointer record placing the pointer at (x, y), fractions of the screen from the top left,
+    with `buttons` (1 left, 2 right, 4 middle) held. The board must have the absolute pointer enabled.
+    """
+    if not (0 <= x <= 1 and 0 <= y <= 1):
+        raise ValueError("x and y must be between 0 and 1")
+    x, y = round(x * POINTER_MAX), round(y * POINTER_MAX)
+    report = bytes((buttons,)) + x.to_bytes(2, "little") + y.to_bytes(2, "little") + b"\x00"
+    return record(report, ABSOLUTE_MOUSE, delay_ms)
+
+
+def delay_records(delay_ms: int) -> bytes:
+    """Returns no-op (all keys released) records adding up to delay_ms, for delays longer than a record allows"""
+    records = b""
+    while delay_ms > 0:
+        records += record(_RELEASED, KEYBOARD, min(delay_ms, MAX_DELAY_MS))
+        delay_ms -= MAX_DELAY_MS
+    return records
+
+
+def split_point(records, max_size: int) -> int:
+    """
+    Returns where to split records so the first part is at most max_size bytes, at a record boundary where every
+    key has been released if there is one. Anything shorter than max_size is returned whole.
+    """
+    if len(records) <= max_size:
+        return len(records)
+    max_size -= max_size % RECORD_SIZE
+    for end in range(max_size, 0, -RECORD_SIZE):
+        if not any(records[end - 8:end]):
+            return end
+    return max_size
+
+
+class _RecordingDevice:
+    """Takes the place of the USB keyboard, keeping every report sent to it"""
+
+    usage_page = 0x01
+    usage = 0x06
+
+    def __init__(self):
+        self.reports = []
+
+    def send_report(self, report, report_id: int = None):  # pylint: disable=unused-argument
+        self.reports.append(bytes(report))
+
+
+class ReportCompiler:
+    """
+    Compiles text (with a keyboard layout) and key combos (Keycode names, as taken by /api/keycodes) into records.
+    Characters are compiled once and cached, anything the layout cannot type raises ValueError before any record
+    has been returned, so nothing is ever typed partially.
+    """
+
+    def __init__(self, layout: str = "en-US"):
+        _install_shims()
+        from adafruit_hid.keyboard import Keyboard, Keycode
+        from supported_keyboards import SUPPORTED_KEYBOARDS, get_layout
+
+        if layout not in SUPPORTED_KEYBOARDS:
+            raise ValueError(f"Unsupported keyboard layout: {layout}. Available layouts: {tuple(SUPPORTED_KEYBOARDS)}")
+        self.layout_name = layout
+        self._keycode = Keycode
+        self._device = _RecordingDevice()
+        self._keyboard = Keyboard(self._device)
+        self._layout = get_layout(layout)(self._keyboard)
+        self._device.reports = []  # anything sent while setting up
+        self._chars = {}
+        self._caps_chars = {}
+
+    def _take(self, delay_ms: int) -> bytes:
+        """Turns the reports recorded since the last call into records, the delay goes after the last one"""
+        reports, self._device.reports = self._device.reports, []
+        last = len(reports) - 1
+        return b"".join(record(report, KEYBOARD, delay_ms if i == last else 0) for i, report in enumerate(reports))
+
+    def _char(self, char: str) -> bytes:
+        records = self._chars.get(char)
+        if records is None:
+            self._layout.write(char)
+            records = self._chars[char] = self._take(0)
+        return records
+
+    def _caps_char(self, char: str) -> bytes:
+        """
+        Compiles char for a host with Caps Lock on, as /api/type's "invert" mode does (with src/lib/caps_lock.py):
+        the letters Caps Lock changes with their case swapped.
+        """
+        records = self._caps_chars.get(char)
+        if records is None:
+            from caps_lock import caps_affects, write_case_swapped
+
+            if caps_affects(self._layout, char):
+                write_case_swapped(self._layout, char)
+            else:
+                self._layout.write(char)
+            records = self._caps_chars[char] = self._take(0)
+        return records
+
+    def text(self, text: str, wait: float = None, caps_lock: bool = False) -> bytes:
+        """
+        Compiles text, pausing `wait` seconds after each character as /api/type would. With caps_lock (the host has
+        Caps Lock on, see PyHIDClient.leds) letters are compiled with their case swapped, as /api/type's "invert"
+        mode does.
+        """
+        pause = delay_records(round(wait * 1000)) if wait else b""
+        char_records = self._caps_char if caps_lock else self._char
+        return b"".join(char_records(char) + pause for char in text)
+
+    def combo(self, keys, wait: float = None) -> bytes:
+        """Compiles a single key combo (a Keycode name or a list of them): all keys pressed, then released"""
+        keys = [keys] if isinstance(keys, str) else keys
+        keycodes = [getattr(self._keycode, key.upper()) for key in keys]
+        try:
+            self._keyboard.press(*keycodes)
+        finally:
+            self._keyboard.release_all()
+        return self._take(0) + (delay_records(round(wait * 1000)) if wait else b"")
+
+    def combos(self, combos: list, wait: float = None) -> bytes:
+        """Compiles a list of key combos, pausing `wait` seconds after each one"""
+        return b"".join(self.combo(keys, wait) for keys in combos)
@@ -0,0 +1,189 @@
+"""
+Decodes a stream of keyboard reports back into the text a host would see, for a given layout: a virtual target to
+check that whatever sends the reports (the board's /api/type, compiled /api/reports records, anything faster) still
+types what was intended.
+
+The layout tables are inverted: ASCII_TO_KEYCODE and HIGHER_ASCII (with NEED_ALTGR) give the character of each
+(keycode, shift, AltGr), COMBINED_KEYS the dead keys and what they combine into. A character is typed when its key
+goes down, with the modifiers of that report; a key held over several reports types once (no autorepeat). Caps Lock
+presses toggle the Caps Lock state, which reverses Shift on every letter key: a key whose shifted character is the
+upper case of its unshifted one (A/a, and ü/Ü on de-DE, ñ/Ñ on es-ES), dead key combinations included (´ E is É).
+Keys pressed with Ctrl, left Alt or GUI are combos, not text, and are kept apart.
+
+    decoder = ReportDecoder("de-DE")
+    text = decoder.decode(reports)   # 8 byte keyboard reports
+    decoder.issues                   # anything a host would not have typed as the tables intend
+"""
+
+from .compiler import KEYBOARD, RECORD_SIZE, ReportCompiler, _install_shims
+
+CAPS_LOCK = 0x39
+ERROR_ROLLOVER = 0x01
+SHIFT_BITS = 0x22  # left and right Shift
+ALTGR_BIT = 0x40  # right Alt
+COMBO_BITS = 0x9D  # Ctrl, left Alt and GUI
+
+
+def keyboard_reports(records: bytes) -> list:
+    """Returns the keyboard reports of /api/reports records, in order"""
+    return [
+        bytes(records[offset + 2:offset + RECORD_SIZE]) for offset in range(0, len(records), RECORD_SIZE)
+        if records[offset] == KEYBOARD
+    ]
+
+
+def _layout_chars(layout_class) -> dict:
+    """{character: keycode (with SHIFT_FLAG)} of everything the layout types with a single key"""
+    chars = {chr(i): keycode for i, keycode in enumerate(layout_class.ASCII_TO_KEYCODE) if keycode}
+    for char, keycode in layout_class.HIGHER_ASCII.items():
+        chars[chr(char) if isinstance(char, int) else char] = keycode
+    return chars
+
+
+class ReportDecoder:  # pylint: disable=too-many-instance-attributes
+    """Turns keyboard reports into text, as a host with `layout` (a SUPPORTED_KEYBOARDS name) would."""
+
+    def __init__(self, layout: str = "en-US", caps_lock: bool = False):
+        _install_shims()
+        from supported_keyboards import SUPPORTED_KEYBOARDS, get_layout
+
+        if layout not in SUPPORTED_KEYBOARDS:
+            raise ValueError(f"Unsupported keyboard layout: {layout}. Available layouts: {tuple(SUPPORTED_KEYBOARDS)}")
+        self.layout_name = layout
+        layout_class = get_layout(layout)
+        shift_flag, altgr_flag = layout_class.SHIFT_FLAG, layout_class.ALTGR_FLAG
+        self.collisions = []  # (character, character) pairs the tables put on the same key
+        self._keys = {}  # (keycode, shift, altgr) -> character
+        for char, keycode in _layout_chars(layout_class).items():
+            key = (keycode & ~shift_flag, bool(keycode & shift_flag), char in layout_class.NEED_ALTGR)
+            if key in self._keys:
+                self.collisions.append((self._keys[key], char))
+            else:
+                self._keys[key] = char
+        self._combined = {}  # (dead key, character) -> character
+        for char, code in layout_class.COMBINED_KEYS.items():
+            first = code >> 8
+            dead = (first & ~shift_flag, bool(first & shift_flag), bool(code & altgr_flag))
+            if dead in self._keys:
+                self.collisions.append((self._keys[dead], chr(char)))
+            self._combined[(dead, chr(code & 0xFF & ~altgr_flag))] = chr(char)
+        self._dead_keys = {dead for dead, _ in self._combined}
+        # (keycode, altgr) of the letter keys, whose Shift Caps Lock reverses
+        self._letter_keys = {
+            (keycode, altgr) for (keycode, shift, altgr), char in self._keys.items()
+            if not shift and char.isalpha() and char != char.upper()
+            and self._keys.get((keycode, True, altgr)) == char.upper()
+        }
+        self.caps_lock = caps_lock
+        self.reset()
+
+    def reset(self):
+        """Forgets everything decoded so far, the Caps Lock state is kept"""
+        self.text = ""
+        self.combos = []  # (modifier byte, keycode) of each key pressed with Ctrl, left Alt or GUI
+        self.issues = []
+        self._reports = 0
+        self._previous = bytes(8)
+        self._dead = None
+
+    def _issue(self, problem: str):
+        self.issues.append(f"report {self._reports - 1}: {problem}")
+
+    def _char(self, key: tuple) -> str:
+        keycode, shift, altgr = key
+        if self.caps_lock and (keycode, altgr) in self._letter_keys:
+            shift = not shift
+        return self._keys.get((keycode, shift, altgr))
+
+    def _type(self, key: tuple) -> str:
+        if self._dead is not None:
+            dead, self._dead = self._dead, None
+            char = self._char(key)
+            combined = self._combined.get((dead, char))
+            if combined is not None:
+                return combined
+            self._issue(f"dead key {dead} followed by {char!r} combines into nothing")
+            return (self._combined.get((dead, " ")) or "") + (char or "")
+        if key in self._dead_keys:
+            self._dead = key
+            return ""
+        char = self._char(key)
+        if char is None:
+            self._issue(f"no character for keycode 0x{key[0]:02x} (shift {key[1]}, AltGr {key[2]})")
+            return ""
+        return char
+
+    def feed(self, report: bytes) -> str:
+        """Decodes the next report, returns the text it typed (if any)"""
+        self._reports += 1
+        modifiers, keys = report[0], [keycode for keycode in report[2:8] if keycode]
+        held = self._previous[2:8]
+        self._previous = bytes(report)
+        if ERROR_ROLLOVER in keys:
+            self._issue("more keys pressed than a report holds")
+            return ""
+        typed = ""
+        for keycode in keys:
+            if keycode in held:
+                continue
+            if keycode == CAPS_LOCK:
+                self.caps_lock = not self.caps_lock
+            elif modifiers & COMBO_BITS:
+                self.combos.append((modifiers, keycode))
+            else:
+                typed += self._type((keycode, bool(modifiers & SHIFT_BITS), bool(modifiers & ALTGR_BIT)))
+        self.text += typed
+        return typed
+
+    def decode(self, reports) -> str:
+        """Decodes reports, returns the text they typed. Keys left pressed at the end are an issue."""
+        start = len(self.text)
+        for report in reports:
+            self.feed(report)
+        if any(self._previous):
+            self._issue(f"keys still pressed at the end: {self._previous.hex()}")
+        if self._dead is not None:
+            self._issue(f"dead key {self._dead} not followed by anything")
+        return self.text[start:]
+
+
+def _divergence(expected: str, decoded: str) -> int:
+    """The index of the first character where decoded differs from expected, None if they are the same"""
+    for i, (want, got) in enumerate(zip(expected, decoded)):
+        if want != got:
+            return i
+    return None if len(expected) == len(decoded) else min(len(expected), len(decoded))
+
+
+def verify(text: str, reports, layout: str = "en-US", caps_lock: bool = False) -> dict:
+    """
+    Decodes reports and compares them with the text they were meant to type. Returns ok, the decoded text, where it
+    first diverges (an index into text, None if it does not) and the decoder's issues.
+    """
+    decoder = ReportDecoder(layout, caps_lock)
+    decoded = decoder.decode(reports)
+    divergence = _divergence(text, decoded)
+    return {
+        "ok": divergence is None and not decoder.issues,
+        "decoded": decoded,
+        "divergence": divergence,
+        "issues": decoder.issues,
+    }
+
+
+def check_layout(layout: str) -> dict:
+    """
+    Compiles every character the layout claims to type, one at a time, and decodes it again. Returns the characters
+    that come back as something else ({character: decoded}) and the table collisions.
+    """
+    compiler = ReportCompiler(layout)
+    decoder = ReportDecoder(layout)
+    layout_class = type(compiler._layout)
+    chars = sorted(set(_layout_chars(layout_class)) | {chr(char) for char in layout_class.COMBINED_KEYS})
+    wrong = {}
+    for char in chars:
+        decoder.reset()
+        decoded = decoder.decode(keyboard_reports(compiler.text(char)))
+        if decoded != char or decoder.issues:
+            wrong[char] = decoded
+    return {"chars": len(chars), "wrong": wrong, "collisions": decoder.collisions}
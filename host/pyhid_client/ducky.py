@@ -0,0 +1,262 @@
+"""
+Compiles DuckyScript into the board's script bytecode (format in src/lib/hid_script.py), run with a single
+POST /api/script rather than a request per line, with the delays kept by the board.
+
+    script = compile_script(open("payload.txt").read(), layout="de-DE")
+    board.run_script(script)          # or board.run_script(source, layout="de-DE")
+    print("\\n".join(disassemble(script)))
+
+Supported, DuckyScript 1.0 and the plain parts of 3.0:
+  - REM comments, REM_BLOCK ... END_REM
+  - STRING / STRINGLN, single line or as a block (STRING on its own line ... END_STRING, lines joined as they are,
+    STRINGLN blocks type each line followed by ENTER)
+  - DELAY ms, DEFAULT_DELAY / DEFAULTDELAY ms (after every command)
+  - DEFAULT_STRING_DELAY / DEFAULTSTRINGDELAY ms (after every character), STRING_DELAY / STRINGDELAY ms (for the
+    next STRING only)
+  - key lines: keys and modifiers separated by spaces or dashes, GUI r, CTRL-ALT DELETE, ENTER. Names are the
+    adafruit_hid Keycode names (as /api/keycodes takes them) plus the usual DuckyScript ones (CTRL, ESC, DOWNARROW,
+    MENU...), single characters are looked up in the layout (SHIFT added for the ones it needs)
+  - HOLD / RELEASE keys (RELEASE on its own releases everything)
+  - REPEAT / REPLAY n, the previous command n more times
+Variables, conditionals, loops, functions and ATTACKMODE are not supported and raise DuckyScriptError.
+"""
+
+from .compiler import _install_shims
+from .decoder import _layout_chars
+
+_install_shims()
+# the op codes are the board's own (src/lib/hid_script.py), so the two cannot drift apart
+from hid_script import (  # pylint: disable=wrong-import-position,wrong-import-order
+    CHAR_DELAY, COMBO, DEFAULT_DELAY, DELAY, LOOP, MAGIC, PRESS, RELEASE, TEXT,
+)
+
+_OP_NAMES = {
+    TEXT: "TEXT", COMBO: "COMBO", PRESS: "PRESS", RELEASE: "RELEASE", DELAY: "DELAY",
+    DEFAULT_DELAY: "DEFAULT_DELAY", CHAR_DELAY: "CHAR_DELAY", LOOP: "LOOP",
+}
+_MAX_TEXT = 0xFFFF
+_MAX_SHORT = 0xFFFF
+_MAX_KEYS = 6  # plus modifiers, as many as a boot keyboard report holds
+_FIRST_MODIFIER = 0xE0
+
+# DuckyScript key names that are not Keycode names -> Keycode name
+ALIASES = {
+    "CTRL": "CONTROL", "ESC": "ESCAPE", "DEL": "DELETE", "MENU": "APPLICATION", "APP": "APPLICATION",
+    "BREAK": "PAUSE", "CAPSLOCK": "CAPS_LOCK", "NUMLOCK": "KEYPAD_NUMLOCK", "SCROLLLOCK": "SCROLL_LOCK",
+    "PAGEUP": "PAGE_UP", "PAGEDOWN": "PAGE_DOWN", "PRINTSCREEN": "PRINT_SCREEN", "CMD": "COMMAND",
+    "UP": "UP_ARROW", "DOWN": "DOWN_ARROW", "LEFT": "LEFT_ARROW", "RIGHT": "RIGHT_ARROW",
+    "UPARROW": "UP_ARROW", "DOWNARROW": "DOWN_ARROW", "LEFTARROW": "LEFT_ARROW", "RIGHTARROW": "RIGHT_ARROW",
+}
+# DuckyScript 3.0 commands that need a runtime this bytecode does not have
+_UNSUPPORTED = (
+    "VAR", "DEFINE", "IF", "ELSE", "END_IF", "WHILE", "END_WHILE", "FUNCTION", "END_FUNCTION", "RETURN",
+    "ATTACKMODE", "SAVE_ATTACKMODE", "RESTORE_ATTACKMODE", "WAIT_FOR_BUTTON_PRESS", "BUTTON_DEF", "LED_OFF", "LED_R",
+    "LED_G", "HIDE_PAYLOAD", "RESTORE_PAYLOAD", "RANDOM_LETTER", "RANDOM_NUMBER", "RANDOM_CHARACTER", "EXFIL",
+)
+
+
+class DuckyScriptError(ValueError):
+    """A line of the script that cannot be compiled"""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def _short(value: int) -> bytes:
+    return value.to_bytes(2, "little")
+
+
+class _Compiler:  # pylint: disable=too-many-instance-attributes
+    """Compiles one script, keeping the ops emitted so far (each one's bytes) for REPEAT"""
+
+    def __init__(self, layout: str):
+        _install_shims()
+        from adafruit_hid.keycode import Keycode
+        from supported_keyboards import SUPPORTED_KEYBOARDS, get_layout
+
+        if layout not in SUPPORTED_KEYBOARDS:
+            raise ValueError(f"Unsupported keyboard layout: {layout}. Available layouts: {tuple(SUPPORTED_KEYBOARDS)}")
+        self.layout = layout
+        self._keycode = Keycode
+        self._layout_class = get_layout(layout)
+        self._chars = _layout_chars(self._layout_class)
+        self._typable = set(self._chars) | {chr(char) for char in self._layout_class.COMBINED_KEYS}
+        self.ops = []
+        self.line = 0
+        self._string_delay = 0  # DEFAULT_STRING_DELAY
+        self._next_string_delay = None  # STRING_DELAY, for the next STRING only
+
+    def error(self, message: str):
+        raise DuckyScriptError(self.line, message)
+
+    def _number(self, argument: str, maximum: int) -> int:
+        if not argument.isdigit() or int(argument) > maximum:
+            self.error(f"expected a number of ms from 0 to {maximum}, got {argument!r}")
+        return int(argument)
+
+    def key(self, name: str) -> list:
+        """The keycodes of a key name (a character needing shift or AltGr gets those too)"""
+        upper = name.upper()
+        keycode_name = ALIASES.get(upper, upper)
+        if not keycode_name.startswith("_") and isinstance(getattr(self._keycode, keycode_name, None), int):
+            return [getattr(self._keycode, keycode_name)]
+        if len(name) == 1 and name in self._chars:
+            layout = self._layout_class
+            code = self._chars[name]
+            keycodes = [code & ~layout.SHIFT_FLAG]
+            if code & layout.SHIFT_FLAG:
+                keycodes.insert(0, self._keycode.SHIFT)
+            if name in layout.NEED_ALTGR:
+                keycodes.insert(0, self._keycode.RIGHT_ALT)
+            return keycodes
+        return self.error(f"unknown key {name!r}")
+
+    def keys(self, words: list) -> bytes:
+        keycodes = []
+        for word in words:
+            for name in word.split("-") if len(word) > 1 else (word,):
+                if name:
+                    keycodes.extend(code for code in self.key(name) if code not in keycodes)
+        if sum(1 for code in keycodes if code < _FIRST_MODIFIER) > _MAX_KEYS:
+            self.error(f"more than {_MAX_KEYS} keys (modifiers aside) at once")
+        return bytes((len(keycodes),)) + bytes(keycodes)
+
+    def emit(self, op: int, data: bytes = b""):
+        self.ops.append(bytes((op,)) + data)
+
+    def text(self, text: str):
+        """TEXT ops for text, split at the op's length limit"""
+        unknown = sorted({char for char in text if char not in self._typable})
+        if unknown:
+            self.error(f"the {self.layout} layout cannot type {''.join(unknown)!r}")
+        delay = self._next_string_delay
+        if delay is not None:
+            self.emit(CHAR_DELAY, _short(delay))
+        data = text.encode("utf-8")
+        while data:
+            chunk = data[:_MAX_TEXT]
+            while chunk and len(chunk) < len(data) and (data[len(chunk)] & 0xC0) == 0x80:
+                chunk = chunk[:-1]  # not in the middle of a character
+            self.emit(TEXT, _short(len(chunk)) + chunk)
+            data = data[len(chunk):]
+        if delay is not None:
+            self.emit(CHAR_DELAY, _short(self._string_delay))
+            self._next_string_delay = None
+
+    def repeat(self, argument: str):
+        """Wraps the previous command in a LOOP running it once more than `argument` times"""
+        count = self._number(argument, _MAX_SHORT - 1)
+        if not self.ops:
+            self.error("REPEAT with nothing to repeat")
+        body = self.ops.pop()
+        if len(body) > _MAX_SHORT:
+            self.error("the command to repeat is too long")
+        self.emit(LOOP, _short(count + 1) + _short(len(body)) + body)
+
+    def command(self, line: str):
+        """Compiles a single line (outside of blocks), with its trailing whitespace"""
+        command, _, argument = line.partition(" ")
+        upper = command.upper()
+        if upper in ("STRING", "STRINGLN"):
+            self.text(argument + ("\n" if upper == "STRINGLN" else ""))
+        elif upper == "DELAY":
+            self.emit(DELAY, self._number(argument.strip(), 0xFFFFFFFF).to_bytes(4, "little"))
+        elif upper in ("DEFAULT_DELAY", "DEFAULTDELAY"):
+            self.emit(DEFAULT_DELAY, _short(self._number(argument.strip(), _MAX_SHORT)))
+        elif upper in ("DEFAULT_STRING_DELAY", "DEFAULTSTRINGDELAY"):
+            self._string_delay = self._number(argument.strip(), _MAX_SHORT)
+            self.emit(CHAR_DELAY, _short(self._string_delay))
+        elif upper in ("STRING_DELAY", "STRINGDELAY"):
+            self._next_string_delay = self._number(argument.strip(), _MAX_SHORT)
+        elif upper in ("REPEAT", "REPLAY"):
+            self.repeat(argument.strip())
+        elif upper == "HOLD":
+            if not argument.strip():
+                self.error("HOLD needs keys")
+            self.emit(PRESS, self.keys(argument.split()))
+        elif upper == "RELEASE":
+            self.emit(RELEASE, self.keys(argument.split()))
+        elif upper in _UNSUPPORTED or command.startswith("$"):
+            self.error(f"{command} is not supported, only plain DuckyScript compiles to the board's bytecode")
+        else:
+            self.emit(COMBO, self.keys(line.split()))
+
+    def _joined(self, start: int):
+        """Joins the ops emitted since start into one, so a command is repeated as a whole"""
+        if len(self.ops) > start + 1:
+            self.ops[start:] = [b"".join(self.ops[start:])]
+
+    def compile(self, source: str) -> bytes:
+        block, block_lines = None, []
+        for self.line, raw_line in enumerate(source.splitlines(), 1):
+            line = raw_line.strip()
+            start = len(self.ops)
+            if block is not None:
+                if line.upper() == ("END_REM" if block == "REM" else "END_STRING"):
+                    if block == "STRING":
+                        self.text("".join(block_lines))
+                    elif block == "STRINGLN":
+                        self.text("".join(text + "\n" for text in block_lines))
+                    block, block_lines = None, []
+                    self._joined(start)
+                else:
+                    block_lines.append(raw_line.lstrip())
+                continue
+            upper = line.upper()
+            if not line or upper == "REM" or upper.startswith("REM ") or line.startswith("//"):
+                continue
+            if upper in ("REM_BLOCK", "STRING", "STRINGLN"):
+                block = "REM" if upper == "REM_BLOCK" else upper
+                continue
+            self.command(raw_line.lstrip())  # trailing spaces are part of a STRING
+            self._joined(start)
+        if block is not None:
+            self.error(f"{block} block not closed")
+        name = self.layout.encode("ascii")
+        return MAGIC + bytes((len(name),)) + name + b"".join(self.ops)
+
+
+def compile_script(source: str, layout: str = "en-US") -> bytes:
+    """Compiles DuckyScript source for a layout, raises DuckyScriptError on the first line that does not compile"""
+    return _Compiler(layout).compile(source)
+
+
+def _disassemble(script: bytes, start: int, end: int, indent: str) -> list:
+    lines = []
+    offset = start
+    while offset < end:
+        op = script[offset]
+        name = _OP_NAMES.get(op, f"0x{op:02x}")
+        if op == TEXT:
+            length = int.from_bytes(script[offset + 1:offset + 3], "little")
+            lines.append(f"{indent}{name} {script[offset + 3:offset + 3 + length].decode('utf-8')!r}")
+            offset += 3 + length
+        elif op in (COMBO, PRESS, RELEASE):
+            count = script[offset + 1]
+            keycodes = script[offset + 2:offset + 2 + count]
+            lines.append(f"{indent}{name} " + " ".join(f"0x{code:02x}" for code in keycodes))
+            offset += 2 + count
+        elif op == DELAY:
+            lines.append(f"{indent}{name} {int.from_bytes(script[offset + 1:offset + 5], 'little')}")
+            offset += 5
+        elif op == LOOP:
+            count = int.from_bytes(script[offset + 1:offset + 3], "little")
+            length = int.from_bytes(script[offset + 3:offset + 5], "little")
+            lines.append(f"{indent}{name} {count}")
+            lines.extend(_disassemble(script, offset + 5, offset + 5 + length, indent + "    "))
+            offset += 5 + length
+        elif op in _OP_NAMES:
+            lines.append(f"{indent}{name} {int.from_bytes(script[offset + 1:offset + 3], 'little')}")
+            offset += 3
+        else:
+            raise ValueError(f"Offset {offset}: unknown op 0x{op:02x}")
+    return lines
+
+
+def disassemble(script: bytes) -> list:
+    """Returns a line per op of a compiled script, the layout first"""
+    if script[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"A script starts with {MAGIC}")
+    start = len(MAGIC) + 1 + script[len(MAGIC)]
+    return [f"LAYOUT {script[len(MAGIC) + 1:start].decode('ascii')}"] + _disassemble(script, start, len(script), "")
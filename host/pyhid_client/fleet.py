@@ -0,0 +1,511 @@
+"""
+Fleet controller: sends the same input to many boards at once, with asyncio.
+
+The inventory is a JSON list of boards:
+
+    [
+        {"name": "lab-01", "host": "10.0.0.21"},
+        {"name": "lab-02", "host": "10.0.0.22", "port": 8080, "layout": "de-DE", "tags": ["rack-b"]}
+    ]
+
+Requests are fanned out concurrently, at most `max_parallel` in flight across the fleet and at most `pool_size`
+per board, each over that board's own pool of keep-alive connections. Every board gets its own result (status,
+body or error, and latency) and a failing board never holds up the others beyond `timeout`. Retries follow the
+same rules as PyHIDClient, nothing a board may have acted on is ever resent.
+
+    python -m pyhid_client.fleet --inventory lab.json type "hello"
+    python -m pyhid_client.fleet --simulate 16 keycodes CONTROL ALT DELETE
+
+With --simulate N, N simulated boards (see simulator.py) are started on local ports instead.
+
+To have every board start at the same moment, rather than whenever its request arrives, sync_clocks estimates each
+board's clock offset through /api/clock and type/keycodes take an `at` time (host time.monotonic_ns()), sent to
+each board as an execute_at in its own clock. The boards hold the job in a timer list until then, and each result's
+started_ns (host time) shows how closely they kept to it. --in-ms does that from the command line:
+
+    python -m pyhid_client.fleet --inventory lab.json --in-ms 500 keycodes CONTROL ALT DELETE
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from .compiler import RECORD_SIZE, ReportCompiler, split_point
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "simulator.py")
+
+
+class _StaleConnection(Exception):
+    """A pooled connection failed once the request was written to it, the board may or may not have read it"""
+
+
+class _NoResponse(ConnectionResetError):
+    """The connection failed before any of the response arrived"""
+
+
+class _Connection:
+    """A keep-alive HTTP/1.1 connection, just enough of the protocol for the board's API"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> "_Connection":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, method: str, path: str, body: bytes, headers: dict):
+        """Sends a request, returns (status, headers, body, keep_alive)"""
+        head = f"{method} {path} HTTP/1.1\r\n"
+        headers = dict(headers, **{"Content-Length": str(len(body))})
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        try:
+            self._writer.write(head.encode() + b"\r\n" + body)
+            await self._writer.drain()
+            status_line = await self._reader.readline()
+        except (ConnectionResetError, BrokenPipeError) as error:
+            raise _NoResponse(str(error)) from error
+        if not status_line:
+            raise _NoResponse("Connection closed before a response")
+        status = int(status_line.split()[1])
+        response_headers = await self._read_headers()
+        length = response_headers.get("content-length")
+        data = await self._reader.readexactly(int(length)) if length else await self._reader.read()
+        keep_alive = response_headers.get("connection", "").lower() == "keep-alive" and length is not None
+        return status, response_headers, data, keep_alive
+
+    async def _read_headers(self) -> dict:
+        """Reads the response headers, names are lower cased"""
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    @property
+    def closed(self) -> bool:
+        """True if the board has closed the connection (an idle keep-alive connection timing out)"""
+        return self._reader.at_eof() or self._writer.is_closing()
+
+    def close(self):
+        self._writer.close()
+
+
+class Board:  # pylint: disable=too-many-instance-attributes
+    """One board in the inventory, with its connection pool"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, name: str, host: str, port: int = 80, *, layout: str = "en-US", tags: list = (), pool_size: int = 2,
+    ):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.layout = layout
+        self.tags = set(tags)
+        self.offset_ns = None  # board time - host time, set by Fleet.sync_clocks
+        self.round_trip_ns = None
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def request(  # pylint: disable=too-many-arguments
+        self, method: str, path: str, body: bytes, content_type: str, retries: int, *, idempotent: bool = None,
+    ):
+        """
+        Sends a request (retrying where that is safe), returns (status, decoded JSON body). A request is only resent
+        after a connection error if it is idempotent, by default only GET requests are.
+        """
+        if idempotent is None:
+            idempotent = method == "GET"
+        headers = {"Host": self.host, "Content-Type": content_type, "Connection": "keep-alive"}
+        attempt = 0
+        async with self._slots:
+            while True:
+                attempt += 1
+                try:
+                    status, response_headers, data = await self._send(method, path, body, headers)
+                except _StaleConnection as error:
+                    self.close()
+                    if not idempotent:
+                        raise error.__cause__
+                    if attempt > retries:
+                        raise
+                    continue
+                except (OSError, asyncio.IncompleteReadError):
+                    if not idempotent or attempt > retries:
+                        raise
+                    continue
+                result = json.loads(data) if data else {}
+                if status == 429 and attempt <= retries:
+                    await asyncio.sleep(float(response_headers.get("retry-after") or 1))
+                    continue
+                return status, result
+
+    async def _send(self, method: str, path: str, body: bytes, headers: dict):
+        # A pooled connection the board has closed is dropped before anything is written to it
+        while self._idle and self._idle[-1].closed:
+            self._idle.pop().close()
+        if self._idle:
+            conn, reused = self._idle.pop(), True
+        else:
+            conn, reused = await self._connect(), False
+        try:
+            status, response_headers, data, keep_alive = await conn.request(method, path, body, headers)
+        except _NoResponse as error:
+            conn.close()
+            if reused:
+                raise _StaleConnection() from error
+            raise
+        except BaseException:
+            conn.close()
+            raise
+        if keep_alive:
+            self._idle.append(conn)
+        else:
+            conn.close()
+        return status, response_headers, data
+
+    async def _connect(self) -> _Connection:
+        """Opens a new connection, retrying a refused connect (nothing has been sent yet, so that is always safe)"""
+        for attempt in range(3):
+            try:
+                return await _Connection.open(self.host, self.port)
+            except ConnectionRefusedError:
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(0.1 * (attempt + 1))
+        raise ConnectionRefusedError(self.name)
+
+    def close(self):
+        """Closes every idle connection"""
+        while self._idle:
+            self._idle.pop().close()
+
+
+class BoardResult:
+    """The outcome of a fan-out on one board"""
+
+    def __init__(self, board: str, status: int = None, body: dict = None, error: str = None, latency_ms: float = 0):
+        self.board = board
+        self.status = status
+        self.body = body
+        self.error = error
+        self.latency_ms = latency_ms
+        self.started_ns = None  # when a scheduled job started on the board, in host time
+
+    @property
+    def ok(self) -> bool:
+        """True if the board answered with a 2xx"""
+        return self.error is None and self.status is not None and 200 <= self.status < 300
+
+    def as_dict(self) -> dict:
+        """The result as a plain dict, for printing or logging"""
+        return {
+            "board": self.board, "ok": self.ok, "status": self.status, "latency_ms": round(self.latency_ms, 2),
+            "error": self.error if self.error else (None if self.ok else (self.body or {}).get("error")),
+        }
+
+
+def _percentile(values: list, percent: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * percent / 100))], 2)
+
+
+def summarise(results: list, elapsed_ms: float = None) -> dict:
+    """
+    Aggregates the results of a fan-out: counts, latency percentiles of the boards that answered and, for scheduled
+    jobs, the skew between the first and last board to start.
+    """
+    latencies = [result.latency_ms for result in results if result.status is not None]
+    started = [result.started_ns for result in results if result.started_ns is not None]
+    return {
+        "boards": len(results),
+        "ok": sum(result.ok for result in results),
+        "failed": sum(not result.ok for result in results),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "max_ms": round(max(latencies), 2) if latencies else None,
+        "elapsed_ms": round(elapsed_ms, 2) if elapsed_ms is not None else None,
+        "skew_ms": round((max(started) - min(started)) / 1_000_000, 3) if started else None,
+    }
+
+
+class Fleet:
+    """The boards in an inventory, and the fan-out of requests to them"""
+
+    def __init__(
+        self, boards: list, *, max_parallel: int = 16, timeout: float = 10.0, retries: int = 2,
+        batch_reports: int = 1024,
+    ):
+        self.boards = boards
+        self.timeout = timeout
+        self.retries = retries
+        self.batch_reports = batch_reports
+        self._parallel = asyncio.Semaphore(max_parallel)
+        self._compilers = {}
+
+    @classmethod
+    def from_inventory(cls, inventory, pool_size: int = 2, **kwargs) -> "Fleet":
+        """Builds a fleet from an inventory, a list of board dicts or the path of a JSON file holding one"""
+        if isinstance(inventory, str):
+            with open(inventory, encoding="utf-8") as inventory_file:
+                inventory = json.load(inventory_file)
+        boards = [Board(pool_size=pool_size, **board) for board in inventory]
+        names = [board.name for board in boards]
+        if len(set(names)) != len(names):
+            raise ValueError("Board names in the inventory must be unique")
+        return cls(boards, **kwargs)
+
+    def select(self, names=None, tags=None) -> list:
+        """Returns the boards with any of the given names or tags, every board if neither is given"""
+        if not names and not tags:
+            return list(self.boards)
+        names, tags = set(names or ()), set(tags or ())
+        return [board for board in self.boards if board.name in names or board.tags & tags]
+
+    async def _one(self, board: Board, method: str, path: str, body: bytes, content_type: str) -> BoardResult:
+        async with self._parallel:
+            start = time.perf_counter()
+            try:
+                status, result = await asyncio.wait_for(
+                    board.request(method, path, body, content_type, self.retries), self.timeout
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                board.close()
+                return BoardResult(board.name, error=repr(error), latency_ms=(time.perf_counter() - start) * 1000)
+            return BoardResult(board.name, status, result, latency_ms=(time.perf_counter() - start) * 1000)
+
+    async def fan_out(
+        self, method: str, path: str, body=b"", content_type: str = "application/json", boards: list = None,
+    ) -> list:
+        """Sends the same request to every board (or `boards`) concurrently, returns a BoardResult per board"""
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        boards = self.boards if boards is None else boards
+        return list(await asyncio.gather(*(self._one(board, method, path, body, content_type) for board in boards)))
+
+    async def get(self, path: str, boards: list = None) -> list:
+        """GETs an endpoint on every board"""
+        return await self.fan_out("GET", path, boards=boards)
+
+    async def sync_clocks(self, samples: int = 8, boards: list = None, parallel: int = 1) -> list:
+        """
+        Estimates every board's clock offset (see PyHIDClient.clock_offset), for scheduling with `at`. Each result's
+        body holds the board's offset_ns and the round trip (us) of the sample it was taken from, half of which
+        bounds the estimate's error. Boards are synced `parallel` at a time, more makes for longer round trips as
+        the exchanges compete for this process. Clocks drift, sync again every few minutes.
+        """
+        boards = self.boards if boards is None else boards
+        slots = asyncio.Semaphore(parallel)
+        return list(await asyncio.gather(*(self._sync_clock(board, samples, slots) for board in boards)))
+
+    async def _sync_clock(self, board: Board, samples: int, slots: asyncio.Semaphore) -> BoardResult:
+        offset_ns = best_ns = None
+        start = time.perf_counter()
+        for _ in range(samples):
+            async with slots:
+                sent_ns = time.monotonic_ns()
+                result = await self._one(board, "GET", "/api/clock", b"", "application/json")
+                round_trip_ns = time.monotonic_ns() - sent_ns
+            if not result.ok:
+                return result
+            if best_ns is None or round_trip_ns < best_ns:
+                offset_ns, best_ns = result.body["monotonic_ns"] - (sent_ns + round_trip_ns // 2), round_trip_ns
+        board.offset_ns, board.round_trip_ns = offset_ns, best_ns
+        body = {"offset_ns": board.offset_ns, "round_trip_us": board.round_trip_ns // 1000}
+        return BoardResult(board.name, 200, body, latency_ms=(time.perf_counter() - start) * 1000)
+
+    @staticmethod
+    def _check_synced(boards: list, at: int):
+        if at is not None:
+            unsynced = [board.name for board in boards if board.offset_ns is None]
+            if unsynced:
+                raise ValueError(f"Scheduling needs the boards' clocks to be synced first (sync_clocks): {unsynced}")
+
+    @staticmethod
+    def _started(board: Board, result: BoardResult) -> BoardResult:
+        """Notes when a scheduled job started, in host time"""
+        if result.ok and isinstance(result.body, dict) and "started_ns" in result.body:
+            result.started_ns = result.body["started_ns"] - board.offset_ns
+        return result
+
+    async def _post(self, board: Board, path: str, body: dict, at: int) -> BoardResult:
+        """POSTs a JSON body to one board, scheduled for `at` (host time) if given"""
+        if at is not None:
+            body = dict(body, execute_at=at + board.offset_ns)
+        result = await self._one(board, "POST", path, json.dumps(body).encode(), "application/json")
+        return self._started(board, result)
+
+    async def keycodes(self, data: list, separate: bool = False, boards: list = None, at: int = None) -> list:
+        """
+        Sends key combos through /api/keycodes (preempting anything being typed) on every board, all starting at
+        `at` (host time.monotonic_ns()) if given.
+        """
+        boards = self.boards if boards is None else boards
+        self._check_synced(boards, at)
+        body = {"data": data, "separate": separate}
+        return list(await asyncio.gather(*(self._post(board, "/api/keycodes", body, at) for board in boards)))
+
+    async def type(
+        self, text: str, wait: float = None, on_board: bool = False, boards: list = None, at: int = None,
+    ) -> list:
+        """
+        Types text on every board, in each board's own layout, all starting at `at` (host time.monotonic_ns()) if
+        given. The text is compiled into raw reports once per layout (on_board=True sends it to /api/type instead).
+        Long text goes as several batches, one after the other on each board, a board's result is that of its last
+        batch or of the first one that failed. Only the first batch is scheduled, the rest follow it.
+        Compiled text assumes Caps Lock is off, /api/type (on_board=True) allows for it on each board.
+        """
+        boards = self.boards if boards is None else boards
+        self._check_synced(boards, at)
+        if on_board:
+            return list(await asyncio.gather(*(
+                self._post(board, "/api/type", {"data": text, "layout": board.layout, "wait": wait}, at)
+                for board in boards
+            )))
+        records = {}
+        for board in boards:
+            if board.layout not in records:
+                compiler = self._compilers.get(board.layout) or ReportCompiler(board.layout)
+                self._compilers[board.layout] = compiler
+                records[board.layout] = compiler.text(text, wait)
+        return list(await asyncio.gather(*(self._send_reports(board, records[board.layout], at) for board in boards)))
+
+    async def _send_reports(self, board: Board, records: bytes, at: int = None) -> BoardResult:
+        batch_size = self.batch_reports * RECORD_SIZE
+        latency_ms = 0
+        path = "/api/reports" if at is None else f"/api/reports?execute_at={at + board.offset_ns}"
+        started_ns = None
+        while True:
+            split = split_point(records, batch_size)
+            result = await self._one(board, "POST", path, records[:split], "application/octet-stream")
+            latency_ms += result.latency_ms
+            started_ns = started_ns or self._started(board, result).started_ns
+            path = "/api/reports"
+            records = records[split:]
+            if not result.ok or not records:
+                result.latency_ms = latency_ms
+                result.started_ns = started_ns
+                return result
+
+    def close(self):
+        """Closes every board's idle connections"""
+        for board in self.boards:
+            board.close()
+
+
+@contextmanager
+def simulated_fleet(
+    count: int, base_port: int = 18700, report_interval: float = 0.0, max_connections: int = 4,
+    clock_offsets: list = None,
+):
+    """
+    Starts `count` simulated boards on consecutive local ports, yields their inventory, stops them on exit.
+    clock_offsets (seconds, one per board) sets the boards' clocks apart from the host's.
+    """
+    clock_offsets = clock_offsets or [0.0] * count
+    boards = [
+        subprocess.Popen(
+            [sys.executable, SIMULATOR, "--port", str(base_port + i), "--report-interval", str(report_interval),
+             "--max-connections", str(max_connections), "--clock-offset", str(clock_offsets[i])],
+            stdout=subprocess.DEVNULL,
+        )
+        for i in range(count)
+    ]
+    inventory = [{"name": f"sim-{i:03}", "host": "127.0.0.1", "port": base_port + i} for i in range(count)]
+    try:
+        asyncio.run(_wait_until_listening(inventory))
+        yield inventory
+    finally:
+        for board in boards:
+            board.terminate()
+        for board in boards:
+            board.wait()
+
+
+async def _wait_until_listening(inventory: list, timeout: float = 30.0):
+    fleet = Fleet.from_inventory(inventory, timeout=1.0, retries=0)
+    deadline = time.monotonic() + timeout
+    waiting = fleet.boards
+    while waiting:
+        results = await fleet.get("/sim/ping", boards=waiting)
+        waiting = [board for board, result in zip(waiting, results) if not result.ok]
+        if waiting and time.monotonic() > deadline:
+            raise TimeoutError(f"Simulated boards did not start: {[board.name for board in waiting]}")
+        if waiting:
+            await asyncio.sleep(0.1)
+    fleet.close()
+
+
+async def _run(args, inventory) -> list:
+    fleet = Fleet.from_inventory(
+        inventory, pool_size=args.pool_size, max_parallel=args.max_parallel, timeout=args.timeout
+    )
+    boards = fleet.select(args.board, args.tag)
+    try:
+        at = None
+        if args.in_ms is not None and args.command != "get":
+            await fleet.sync_clocks(boards=boards)
+            at = time.monotonic_ns() + int(args.in_ms * 1_000_000)
+        if args.command == "type":
+            return await fleet.type(args.text, wait=args.wait, on_board=args.on_board, boards=boards, at=at)
+        if args.command == "keycodes":
+            return await fleet.keycodes(args.keys, separate=args.separate, boards=boards, at=at)
+        return await fleet.get(args.path, boards=boards)
+    finally:
+        fleet.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--inventory", help="JSON file listing the boards")
+    source.add_argument("--simulate", type=int, metavar="N", help="start N simulated boards instead")
+    parser.add_argument("--board", nargs="+", help="only these boards (by name)")
+    parser.add_argument("--tag", nargs="+", help="only boards with any of these tags")
+    parser.add_argument("--max-parallel", type=int, default=16, help="requests in flight across the fleet")
+    parser.add_argument("--pool-size", type=int, default=2, help="connections per board")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds per board")
+    parser.add_argument("--base-port", type=int, default=18700, help="first port used by --simulate")
+    parser.add_argument(
+        "--in-ms", type=float, default=None,
+        help="sync the boards' clocks and start on all of them this many ms from now",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    type_parser = commands.add_parser("type", help="type text")
+    type_parser.add_argument("text")
+    type_parser.add_argument("--wait", type=float, default=None)
+    type_parser.add_argument("--on-board", action="store_true", help="send to /api/type rather than compiling")
+    keycodes_parser = commands.add_parser("keycodes", help="press a key combo, e.g. CONTROL ALT DELETE")
+    keycodes_parser.add_argument("keys", nargs="+")
+    keycodes_parser.add_argument("--separate", action="store_true", help="press the keys one after the other")
+    get_parser = commands.add_parser("get", help="GET an endpoint, e.g. /api/queue")
+    get_parser.add_argument("path")
+    args = parser.parse_args()
+
+    def _report(inventory):
+        start = time.perf_counter()
+        results = asyncio.run(_run(args, inventory))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for result in results:
+            print(json.dumps(result.as_dict()))
+        print(json.dumps(summarise(results, elapsed_ms)))
+
+    if args.simulate:
+        with simulated_fleet(args.simulate, args.base_port) as inventory:
+            _report(inventory)
+    else:
+        _report(args.inventory)
+
+
+if __name__ == "__main__":
+    main()
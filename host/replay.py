@@ -0,0 +1,165 @@
+"""
+Replays a session recorded by a board (see src/lib/session_recorder.py) against a board or a simulated one.
+
+Requests are sent on the recorded schedule, open loop: each one at its recorded offset from the start divided by
+--speed, whether or not earlier ones have been answered, with at most --concurrency in flight. --speed 1 is real
+time, 10 compresses the gaps tenfold and 0 sends everything flat out. Each speed given is run in turn.
+
+    python host/replay.py --download 192.168.1.50 -o session.phs     # fetch (and clear) a board's recording
+    python host/replay.py session.phs --target 192.168.1.51 --speed 1 10 0
+    python host/replay.py session.phs --simulate --speed 1 0           # against a local simulated board
+
+To record: POST /api/session/record {"record": true} (or PyHIDClient.record_session()), use the board, then download.
+"""
+
+import argparse
+import http.client
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyhid_client import PyHIDClient, PyHIDError
+from pyhid_client.fleet import simulated_fleet
+
+# As in src/lib/session_recorder.py
+MAGIC = b"PHS1"
+POST = 1
+BINARY = 2
+QUERY = 4
+_HEADER = "<IBBH"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+
+
+class RecordedRequest:
+    """One request of a recorded session"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, offset_s: float, method: str, path: str, body: bytes, binary: bool, *, query: str = "",
+    ):
+        self.offset_s = offset_s  # from the start of the recording
+        self.method = method
+        self.path = path
+        self.query = query  # as it was sent, without the ?
+        self.body = body
+        self.content_type = "application/octet-stream" if binary else "application/json"
+
+    @property
+    def target(self) -> str:
+        """The path and query string, as the request was sent"""
+        return f"{self.path}?{self.query}" if self.query else self.path
+
+
+def parse_session(log: bytes) -> list:
+    """Parses a downloaded session log into RecordedRequests, raises ValueError if it is not one"""
+    if log[:4] != MAGIC:
+        raise ValueError("Not a pyHID session log")
+    offset = 5
+    routes = []
+    for _ in range(log[4]):
+        length = log[offset]
+        routes.append(log[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+    requests = []
+    elapsed_s = 0.0
+    while offset < len(log):
+        gap_us, flags, route_id, length = struct.unpack_from(_HEADER, log, offset)
+        offset += _HEADER_SIZE
+        elapsed_s += gap_us / 1_000_000
+        query = ""
+        if flags & QUERY:
+            query = log[offset + 1:offset + 1 + log[offset]].decode()
+            offset += 1 + log[offset]
+        body = log[offset:offset + length]
+        offset += length
+        requests.append(RecordedRequest(
+            elapsed_s, "POST" if flags & POST else "GET", routes[route_id], body, bool(flags & BINARY), query=query
+        ))
+    return requests
+
+
+def _send(client: PyHIDClient, request: RecordedRequest, due: float) -> tuple:
+    """Sends one request, returns (status, latency (ms), lateness (ms))"""
+    start = time.perf_counter()
+    try:
+        client.request(request.method, request.target, request.body or None, request.content_type)
+        status = 200
+    except PyHIDError as error:
+        status = error.status
+    except (OSError, http.client.HTTPException):
+        status = None
+    return status, (time.perf_counter() - start) * 1000, (start - due) * 1000
+
+
+def replay(requests: list, host: str, port: int, speed: float, concurrency: int = 4) -> dict:
+    """Replays requests at `speed` (0: flat out), returns a summary"""
+    client = PyHIDClient(host, port, pool_size=concurrency, retries=1)
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        futures = []
+        for request in requests:
+            due = start + (request.offset_s / speed if speed else 0)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            futures.append(executor.submit(_send, client, request, due))
+        results = [future.result() for future in futures]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    client.close()
+    return _summary(requests, results, elapsed_ms)
+
+
+def _summary(requests: list, results: list, elapsed_ms: float) -> dict:
+    latencies = sorted(latency for _, latency, _ in results)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "recorded_ms": round(requests[-1].offset_s * 1000, 1) if requests else 0,
+        "replayed_ms": round(elapsed_ms, 1),
+        "statuses": statuses,
+        "p50_ms": round(latencies[len(latencies) // 2], 2) if latencies else None,
+        "p95_ms": round(latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)], 2) if latencies else None,
+        "max_late_ms": round(max(late for _, _, late in results), 2) if results else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("session", nargs="?", help="a downloaded session log")
+    parser.add_argument("--download", metavar="HOST", help="download the session recorded by this board")
+    parser.add_argument("-o", "--output", default="session.phs", help="where --download saves the log")
+    parser.add_argument("--target", help="board to replay against")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument("--simulate", action="store_true", help="replay against a local simulated board")
+    parser.add_argument(
+        "--speed", type=float, nargs="+", default=[1.0], help="1: real time, N: N times faster, 0: flat out"
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at most")
+    args = parser.parse_args()
+
+    if args.download:
+        with PyHIDClient(args.download, args.port) as client:
+            log = client.download_session()
+        with open(args.output, "wb") as log_file:
+            log_file.write(log)
+        print(f"{len(parse_session(log))} requests saved to {args.output}")
+        return
+    if not args.session or not (args.target or args.simulate):
+        parser.error("give a session log and --target or --simulate")
+    with open(args.session, "rb") as log_file:
+        requests = parse_session(log_file.read())
+
+    def _run(host: str, port: int):
+        for speed in args.speed:
+            print(f"speed {speed:g}x" if speed else "flat out", replay(requests, host, port, speed, args.concurrency))
+
+    if args.simulate:
+        with simulated_fleet(1, max_connections=args.concurrency) as inventory:
+            _run(inventory[0]["host"], inventory[0]["port"])
+    else:
+        _run(args.target, args.port)
+
+
+if __name__ == "__main__":
+    main()
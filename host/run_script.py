@@ -0,0 +1,49 @@
+"""
+Compiles a DuckyScript file into the board's script bytecode (see pyhid_client/ducky.py) and runs it with a single
+POST /api/script.
+
+    python host/run_script.py payload.txt --dump                      # compile and print the ops
+    python host/run_script.py payload.txt --layout de-DE --host 192.168.1.50
+    python host/run_script.py payload.txt --out payload.phb           # keep the compiled script
+
+Exits with status 1 if the script does not compile.
+"""
+
+import argparse
+import sys
+import time
+
+from pyhid_client import DuckyScriptError, PyHIDClient, compile_script, disassemble
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", help="DuckyScript source file")
+    parser.add_argument("--layout", default="en-US", help="the target's keyboard layout")
+    parser.add_argument("--host", help="the board to run the script on")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument("--dump", action="store_true", help="print the compiled ops")
+    parser.add_argument("--out", help="save the compiled script here")
+    args = parser.parse_args()
+
+    with open(args.script, encoding="utf-8") as source:
+        try:
+            script = compile_script(source.read(), args.layout)
+        except DuckyScriptError as error:
+            print(f"{args.script}: {error}", file=sys.stderr)
+            raise SystemExit(1) from None
+    print(f"{args.script}: {len(script)} bytes")
+    if args.dump:
+        print("\n".join(disassemble(script)))
+    if args.out:
+        with open(args.out, "wb") as out:
+            out.write(script)
+    if args.host:
+        with PyHIDClient(args.host, args.port) as board:
+            start = time.perf_counter()
+            board.run_script(script)
+            print(f"ran in {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+A CPython stand-in for a pyHID board.
+
+Runs the real src/code.py on the host: the CircuitPython only modules (usb_hid, microcontroller, supervisor,
+watchdog, micropython) are replaced with simulated ones and the server listens on a local TCP port instead of the
+Wiznet chip.
+HID reports are recorded rather than sent, optionally taking `report_interval` seconds each to mimic USB polling.
+
+    requirements (pip): adafruit-circuitpython-httpserver, adafruit-circuitpython-hid
+    plus config_utils from the circuit-python-utils submodule
+
+    python host/simulator.py --port 8080 --max-connections 4
+
+The simulator also answers a few routes of its own, under /sim:
+    GET /sim/ping      answers as soon as the board is serving
+    GET /sim/reports   returns (and clears) the recorded HID reports as [device, t_ns, hex report]
+    GET /sim/leds      sets the keyboard LEDs the host reports, e.g. /sim/leds?value=2 for Caps Lock
+    GET /sim/stall     holds the board up for ?seconds=N inside a handler, as a hung request would
+
+The watchdog (the "watchdog" section of pyhid_config.json) is checked after every poll and, where the host has
+interval timers, every 50 ms from a signal handler, so it also fires in the middle of a stalled request. In RAISE mode
+that raises WatchDogTimeout wherever the board is, in RESET mode the board resets straight away. A reset (or a
+soft reload) re-executes the simulator with the same device directory, nvm is kept there in nvm.bin, so a stall
+persisted before a reset is reported by /api/watchdog after it (see host/check_watchdog.py).
+
+Report timestamps are the host's time.monotonic_ns(), so those of simulators on one host can be compared. The
+board's own clock can be set apart from it with --clock-offset, to try out clock synchronisation (see /api/clock).
+"""
+
+import argparse
+import http.client
+import json
+import os
+import runpy
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import types
+from collections import deque
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+SRC_DIR = os.path.join(REPO_DIR, "src")
+LIB_DIR = os.path.join(SRC_DIR, "lib")
+SUBMODULES_DIR = os.path.join(REPO_DIR, "submodules")
+
+KEYBOARD = (0x01, 0x06)
+MOUSE = (0x01, 0x02)
+CAPS_LOCK = 0x39
+LED_CAPS_LOCK = 0x02
+NVM_FILE = "nvm.bin"
+NVM_SIZE = 4096
+# Set for the re-executed simulator, microcontroller.cpu.reset_reason after a reset
+RESET_REASON_ENV = "PYHID_SIM_RESET_REASON"
+WATCHDOG_CHECK_INTERVAL = 0.05
+
+_host_monotonic_ns = time.monotonic_ns
+
+
+class SimulatedHIDDevice:
+    """Records every report sent to it, in place of a usb_hid.Device"""
+
+    def __init__(self, name: str, usage_page: int, usage: int, report_interval: float = 0.0, history: int = 65536):
+        self.name = name
+        self.usage_page = usage_page
+        self.usage = usage
+        self.report_interval = report_interval
+        self.reports = deque(maxlen=history)
+        # Set this to emulate an OUT report from the host (e.g. keyboard LEDs)
+        self.last_received_report = None
+
+    def send_report(self, report, report_id: int = None):  # pylint: disable=unused-argument
+        """
+        Records the report, waiting report_interval seconds as a USB poll would. A keyboard's Caps Lock LED is
+        toggled whenever Caps Lock is pressed, as the host's OS would.
+        """
+        if self.report_interval:
+            time.sleep(self.report_interval)
+        if (self.usage_page, self.usage) == KEYBOARD and CAPS_LOCK in report[2:8]:
+            previous = self.reports[-1][1] if self.reports else bytes(8)
+            if CAPS_LOCK not in previous[2:8]:
+                leds = self.last_received_report[0] if self.last_received_report else 0
+                self.last_received_report = bytes((leds ^ LED_CAPS_LOCK,))
+        self.reports.append((_host_monotonic_ns(), bytes(report)))
+
+    def get_last_received_report(self, report_id: int = None):  # pylint: disable=unused-argument
+        """Returns the last OUT report set by the test/simulation, if any"""
+        return self.last_received_report
+
+
+class _Device:
+    """usb_hid.Device, only used for its constants. Simulated devices are not instances of it, so adafruit_hid does
+    not wait for USB to be connected."""
+
+    KEYBOARD = KEYBOARD
+    MOUSE = MOUSE
+
+
+class _NoDelayListener:
+    """
+    Wraps the listening socket so accepted connections have Nagle's algorithm turned off. The server writes a
+    response's headers and body separately, on a host TCP stack that holds the body back until the client's delayed
+    ACK (~40 ms) on a kept alive connection. The W5500 sends every write straight away, as this does.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def accept(self):
+        conn, address = self._sock.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, address
+
+
+class _ReusableAddressPool:
+    """
+    The socket module as the server's socket pool, with SO_REUSEADDR set on new sockets so a rebooted simulator can
+    listen again straight away, while connections the last run closed are still in TIME_WAIT.
+    """
+
+    def __getattr__(self, name):
+        return getattr(socket, name)
+
+    @staticmethod
+    def socket(*args, **kwargs):
+        sock = socket.socket(*args, **kwargs)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        return sock
+
+
+class SimulatedReset(SystemExit):
+    """Raised by microcontroller.reset() when there is no device directory to reboot with, stops the simulated board"""
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def set_clock_offset(offset: float):
+    """Sets the board's clock (time.monotonic and time.monotonic_ns) `offset` seconds apart from the host's"""
+    offset_ns = int(offset * 1_000_000_000)
+    time.monotonic_ns = lambda: _host_monotonic_ns() + offset_ns
+    time.monotonic = lambda: time.monotonic_ns() / 1_000_000_000
+
+
+def _load_nvm(device_dir: str) -> bytearray:
+    """microcontroller.nvm, as the last run left it in device_dir"""
+    nvm = bytearray(NVM_SIZE)
+    if device_dir is not None and os.path.exists(os.path.join(device_dir, NVM_FILE)):
+        with open(os.path.join(device_dir, NVM_FILE), "rb") as nvm_file:
+            data = nvm_file.read(NVM_SIZE)
+        nvm[:len(data)] = data
+    return nvm
+
+
+def install_simulated_modules(
+    report_interval: float = 0.0, absolute_mouse: bool = False, device_dir: str = None,
+) -> list:
+    """
+    Installs the simulated CircuitPython modules into sys.modules, returns the simulated HID devices.
+    absolute_mouse adds the absolute pointer, as boot.py would. With a device_dir, nvm is kept there and a reset
+    reboots the simulated board (re-executes the simulator), otherwise a reset stops it.
+    """
+    sys.path.insert(0, LIB_DIR)
+    for submodule in ("circuit-python-utils", "Adafruit_CircuitPython_HTTPServer"):
+        sys.path.append(os.path.join(SUBMODULES_DIR, submodule))
+    from pyhid_watchdog import SimulatedWatchDog, SimulatedWatchDogTimeout
+
+    devices = [
+        SimulatedHIDDevice("keyboard", *KEYBOARD, report_interval=report_interval),
+        SimulatedHIDDevice("mouse", *MOUSE, report_interval=report_interval),
+    ]
+    if absolute_mouse:
+        devices.append(SimulatedHIDDevice("absolute_mouse", *MOUSE, report_interval=report_interval))
+
+    nvm = _load_nvm(device_dir)
+    # runpy.run_path replaces sys.argv[0] with code.py, the simulator is re-executed with its own
+    argv = [sys.executable] + sys.argv
+
+    def _reboot(reason: str):
+        if device_dir is None:
+            raise SimulatedReset(f"microcontroller.reset() ({reason})")
+        with open(os.path.join(device_dir, NVM_FILE), "wb") as nvm_file:
+            nvm_file.write(nvm)
+        os.environ[RESET_REASON_ENV] = reason
+        os.execv(sys.executable, argv)
+
+    def _reload():
+        # A soft reload re-runs code.py in a fresh interpreter, the closest thing on a host
+        os.execv(sys.executable, argv)
+
+    _module(
+        "usb_hid",
+        devices=devices,
+        Device=_Device,
+        enable=lambda *args, **kwargs: None,
+    )
+    _module(
+        "microcontroller",
+        reset=lambda: _reboot("SOFTWARE"),
+        nvm=nvm,
+        watchdog=SimulatedWatchDog(),
+        cpu=types.SimpleNamespace(reset_reason=os.environ.pop(RESET_REASON_ENV, "POWER_ON"), temperature=25.0),
+        reboot=_reboot,
+    )
+    # adafruit_hid only needs micropython.const, which Blinka would otherwise provide
+    _module("micropython", const=lambda value: value)
+    _module("supervisor", reload=_reload, runtime=types.SimpleNamespace(usb_connected=True))
+    _module(
+        "watchdog",
+        WatchDogMode=types.SimpleNamespace(RAISE="WatchDogMode.RAISE", RESET="WatchDogMode.RESET"),
+        WatchDogTimeout=SimulatedWatchDogTimeout,
+    )
+    return devices
+
+
+def check_watchdog():
+    """
+    Fires the simulated watchdog if it has not been fed within its timeout: raises WatchDogTimeout in RAISE mode,
+    resets the board in RESET mode.
+    """
+    microcontroller = sys.modules["microcontroller"]
+    wdt = microcontroller.watchdog
+    if wdt.expired() and wdt.mode == sys.modules["watchdog"].WatchDogMode.RESET:
+        wdt.deinit()
+        microcontroller.reboot("WATCHDOG")
+    wdt.check()
+
+
+def _drive_watchdog():
+    """Checks the watchdog from a signal handler as well, so it fires in the middle of a request that never returns"""
+    if not hasattr(signal, "setitimer"):
+        return
+    signal.signal(signal.SIGALRM, lambda signum, frame: check_watchdog())
+    signal.setitimer(signal.ITIMER_REAL, WATCHDOG_CHECK_INTERVAL, WATCHDOG_CHECK_INTERVAL)
+
+
+def _host_server_factory(port: int, devices: list):
+    """Returns a create_server board bucket that serves on a local TCP port"""
+
+    def _sim_routes(server_class):
+        class SimulatedServer(server_class):
+            """Serves the simulator's own /sim routes ahead of the app routes"""
+
+            def start(self, host: str, port_: int = 80):  # pylint: disable=unused-argument
+                super().start(host, port)
+                self._sock = _NoDelayListener(self._sock)
+
+            def poll(self):
+                from hid_queue import HID_QUEUE
+                result = super().poll()
+                # While the HID queue has nothing to do wait briefly for network activity rather than spinning, a
+                # board has a core to itself but a host running dozens of simulated boards does not
+                due_ns = HID_QUEUE.next_due_ns()
+                wait = 0.001 if due_ns is None else min(0.001, (due_ns - time.monotonic_ns()) / 1_000_000_000)
+                if wait > 0:
+                    socks = [self._sock._sock] + [conn.sock for conn in getattr(self, "_connections", ())]
+                    select.select(socks, [], [], wait)
+                check_watchdog()
+                return result
+
+            def _handle_request(self, request, handler):
+                from adafruit_httpserver import JSONResponse
+                if request.path == "/sim/ping":
+                    return JSONResponse(request, {"ok": True})
+                if request.path == "/sim/reports":
+                    reports = []
+                    for device in devices:
+                        while device.reports:
+                            timestamp, report = device.reports.popleft()
+                            reports.append([device.name, timestamp, report.hex()])
+                    reports.sort(key=lambda report: report[1])
+                    return JSONResponse(request, {"reports": reports})
+                if request.path == "/sim/leds":
+                    devices[0].last_received_report = bytes((int(request.query_params.get("value", 0)),))
+                    return JSONResponse(request, {"ok": True})
+                if request.path == "/sim/stall":
+                    from pyhid_watchdog import WATCHDOG
+                    WATCHDOG.crumb("handler", request.path)
+                    time.sleep(float(request.query_params.get("seconds", 1)))
+                    return JSONResponse(request, {"ok": True})
+                return super()._handle_request(request, handler)
+
+        return SimulatedServer
+
+    def get_server(config_file_path: str, static_file_path: str = "/static", debug: bool = False,
+                   max_connections: int = 1, keep_alive_timeout: float = 0) -> tuple:
+        from dispatch_server import DispatchServer
+        from concurrent_server import ConcurrentServer
+        with open(config_file_path, encoding="utf-8") as config_file:
+            host = json.load(config_file).get("ipv4_addr") or "127.0.0.1"
+        # The board's static directory is at the root of CIRCUITPY
+        static_file_path = os.path.join(SRC_DIR, static_file_path.lstrip("/"))
+        if max_connections > 1:
+            server = _sim_routes(ConcurrentServer)(
+                _ReusableAddressPool(), static_file_path, debug=debug, max_connections=max_connections,
+                keep_alive_timeout=keep_alive_timeout,
+            )
+        else:
+            server = _sim_routes(DispatchServer)(_ReusableAddressPool(), static_file_path, debug=debug)
+        return server, host
+
+    return get_server
+
+
+def prepare_device_dir(device_dir: str, port: int, pyhid_overrides: dict = None, host: str = "127.0.0.1"):
+    """Copies the device's config files into device_dir, pointed at the simulated board"""
+    for name in ("config", "boot_kbd"):
+        shutil.copytree(os.path.join(SRC_DIR, name), os.path.join(device_dir, name), dirs_exist_ok=True)
+    pyhid_config_path = os.path.join(device_dir, "config", "pyhid_config.json")
+    with open(pyhid_config_path, encoding="utf-8") as config_file:
+        pyhid_config = json.load(config_file)
+    pyhid_config["board"] = "host"
+    pyhid_config.update(pyhid_overrides or {})
+    with open(pyhid_config_path, "w", encoding="utf-8") as config_file:
+        json.dump(pyhid_config, config_file, indent=4)
+    with open(os.path.join(device_dir, "config", "net_config.json"), "w", encoding="utf-8") as config_file:
+        json.dump({"ipv4_addr": host, "port": port}, config_file, indent=4)
+
+
+def run(
+    port: int, pyhid_overrides: dict = None, report_interval: float = 0.0, device_dir: str = None,
+    clock_offset: float = 0.0,
+):
+    """Runs src/code.py as a simulated board listening on 127.0.0.1:port. Does not return."""
+    if device_dir is None:
+        device_dir = tempfile.mkdtemp(prefix=f"pyhid-sim-{port}-")
+        # supervisor.reload() re-executes the simulator, it has to come back with the same (possibly edited) config
+        sys.argv += ["--device-dir", device_dir]
+    if not os.path.isdir(os.path.join(device_dir, "config")):
+        prepare_device_dir(device_dir, port, pyhid_overrides)
+    with open(os.path.join(device_dir, "config", "pyhid_config.json"), encoding="utf-8") as config_file:
+        absolute_mouse = json.load(config_file).get("absolute_mouse", False)
+    devices = install_simulated_modules(report_interval, absolute_mouse, device_dir)
+    if clock_offset:
+        set_clock_offset(clock_offset)
+    _drive_watchdog()
+    import create_server
+    create_server.SUPPORTED_DEVICES["host"] = _host_server_factory(port, devices)
+    os.chdir(device_dir)
+    runpy.run_path(os.path.join(SRC_DIR, "code.py"), run_name="__main__")
+
+
+def wait_until_listening(port: int, host: str = "127.0.0.1", timeout: float = 10.0):
+    """
+    Blocks until the simulated board on host:port answers GET /sim/ping, for scripts that start simulators.
+    A real request is sent as a bare connect/close would tie up a single connection server until it times out.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request("GET", "/sim/ping")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Simulated board on {host}:{port} did not start listening")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-connections", type=int, default=None, help="overrides pyhid_config.json")
+    parser.add_argument("--report-interval", type=float, default=0.0, help="seconds each HID report takes")
+    parser.add_argument("--clock-offset", type=float, default=0.0, help="seconds the board's clock is off the host's")
+    parser.add_argument("--config", type=json.loads, default={}, help="JSON merged into pyhid_config.json")
+    parser.add_argument(
+        "--device-dir", default=None, help="where the board's config lives, created if missing (default: a temp dir)"
+    )
+    args = parser.parse_args()
+    overrides = dict(args.config)
+    if args.max_connections is not None:
+        overrides["max_connections"] = args.max_connections
+    run(args.port, overrides, args.report_interval, args.device_dir, args.clock_offset)
+
+
+if __name__ == "__main__":
+    main()
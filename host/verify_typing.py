@@ -0,0 +1,121 @@
+"""
+Checks that typing decodes back to the intended text, layout by layout (see pyhid_client/decoder.py).
+
+Without --port, every character each layout's tables claim to type is compiled and decoded again, which catches
+tables that disagree with themselves (AltGr flags, dead keys, keys given two characters). With --port, text is typed
+on a simulated board (see simulator.py) both through /api/type and as compiled /api/reports records, the board's
+reports are fetched and decoded, and the first divergence of each is printed.
+
+    python host/verify_typing.py
+    python host/verify_typing.py --port 8080 --layout de-DE fr-FR --caps-lock
+    python host/verify_typing.py --port 8080 --text "Grüße" --wait 0.01
+
+Exits with status 1 if anything diverged.
+"""
+
+import argparse
+import http.client
+import json
+import random
+import time
+
+from pyhid_client import PyHIDClient
+from pyhid_client.compiler import _install_shims
+from pyhid_client.decoder import _layout_chars, check_layout, verify
+
+_install_shims()
+from supported_keyboards import SUPPORTED_KEYBOARDS, get_layout  # pylint: disable=wrong-import-position
+
+LED_CAPS_LOCK = 2
+
+
+def sample_text(layout: str, length: int, seed: int = 0) -> str:
+    """Random text made of every character the layout types (control characters left out), at least once each"""
+    layout_class = get_layout(layout)
+    chars = sorted(
+        {char for char in _layout_chars(layout_class) if char.isprintable()}
+        | {chr(char) for char in layout_class.COMBINED_KEYS}
+    )
+    rng = random.Random(seed)
+    text = chars + [rng.choice(chars) for _ in range(max(0, length - len(chars)))]
+    rng.shuffle(text)
+    return "".join(text)
+
+
+def _sim(host: str, port: int, path: str) -> dict:
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request("GET", path)
+    result = json.loads(conn.getresponse().read())
+    conn.close()
+    return result
+
+
+def _keyboard_reports(host: str, port: int) -> list:
+    reports = _sim(host, port, "/sim/reports")["reports"]
+    return [bytes.fromhex(report) for device, _, report in reports if device == "keyboard"]
+
+
+def _wait_idle(board: PyHIDClient):
+    while True:
+        status = board.queue_status()
+        if not status["depth"] and not status["scheduled"]:
+            return
+        time.sleep(0.05)
+
+
+def check_board(args, layout: str, text: str) -> bool:
+    """Types text both ways on the simulated board, returns True if both decode to it"""
+    ok = True
+    with PyHIDClient(args.host, args.port) as board:
+        for mode in ("board", "compiled"):
+            _sim(args.host, args.port, f"/sim/leds?value={LED_CAPS_LOCK if args.caps_lock else 0}")
+            _keyboard_reports(args.host, args.port)  # anything left over
+            start = time.perf_counter()
+            if mode == "board":
+                board.type_on_board(text, layout, args.wait)
+            else:
+                board.type(text, layout, args.wait, caps_lock=args.caps_lock)
+            _wait_idle(board)
+            elapsed = time.perf_counter() - start
+            reports = _keyboard_reports(args.host, args.port)
+            result = verify(text, reports, layout, args.caps_lock)
+            ok = ok and result["ok"]
+            line = f"{layout} {mode}: {len(text)} chars, {len(reports)} reports, {len(reports) / elapsed:.0f} reports/s"
+            if result["divergence"] is not None:
+                at = result["divergence"]
+                line += f", diverges at {at}: expected {text[at:at + 10]!r}, got {result['decoded'][at:at + 10]!r}"
+            print(line + (" ok" if result["ok"] else ""))
+            for issue in result["issues"][:5]:
+                print("   ", issue)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layout", nargs="+", default=list(SUPPORTED_KEYBOARDS), choices=list(SUPPORTED_KEYBOARDS))
+    parser.add_argument("--port", type=int, help="a simulated board to type on")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--text", help="text to type, random text using every character of the layout if not given")
+    parser.add_argument("--length", type=int, default=500, help="length of the random text")
+    parser.add_argument("--wait", type=float, help="seconds between characters")
+    parser.add_argument("--caps-lock", action="store_true", help="type with the host's Caps Lock on")
+    args = parser.parse_args()
+
+    ok = True
+    for layout in args.layout:
+        if args.port:
+            ok = check_board(args, layout, args.text or sample_text(layout, args.length)) and ok
+            continue
+        result = check_layout(layout)
+        ok = ok and not result["wrong"] and not result["collisions"]
+        print(f"{layout}: {result['chars']} characters, {len(result['wrong'])} wrong, "
+              f"{len(result['collisions'])} collisions")
+        for char, decoded in result["wrong"].items():
+            print(f"    {char!r} decodes as {decoded!r}")
+        for first, second in result["collisions"]:
+            print(f"    {first!r} and {second!r} are on the same key")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,28 @@ import storage
 import usb_cdc
 import usb_midi
 
+from absolute_mouse import device as absolute_mouse_device
+from config_files import read_config
+
+
+def _absolute_mouse_enabled() -> bool:
+    """Whether pyhid_config.json asks for the absolute pointer (see lib/absolute_mouse.py)"""
+    try:
+        return bool(read_config("config/pyhid_config.json").get("absolute_mouse", False))
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+hid_devices = [usb_hid.Device.KEYBOARD, usb_hid.Device.MOUSE]
+if _absolute_mouse_enabled():
+    hid_devices.append(absolute_mouse_device())
+
 if "enable" in [x.lower() for x in os.listdir("boot_kbd")]:
     storage.disable_usb_drive()  # disable CIRCUITPY USB storage
     storage.remount("/", False)  # enable Pico's file system to be writable by circuit python
     usb_cdc.disable()            # disable REPL
     usb_midi.disable()           # disable MIDI
-    usb_hid.enable((usb_hid.Device.KEYBOARD, usb_hid.Device.MOUSE), boot_device=1)
+    usb_hid.enable(tuple(hid_devices), boot_device=1)
+elif len(hid_devices) > 2:
+    # The CircuitPython defaults plus the absolute pointer
+    usb_hid.enable((usb_hid.Device.KEYBOARD, usb_hid.Device.MOUSE, usb_hid.Device.CONSUMER_CONTROL, hid_devices[2]))
@@ -7,28 +7,104 @@
         ever arrives)
 """
 
+# Imported first so the start up profile covers every other import
+from startup_profile import PROFILE  # pylint: disable=wrong-import-order
+
+# Each of these is imported as a start up phase of its own (see /api/startup), leaves first, so how long each module
+# takes to load (compiled from source or not, see host/build_bundle.py) and how much heap it takes can be told apart
+PROFILE.imports((
+    "adafruit_httpserver", "adafruit_hid.keyboard", "config_utils", "config_files", "pyhid_log", "hid_queue",
+    "fixed_fields", "health", "streamed_response", "static_files", "server_timing", "dispatch_server", "key_state",
+    "session_recorder", "absolute_mouse", "raw_reports", "hid_script", "unicode_input", "caps_lock", "usb_hid_helpers",
+    "job_events", "supported_keyboards", "concurrent_server", "create_server", "get_boot_kbd", "pyhid_watchdog",
+))
+
+# pylint: disable=wrong-import-position
 import os
+import time
 
 import microcontroller
+import supervisor
+from watchdog import WatchDogMode, WatchDogTimeout
 
 from adafruit_httpserver import Request, JSONResponse, GET, POST
 
-# circuit-python-utils
-from config_utils import get_config_from_json_file
+from config_files import read_config
 
 # usb_hid_helpers
-from usb_hid_helpers import type_chars, type_keycodes, json_resp, json_resp_get
+from usb_hid_helpers import (
+    type_chars, type_keycodes, send_reports, run_script, hold_keys, release_keys, key_state, keyboard_leds,
+    place_pointer, json_resp, json_resp_get, binary_resp, validate_defaults, set_defaults, get_keyboard, get_mouse
+)
+from supported_keyboards import load_all_layouts
 # HTTP server
 from create_server import get_server_and_ip
 
 from get_boot_kbd import get_boot_enable_path, BOOT_KBD_DIR
 
+from pyhid_log import LOG
+from server_timing import TIMER
+from pyhid_watchdog import WATCHDOG
+from hid_queue import HID_QUEUE
+from health import HEALTH
+from static_files import STATIC
+from job_events import job_event_stream
+from key_state import KEY_STATE
+from session_recorder import RECORDER
+# pylint: enable=wrong-import-position
+
+PROFILE.mark("imports")
+
 # config files
-PYHID_CONFIG = get_config_from_json_file("config/pyhid_config.json")
+PYHID_CONFIG_PATH = "config/pyhid_config.json"
+NET_CONFIG_PATH = "config/net_config.json"
+PYHID_CONFIG = read_config(PYHID_CONFIG_PATH)
+NET_CONFIG = read_config(NET_CONFIG_PATH)
 API_ENDPOINTS = PYHID_CONFIG["api_endpoints"]
+# Set by a config reload that changed the network settings, acted on once the response has been sent.
+RESTART_NETWORK = False
+
+
+def _apply_settings(pyhid_config: dict):
+    """
+    Applies everything in pyhid_config.json that can change without touching the server or network. Every section is
+    validated before any is applied, so a bad value in one leaves all of them as they were.
+    """
+    defaults = validate_defaults(pyhid_config.get("defaults", {}))
+    log = LOG.validate(**pyhid_config.get("log", {}))
+    queue = HID_QUEUE.validate(**pyhid_config.get("queue", {}))
+    session = RECORDER.validate(**pyhid_config.get("session", {}))
+    LOG.configure(**log)
+    HID_QUEUE.configure(**queue)
+    RECORDER.configure(**session)
+    set_defaults(defaults)
+    TIMER.enabled = pyhid_config.get("server_timing", False)
+
 
-# Configure server
-server, listening_ip = get_server_and_ip(PYHID_CONFIG["board"], config_file_path="config/net_config.json")
+_apply_settings(PYHID_CONFIG)
+PROFILE.mark("config")
+
+# Fast boot brings the network up first, the HID objects and layouts are then created/imported by the first request
+# that needs them. Otherwise everything is ready before the server starts listening.
+if not PYHID_CONFIG.get("fast_boot", False):
+    get_keyboard()
+    get_mouse()
+    PROFILE.mark("hid")
+    load_all_layouts(PROFILE.mark)
+
+# Configure server. The request log lives in RAM (see /api/logs), debug prints are opt in as they are synchronous
+# and nobody can read them in boot keyboard mode anyway.
+server, listening_ip = get_server_and_ip(
+    PYHID_CONFIG["board"],
+    config_file_path=NET_CONFIG_PATH,
+    debug=PYHID_CONFIG.get("debug", False),
+    max_connections=PYHID_CONFIG.get("max_connections", 1),
+    keep_alive_timeout=PYHID_CONFIG.get("keep_alive_timeout", 0),
+)
+PROFILE.mark("network")
+# The web console, from the gzipped files host/build_console.py put in the static directory (if any)
+STATIC.load(server.root_path)
+PROFILE.mark("static")
 
 
 def _disable_boot_keyboard():
@@ -38,22 +114,47 @@ def _disable_boot_keyboard():
         os.rename(boot_enable_path, f"{BOOT_KBD_DIR}/disable")
 
 
+def _set_server_timing(_, input_data: dict):
+    """Switches the Server-Timing response header on or off"""
+    TIMER.enabled = input_data["enabled"]
+
+
+def _record_session(_, input_data: dict):
+    """Starts or stops recording requests"""
+    if input_data["record"]:
+        return RECORDER.start(input_data.get("capacity"))
+    return RECORDER.stop()
+
+
+def _device_clock() -> dict:
+    """The device's clock, as used by execute_at"""
+    return {"monotonic_ns": time.monotonic_ns()}
+
+
 def _hard_reset():
     """In a very unfriendly way, this resets the device"""
     microcontroller.reset()
 
 
-@server.route(API_ENDPOINTS["type"], POST)
 def type_into_device(request: Request) -> JSONResponse:
-    """Type into the device via a simple input string. If no layout is specified, en-US is used."""
+    """
+    Type into the device via a simple input string. If no layout is specified, the default layout is used.
+    "caps_lock" ("invert", "toggle" or "ignore") overrides how letters are typed while the host has Caps Lock on.
+    "unicode" ("windows", "windows_hex", "linux" or "macos") types the characters the layout has no key for with the
+    host's Unicode input, {"data": "π ≈ 3.14", "unicode": "linux"}. Without one, text with any of them is a 400.
+    """
     return json_resp(
         request,
         type_chars,
-        {"required_keys": {"data": str}, "optional_keys": {"layout": str, "wait": (int, float)}}
+        {
+            "required_keys": {"data": str},
+            "optional_keys": {
+                "layout": str, "wait": (int, float), "caps_lock": str, "unicode": str, "execute_at": int,
+            },
+        }
     )
 
 
-@server.route(API_ENDPOINTS["type_keycodes"], POST)
 def type_keycodes_into_device(request: Request) -> JSONResponse:
     """
     Types into the connected device via keycodes, maximum of six pressed at one time.
@@ -68,25 +169,285 @@ def type_keycodes_into_device(request: Request) -> JSONResponse:
         {"data": ["F5", ["SHIFT", "T"], ["CONTROL", "SHIFT", "ESCAPE"]]}
     Single key codes in flat list:
         {"data": ["KEYPAD_FIVE", "C", "ESCAPE"], "separate": True}
+    Loops, {"repeat": <count>, "data": [...]} (nested up to four deep), are typed without being expanded first:
+        {"data": [{"repeat": 40, "data": ["TAB"]}, "ENTER"]}
+        {"data": [{"repeat": 3, "data": [{"repeat": 5, "data": ["DOWN_ARROW"]}, ["SHIFT", "TAB"]]}]}
     """
     return json_resp(
         request,
         type_keycodes,
-        {"required_keys": {"data": list}, "optional_keys": {"wait": (int, float), "separate": bool}}
+        {
+            "required_keys": {"data": list},
+            "optional_keys": {"wait": (int, float), "separate": bool, "execute_at": int},
+        }
     )
 
 
-@server.route(API_ENDPOINTS["disable_boot_keyboard"], GET)
+def send_raw_reports(request: Request) -> JSONResponse:
+    """
+    Sends keyboard/mouse reports computed on the host, as fast as the USB HID devices take them.
+    The body is binary, a sequence of 10 byte records: device (0 keyboard, 1 mouse, 2 absolute pointer), delay after
+    the report (ms), then the 8 byte report (mouse reports are padded to 8). E.g. typing "a" with a 10ms gap:
+        00 0a 00 00 04 00 00 00 00 00
+        00 00 00 00 00 00 00 00 00 00
+    """
+    return binary_resp(request, send_reports)
+
+
+def run_hid_script(request: Request) -> JSONResponse:
+    """
+    Runs a script of HID ops (text, key combos, held keys, delays, loops) compiled on the host, DuckyScript for
+    instance (host/pyhid_client/ducky.py), as a single job with its delays kept by the board. The body is binary, the
+    format is in hid_script.py. Scripts are limited by max_reports (estimated) and can be scheduled with execute_at.
+    """
+    return binary_resp(request, run_script)
+
+
+def press_keys(request: Request) -> JSONResponse:
+    """
+    Presses keys and keeps them held until they are released (/api/keys/release) or "hold" seconds have passed
+    (at most max_hold, see the defaults in pyhid_config.json). At most six keys plus modifiers can be held. Any other
+    HID output (typing, key combos, raw reports) releases held keys.
+        {"data": ["SHIFT", "W"], "hold": 2.5}
+    """
+    return json_resp(
+        request,
+        hold_keys,
+        {"required_keys": {"data": list}, "optional_keys": {"hold": (int, float), "execute_at": int}}
+    )
+
+
+def release_held_keys(request: Request) -> JSONResponse:
+    """Releases held keys, e.g. {"data": ["W"]}. Every key is released if there is no "data", {}."""
+    return json_resp(request, release_keys, {"required_keys": {}, "optional_keys": {"data": list, "execute_at": int}})
+
+
+def get_key_state(request: Request):
+    """Returns the held keys, when they will be auto-released (ms from now) and the keyboard report as hex."""
+    return json_resp_get(request, key_state)
+
+
+def set_pointer_position(request: Request) -> JSONResponse:
+    """
+    Places the pointer with a single report, at fractions of the screen: (0, 0) top left, (1, 1) bottom right.
+    Needs the absolute pointer ("absolute_mouse": true in pyhid_config.json, then a hard reset).
+        {"x": 0.5, "y": 0.25}
+        {"x": 0.9, "y": 0.05, "click": "LEFT"}
+    """
+    return json_resp(
+        request,
+        place_pointer,
+        {
+            "required_keys": {"x": (int, float), "y": (int, float)},
+            "optional_keys": {"click": str, "execute_at": int},
+        }
+    )
+
+
+def record_session(request: Request) -> JSONResponse:
+    """
+    Starts ({"record": true}, optionally with a "capacity" in bytes) or stops ({"record": false}) recording every API
+    request, with its body and timing, for replaying elsewhere (host/replay.py). Starting discards any log that has
+    not been downloaded. Returns the recorder's status.
+    """
+    return json_resp(
+        request, _record_session, {"required_keys": {"record": bool}, "optional_keys": {"capacity": int}}
+    )
+
+
+def download_session(request: Request):
+    """Returns the recorded session log (format in session_recorder.py) as application/octet-stream, and clears it."""
+    return json_resp_get(request, RECORDER.download)
+
+
+def get_keyboard_leds(request: Request):
+    """Returns the keyboard LEDs (Num Lock, Caps Lock, Scroll Lock, Compose) as last set by the host."""
+    return json_resp_get(request, keyboard_leds)
+
+
+def get_clock(request: Request):
+    """
+    Returns the device's clock (time.monotonic_ns()), for clients estimating their offset from it NTP style: the
+    device time is taken to be halfway between sending the request and receiving the response. Jobs sent to
+    /api/type, /api/keycodes and /api/reports can then be scheduled with "execute_at": <device time in ns>.
+    """
+    return json_resp_get(request, _device_clock)
+
+
 def disable_boot_keyboard(request: Request):
     """This will re-enable serial, USB storage and MIDI and prevent the device from running as a boot keyboard"""
     return json_resp_get(request, _disable_boot_keyboard)
 
 
-@server.route(API_ENDPOINTS["hard_reset"], GET)
 def hard_reset(request: Request):
     """Resets the device, very aggressively. I'll wrap this in a try/except, however don't expect this to actually
     respond. Just wait a few seconds and the device should be back up and running."""
     return json_resp_get(request, _hard_reset)
 
 
-server.serve_forever(listening_ip)
+def get_logs(request: Request):
+    """Returns the buffered request log (oldest first) and clears it, streamed a few records at a time."""
+    return json_resp_get(request, lambda: LOG.response(request))
+
+
+def set_server_timing(request: Request) -> JSONResponse:
+    """Enables/disables per-request phase timing, e.g. {"enabled": true}. The phases are returned in a Server-Timing
+    header on every API response while enabled."""
+    return json_resp(request, _set_server_timing, {"required_keys": {"enabled": bool}})
+
+
+def get_startup_profile(request: Request):
+    """Returns how long each start up phase took (ms) and the free heap after it, up to the first request."""
+    return json_resp_get(request, PROFILE.report)
+
+
+def get_watchdog_status(request: Request):
+    """Returns the watchdog settings and, after a watchdog reset, the route/phase the board stalled in."""
+    return json_resp_get(request, WATCHDOG.status)
+
+
+def get_queue_status(request: Request):
+    """Returns the HID queue's depth, estimated backlog (reports), drain rate (reports/s) and limits, so clients can
+    throttle themselves rather than being sent a 429."""
+    return json_resp_get(request, HID_QUEUE.status)
+
+
+def get_job_events(request: Request):
+    """
+    Streams the progress of a HID job as server-sent events (characters typed, reports sent, ETA, then done or
+    error) until it has finished, over the one connection. Queue the job with ?detach=1 to get its id straight away:
+        POST /api/type?detach=1 {"data": "..."}  ->  202 {"error": "OK", "job": 12}
+        GET /api/events?job=12&interval=500      ->  text/event-stream, see job_events.py
+    """
+    return json_resp_get(request, lambda: job_event_stream(request))
+
+
+def reload_config(request: Request):
+    """Re-reads the config files without a reset. Routes and defaults are swapped in place, only a change to the
+    network settings restarts the network stack (via a soft reload, which keeps USB enumerated)."""
+    return json_resp_get(request, _reload_config)
+
+
+# endpoint name (key in the "api_endpoints" config) -> (method, handler)
+ROUTES = {
+    "type": (POST, type_into_device),
+    "type_keycodes": (POST, type_keycodes_into_device),
+    "raw_reports": (POST, send_raw_reports),
+    "script": (POST, run_hid_script),
+    "disable_boot_keyboard": (GET, disable_boot_keyboard),
+    "hard_reset": (GET, hard_reset),
+    "logs": (GET, get_logs),
+    "server_timing": (POST, set_server_timing),
+    "reload_config": (GET, reload_config),
+    "startup_profile": (GET, get_startup_profile),
+    "watchdog": (GET, get_watchdog_status),
+    "queue": (GET, get_queue_status),
+    "job_events": (GET, get_job_events),
+    "clock": (GET, get_clock),
+    "keys_press": (POST, press_keys),
+    "keys_release": (POST, release_held_keys),
+    "keys": (GET, get_key_state),
+    "leds": (GET, get_keyboard_leds),
+    "pointer": (POST, set_pointer_position),
+    "session_record": (POST, record_session),
+    "session": (GET, download_session),
+}
+
+
+# endpoints answered by the server itself, ahead of the route table
+SERVER_ENDPOINTS = {
+    # GET: {"ready", "link", "usb", "depth", "mem_free"} from a preformatted buffer, a 503 while the network link or
+    # USB is down. For load balancers and monitoring polling the board, see health.py.
+    "health": HEALTH.set_path,
+}
+
+
+def _route_table(api_endpoints: dict):
+    """Returns a new route table with every handler in ROUTES registered against it, the server's is left in place"""
+    routes = server._routes
+    server._routes = type(routes)()
+    try:
+        for name, (method, handler) in ROUTES.items():
+            server.route(api_endpoints[name], method)(handler)
+        return server._routes
+    finally:
+        server._routes = routes
+
+
+def _use_routes(routes, api_endpoints: dict):
+    """Swaps in a table from _route_table, along with the paths the server answers itself and those never recorded"""
+    server._routes = routes
+    RECORDER.skip = (api_endpoints["session_record"], api_endpoints["session"])
+    for name, set_path in SERVER_ENDPOINTS.items():
+        set_path(api_endpoints[name])
+
+
+def _start_watchdog(watchdog_config: dict):
+    """
+    Starts the hardware watchdog if a timeout is configured. RAISE mode lets us persist a breadcrumb before resetting,
+    ports that do not implement it fall back to RESET mode.
+    """
+    WATCHDOG.load(microcontroller.nvm, str(microcontroller.cpu.reset_reason))
+    timeout = watchdog_config.get("timeout", 0)
+    if not timeout:
+        return
+    if watchdog_config.get("mode", "raise").lower() == "raise":
+        try:
+            WATCHDOG.start(microcontroller.watchdog, timeout, WatchDogMode.RAISE, WatchDogTimeout)
+            return
+        except NotImplementedError:
+            pass
+    WATCHDOG.start(microcontroller.watchdog, timeout, WatchDogMode.RESET)
+
+
+def _reload_config() -> dict:
+    """
+    Re-reads both config files. Nothing is applied unless the whole config is valid: the new route table is built
+    and every settings section validated before any of them is applied. Paths are only re-registered if at least one
+    of them changed.
+    """
+    global PYHID_CONFIG, NET_CONFIG, API_ENDPOINTS, RESTART_NETWORK  # pylint: disable=global-statement
+    pyhid_config = read_config(PYHID_CONFIG_PATH)
+    net_config = read_config(NET_CONFIG_PATH)
+    api_endpoints = pyhid_config["api_endpoints"]
+    endpoints = tuple(ROUTES) + tuple(SERVER_ENDPOINTS)
+    missing = [name for name in endpoints if name not in api_endpoints]
+    if missing:
+        raise ValueError(f"Missing api_endpoints: {missing}")
+    bad = [name for name in endpoints if not isinstance(api_endpoints[name], str) or api_endpoints[name][:1] != "/"]
+    if bad:
+        raise ValueError(f"api_endpoints must be paths starting with /: {bad}")
+    changed_routes = [name for name in endpoints if api_endpoints[name] != API_ENDPOINTS.get(name)]
+    restart_network = net_config != NET_CONFIG or pyhid_config["board"] != PYHID_CONFIG["board"]
+
+    routes = _route_table(api_endpoints) if changed_routes else None
+    _apply_settings(pyhid_config)
+    if routes is not None:
+        _use_routes(routes, api_endpoints)
+    server.debug = pyhid_config.get("debug", False)
+    if hasattr(server, "keep_alive_timeout"):
+        server.keep_alive_timeout = pyhid_config.get("keep_alive_timeout", 0)
+    PYHID_CONFIG, NET_CONFIG, API_ENDPOINTS = pyhid_config, net_config, api_endpoints
+    RESTART_NETWORK = restart_network
+    return {"changed_routes": changed_routes, "network_restart": restart_network}
+
+
+_use_routes(_route_table(API_ENDPOINTS), API_ENDPOINTS)
+
+server.start(listening_ip)
+PROFILE.mark("listening")
+_start_watchdog(PYHID_CONFIG.get("watchdog", {}))
+while True:
+    WATCHDOG.feed()
+    WATCHDOG.crumb("poll", "")
+    try:
+        server.poll()
+        KEY_STATE.poll(get_keyboard)
+    except WatchDogTimeout:
+        WATCHDOG.persist()
+        microcontroller.reset()
+    except Exception:  # pylint: disable=broad-except
+        pass  # Ignore exceptions in handler functions, as serve_forever does
+    if RESTART_NETWORK:
+        # Re-runs code.py without re-running boot.py, so the network comes back up without USB re-enumerating.
+        supervisor.reload()
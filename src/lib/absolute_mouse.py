@@ -0,0 +1,123 @@
+"""
+An absolute pointer: a mouse whose X and Y are positions on the screen rather than movements, so the pointer can be
+placed anywhere with a single report.
+
+It is an extra HID device, added by boot.py when "absolute_mouse" is set in pyhid_config.json (changing that needs a
+hard reset, USB has to enumerate again). The relative mouse stays as it is and, being enabled first, is still the
+one adafruit_hid's Mouse finds.
+
+Report (id REPORT_ID, REPORT_LENGTH bytes):
+
+    byte 0      buttons: bit 0 left, bit 1 right, bit 2 middle
+    bytes 1-2   X, little endian, 0 (left edge) to LOGICAL_MAX (right edge)
+    bytes 3-4   Y, little endian, 0 (top edge) to LOGICAL_MAX (bottom edge)
+    byte 5      wheel, relative (-127 to 127)
+"""
+
+REPORT_ID = 4
+REPORT_LENGTH = 6
+LOGICAL_MAX = 32767
+
+REPORT_DESCRIPTOR = bytes((
+    0x05, 0x01,  # Usage Page (Generic Desktop)
+    0x09, 0x02,  # Usage (Mouse)
+    0xA1, 0x01,  # Collection (Application)
+    0x85, REPORT_ID,  # Report ID
+    0x09, 0x01,  # Usage (Pointer)
+    0xA1, 0x00,  # Collection (Physical)
+    0x05, 0x09,  # Usage Page (Button)
+    0x19, 0x01,  # Usage Minimum (1)
+    0x29, 0x03,  # Usage Maximum (3)
+    0x15, 0x00,  # Logical Minimum (0)
+    0x25, 0x01,  # Logical Maximum (1)
+    0x95, 0x03,  # Report Count (3)
+    0x75, 0x01,  # Report Size (1)
+    0x81, 0x02,  # Input (Data, Variable, Absolute)
+    0x95, 0x01,  # Report Count (1)
+    0x75, 0x05,  # Report Size (5)
+    0x81, 0x03,  # Input (Constant), padding
+    0x05, 0x01,  # Usage Page (Generic Desktop)
+    0x09, 0x30,  # Usage (X)
+    0x09, 0x31,  # Usage (Y)
+    0x15, 0x00,  # Logical Minimum (0)
+    0x26, LOGICAL_MAX & 0xFF, LOGICAL_MAX >> 8,  # Logical Maximum (LOGICAL_MAX)
+    0x75, 0x10,  # Report Size (16)
+    0x95, 0x02,  # Report Count (2)
+    0x81, 0x02,  # Input (Data, Variable, Absolute)
+    0x09, 0x38,  # Usage (Wheel)
+    0x15, 0x81,  # Logical Minimum (-127)
+    0x25, 0x7F,  # Logical Maximum (127)
+    0x75, 0x08,  # Report Size (8)
+    0x95, 0x01,  # Report Count (1)
+    0x81, 0x06,  # Input (Data, Variable, Relative)
+    0xC0,  # End Collection
+    0xC0,  # End Collection
+))
+
+# usage page, usage: the same as the relative mouse
+USAGE = (0x01, 0x02)
+
+
+def device():
+    """Returns the usb_hid.Device to pass to usb_hid.enable in boot.py"""
+    import usb_hid  # pylint: disable=import-outside-toplevel
+    return usb_hid.Device(
+        report_descriptor=REPORT_DESCRIPTOR, usage_page=USAGE[0], usage=USAGE[1], report_ids=(REPORT_ID,),
+        in_report_lengths=(REPORT_LENGTH,), out_report_lengths=(0,),
+    )
+
+
+def find_absolute_mouse(devices):
+    """Returns the absolute pointer, the second of the devices that are mice, or None if it was not enabled"""
+    mice = [dev for dev in devices if (dev.usage_page, dev.usage) == USAGE]
+    return mice[1] if len(mice) > 1 else None
+
+
+class AbsoluteMouse:
+    """Sends absolute pointer reports, with positions given as fractions of the screen (0.0 to 1.0)."""
+
+    LEFT_BUTTON = 1
+    RIGHT_BUTTON = 2
+    MIDDLE_BUTTON = 4
+
+    def __init__(self, hid_device):
+        self._device = hid_device
+        self.report = bytearray(REPORT_LENGTH)
+
+    @staticmethod
+    def _axis(value: float) -> int:
+        if not 0 <= value <= 1:
+            raise ValueError(f"Pointer positions must be between 0 and 1, got {value}")
+        return round(value * LOGICAL_MAX)
+
+    def _send(self):
+        self._device.send_report(self.report)
+
+    def move_to(self, x: float, y: float):
+        """Places the pointer at (x, y), with (0, 0) the top left corner and (1, 1) the bottom right one"""
+        x, y = self._axis(x), self._axis(y)
+        self.report[1] = x & 0xFF
+        self.report[2] = x >> 8
+        self.report[3] = y & 0xFF
+        self.report[4] = y >> 8
+        self._send()
+
+    def press(self, buttons: int):
+        """Presses buttons (LEFT_BUTTON etc. or'ed together) where the pointer is"""
+        self.report[0] |= buttons
+        self._send()
+
+    def release(self, buttons: int):
+        """Releases buttons"""
+        self.report[0] &= ~buttons & 0xFF
+        self._send()
+
+    def release_all(self):
+        """Releases every button"""
+        self.report[0] = 0
+        self._send()
+
+    def click(self, buttons: int):
+        """Presses and releases buttons where the pointer is"""
+        self.press(buttons)
+        self.release(buttons)
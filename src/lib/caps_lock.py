@@ -0,0 +1,66 @@
+"""
+Typing for a host with Caps Lock on: which characters Caps Lock changes on a layout, and typing them with their case
+swapped so that the host's Caps Lock swaps it back. Used by /api/type's "invert" mode and by the host's report
+compiler (host/pyhid_client/compiler.py), so both type the same reports.
+"""
+
+
+def _is_ascii_letter(char: str) -> bool:
+    return "a" <= char <= "z" or "A" <= char <= "Z"
+
+
+def _other_case(char: str) -> str:
+    """
+    An ASCII or Latin-1 letter in the other case, any other character as it is (CircuitPython's str has no swapcase,
+    and its upper/lower only know ASCII)
+    """
+    code = ord(char)
+    if 0x61 <= code <= 0x7A or 0xE0 <= code <= 0xFE and code != 0xF7:
+        return chr(code - 0x20)
+    if 0x41 <= code <= 0x5A or 0xC0 <= code <= 0xDE and code != 0xD7:
+        return chr(code + 0x20)
+    return char
+
+
+def _higher_keycode(layout, char: str) -> int:
+    """char's HIGHER_ASCII keycode, None if it has no key of its own there"""
+    keycode = layout.HIGHER_ASCII.get(ord(char))
+    return layout.HIGHER_ASCII.get(char) if keycode is None else keycode
+
+
+def _key_letter(layout, char: str) -> bool:
+    """
+    True if char is a letter with a key of its own in HIGHER_ASCII (ü on de-DE, ñ on es-ES) that its other case
+    shares, shift telling them apart and neither needing AltGr: the host's Caps Lock swaps them as it does A and a.
+    """
+    other = _other_case(char)
+    if other == char or char in layout.NEED_ALTGR or other in layout.NEED_ALTGR:
+        return False
+    keycode, other_keycode = _higher_keycode(layout, char), _higher_keycode(layout, other)
+    return keycode is not None and other_keycode is not None and keycode ^ other_keycode == layout.SHIFT_FLAG
+
+
+def _combined_letter(layout, char: str) -> int:
+    """char's COMBINED_KEYS code if it is typed as a dead key then an ASCII letter (é: ´ e), else None"""
+    if ord(char) in layout.HIGHER_ASCII:  # a key of its own, layout.write types that first
+        return None
+    code = layout.COMBINED_KEYS.get(ord(char))
+    return code if code is not None and _is_ascii_letter(chr(code & 0x7F)) else None
+
+
+def caps_affects(layout, char: str) -> bool:
+    """
+    True if Caps Lock changes what char types: ASCII letters, letters on a key of their own shared with their other
+    case, and dead key combinations ending in an ASCII letter
+    """
+    return _is_ascii_letter(char) or _key_letter(layout, char) or _combined_letter(layout, char) is not None
+
+
+def write_case_swapped(layout, char: str):
+    """Types char with its letter's case swapped, for the host's Caps Lock to swap back. Dead keys are typed as is."""
+    code = _combined_letter(layout, char)
+    if code is None:
+        layout.write(_other_case(char))
+        return
+    layout._write(code >> 8, code & layout.ALTGR_FLAG)
+    layout.write(_other_case(chr(code & 0x7F)))
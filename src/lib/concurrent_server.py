@@ -0,0 +1,255 @@
+"""
+A Server that services several connections at once, rather than one at a time (the W5500 has 8 hardware sockets).
+
+Every accepted connection gets a small state machine which poll() advances one step at a time, round robin, so a
+slow client no longer holds up everyone else. HID output stays serialised through HID_QUEUE, poll() steps it once
+per call. Requests whose HID job is still queued keep their connection open until the job has finished. Health
+checks (see health.py) are answered as soon as they are in, without being parsed, and a body too big for the board
+(see dispatch_server.body_rejection) is turned away once the headers are in, before any of it is buffered. Streamed
+responses (static files, job events, see streamed_response.py) are sent a piece per poll.
+
+With keep_alive_timeout set, HTTP/1.1 clients can send several requests over one connection (saving a TCP handshake
+per request), the connection is closed once it has been idle for keep_alive_timeout seconds.
+"""
+
+import time
+from errno import EAGAIN, ECONNRESET, ETIMEDOUT
+
+from adafruit_httpserver import Request, Route, ServerStoppedError
+
+from dispatch_server import DispatchServer, body_rejection, content_length, send_bytes
+from health import HEALTH
+from hid_queue import HID_QUEUE, DeferredResponse
+from server_timing import TIMER
+from streamed_response import StreamedResponse
+
+
+class _KeptOpen:
+    """Stands in for a connection's socket in a Request, so sending the response does not close the socket."""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def close(self):
+        pass
+
+
+class _Connection:  # pylint: disable=too-many-instance-attributes
+    """State for a single client connection, reading until the whole request is in, then waiting on its job"""
+
+    def __init__(self, sock, client_address, now_ns: int):
+        self.sock = sock
+        self.client_address = client_address
+        self.raw_request = b""
+        self.request_length = None  # headers + body, known once the headers are in
+        self.body_length = 0
+        self.response = None  # DeferredResponse waiting on a queued HID job
+        self.stream = None  # StreamedResponse being sent
+        self.started_ns = now_ns
+        self.last_active_ns = now_ns
+        self.requests = 0
+        self.keep_alive = False
+
+    def next_request(self, now_ns: int):
+        """Gets ready for the next request on a kept alive connection, keeping any bytes already received for it"""
+        self.raw_request = self.raw_request[self.request_length:]
+        self.request_length = None
+        self.response = None
+        self.stream = None
+        self.started_ns = now_ns
+        self.last_active_ns = now_ns
+
+    def headers_complete(self) -> bool:
+        """True once the headers have been received, request_length is known from then on"""
+        if self.request_length is None:
+            header_end = self.raw_request.find(b"\r\n\r\n")
+            if header_end < 0:
+                return False
+            self.body_length = content_length(self.raw_request, header_end)
+            self.request_length = header_end + 4 + self.body_length
+        return True
+
+    def close(self):
+        """Closes the socket, ignoring errors from a client that has already gone"""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConcurrentServer(DispatchServer):
+    """
+    Accepts up to `max_connections` connections at a time. Connections that have not sent a complete request within
+    socket_timeout seconds of their last activity are dropped, so idle clients cannot hog the sockets.
+    """
+
+    def __init__(self, *args, max_connections: int = 4, keep_alive_timeout: float = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_connections = max_connections
+        self.keep_alive_timeout = keep_alive_timeout
+        self._connections = []
+
+    @property
+    def connection_count(self) -> int:
+        """The number of connections currently open"""
+        return len(self._connections)
+
+    def stop(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        super().stop()
+
+    def poll(self):
+        """Accepts a new connection (if below the cap), advances every open connection by one step, then steps the
+        HID queue once."""
+        if self.stopped:
+            raise ServerStoppedError
+        if len(self._connections) < self.max_connections:
+            self._accept()
+        if self._connections:
+            # Rotate so no connection is always first to be served
+            self._connections.append(self._connections.pop(0))
+            for conn in tuple(self._connections):
+                try:
+                    done = self._service(conn)
+                except Exception:
+                    self._drop(conn)
+                    raise
+                if done:
+                    self._drop(conn)
+        HID_QUEUE.step()
+
+    def _drop(self, conn: _Connection):
+        conn.close()
+        if conn in self._connections:
+            self._connections.remove(conn)
+
+    def _accept(self):
+        try:
+            sock, client_address = self._sock.accept()
+        except OSError as error:
+            if error.errno in (EAGAIN, ECONNRESET, ETIMEDOUT):
+                return
+            raise
+        sock.settimeout(0)
+        self._connections.append(_Connection(sock, client_address, time.monotonic_ns()))
+
+    def _service(self, conn: _Connection) -> bool:
+        """Advances a connection by one step, returns True once it is finished with."""
+        if conn.stream is not None:
+            return self._stream(conn)
+        if conn.response is not None:
+            if not conn.response.job.finished:
+                return False
+            return self._send(conn, conn.response)
+
+        now_ns = time.monotonic_ns()
+        if not self._receive(conn, now_ns):
+            return True
+        if conn.raw_request and conn.headers_complete() and len(conn.raw_request) >= conn.request_length:
+            return self._handle(conn)
+        # Drop the connection if it has been idle for too long, waiting for the next request on a kept alive
+        # connection can take longer than waiting for the rest of one
+        timeout = self.keep_alive_timeout if conn.requests and not conn.raw_request else self._timeout
+        return now_ns - conn.last_active_ns > timeout * 1_000_000_000
+
+    def _receive(self, conn: _Connection, now_ns: int) -> bool:
+        """
+        Reads whatever has arrived on the connection, returns False if the client has closed it (or it failed), or if
+        the request was turned away as soon as its headers were in
+        """
+        try:
+            length = conn.sock.recv_into(self._buffer, len(self._buffer))
+        except OSError as error:
+            if error.errno not in (EAGAIN, ETIMEDOUT):
+                return False
+            length = None
+        if length == 0:
+            return False  # the client closed the connection
+        if length:
+            conn.raw_request += self._buffer[:length]
+            conn.last_active_ns = now_ns
+        # checked once per request, whether its headers came in now or with the previous request on the connection
+        return conn.request_length is not None or not conn.headers_complete() or not self._turn_away(conn)
+
+    def _turn_away(self, conn: _Connection) -> bool:
+        """Answers a request whose body the board should not take before reading it, returns True if it did"""
+        if HEALTH.matches(conn.raw_request):
+            return False
+        rejection = body_rejection(conn.body_length)
+        if rejection is None:
+            return False
+        conn.sock.settimeout(self._timeout)
+        send_bytes(conn.sock, rejection)
+        return True
+
+    def _wants_keep_alive(self, request) -> bool:
+        if not self.keep_alive_timeout:
+            return False
+        connection = (request.headers.get("Connection") or "").lower()
+        if request.http_version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+    def _handle(self, conn: _Connection) -> bool:
+        """Runs the handler for a complete request, as Server.poll would. Returns False while its job is queued."""
+        if HEALTH.matches(conn.raw_request):
+            conn.keep_alive = bool(self.keep_alive_timeout) and HEALTH.keep_alive(conn.raw_request)
+            HEALTH.answer(conn.sock, conn.keep_alive)
+            return self._kept_alive(conn)
+        request = Request(self, conn.sock, conn.client_address, conn.raw_request[:conn.request_length])
+        conn.keep_alive = self._wants_keep_alive(request)
+        if conn.keep_alive:
+            request.connection = _KeptOpen(conn.sock)
+        TIMER.begin(conn.started_ns)
+        TIMER.mark("recv")
+        handler = self._routes.find_handler(Route(request.path, request.method))
+        response = self._handle_request(request, handler)
+        if response is None:
+            return True
+        self._set_default_server_headers(response)
+        if isinstance(response, StreamedResponse) and not response.length_known:
+            conn.keep_alive = False
+        if conn.keep_alive:
+            response._headers["Connection"] = "keep-alive"
+        if isinstance(response, DeferredResponse) and not response.job.finished:
+            conn.response = response
+            return False
+        if isinstance(response, StreamedResponse):
+            conn.stream = response
+            return self._stream(conn)
+        return self._send(conn, response)
+
+    def _send(self, conn: _Connection, response) -> bool:
+        """Sends the response, returns True if the connection is finished with"""
+        conn.sock.settimeout(self._timeout)
+        response._send()
+        if self.debug:
+            print(f"{conn.client_address[0]} -- {response._status.code} -- {response._size} bytes")
+        return self._kept_alive(conn)
+
+    def _stream(self, conn: _Connection) -> bool:
+        """Sends the next piece of a streamed response, returns True if the connection is finished with"""
+        conn.sock.settimeout(self._timeout)
+        if not conn.stream.send_step():
+            return False
+        conn.stream.close()
+        conn.stream = None
+        return self._kept_alive(conn)
+
+    @staticmethod
+    def _kept_alive(conn: _Connection) -> bool:
+        """Readies a connection for its next request once a response has been sent, True if it is finished with"""
+        if not conn.keep_alive:
+            return True
+        conn.sock.settimeout(0)
+        conn.requests += 1
+        conn.next_request(time.monotonic_ns())
+        return False
@@ -0,0 +1,20 @@
+"""
+Reads the JSON config files. A .mpy bundle built with host/build_bundle.py --freeze-config has no JSON files, their
+contents are compiled into the frozen_config module instead, which is then read in their place.
+"""
+
+from config_utils import get_config_from_json_file
+
+
+def read_config(path: str) -> dict:
+    """Returns the config in the JSON file at path, or its frozen copy if there is no such file"""
+    try:
+        return get_config_from_json_file(path)
+    except OSError as error:
+        try:
+            from frozen_config import CONFIGS
+        except ImportError:
+            raise error from None
+        if path not in CONFIGS:
+            raise error from None
+        return CONFIGS[path]
@@ -0,0 +1,87 @@
+"""
+The app's Server: what the board answers besides its routes, and the HID queue stepped from the server loop.
+
+    health checks   (see health.py) answered as soon as their headers are in, ahead of parsing and routing
+    big bodies      a Content-Length over the queue's max_request_size is a 413, one free memory cannot take (see
+                    HIDQueue.memory_low) a 429, answered from the headers before any of the body is read
+    static files    (see static_files.py) GET and HEAD requests no route takes
+    HID queue       stepped after every poll, for the jobs queued with ?detach=1 that no request is waiting on
+
+A server serving one connection at a time is a DispatchServer as it is, ConcurrentServer builds on it.
+"""
+
+import json
+
+from adafruit_httpserver import GET, HEAD
+
+from health import HEALTH
+from hid_queue import HID_QUEUE
+from server_timing import TimedServer
+from static_files import STATIC
+
+_RESPONSE = (
+    "HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}Connection: close\r\n\r\n{}"
+)
+
+
+def content_length(raw_request: bytes, header_end: int) -> int:
+    """The Content-Length of a request whose headers end at header_end, 0 if it has none"""
+    for line in raw_request[:header_end].split(b"\r\n")[1:]:
+        if line[:15].lower() == b"content-length:":
+            return int(line[15:].strip())
+    return 0
+
+
+def body_rejection(length: int) -> bytes:
+    """
+    The response turning away a request body of length bytes before it is read (the connection is closed after it),
+    or None if it can be received.
+    """
+    if HID_QUEUE.max_request_size and length > HID_QUEUE.max_request_size:
+        status, headers = "413 Payload Too Large", ""
+        body = {"error": f"Request too large: {length} > max_request_size ({HID_QUEUE.max_request_size})"}
+    elif length and HID_QUEUE.memory_low(length):
+        HID_QUEUE.rejected += 1
+        retry_after = HID_QUEUE.retry_after()
+        status, headers = "429 Too Many Requests", f"Retry-After: {retry_after}\r\n"
+        body = {"error": "Not enough free memory for the request, retry later", "retry_after": retry_after}
+    else:
+        return None
+    body = json.dumps(body)
+    return _RESPONSE.format(status, len(body), headers, body).encode()
+
+
+def send_bytes(sock, data: bytes):
+    """Sends all of data, a slice at a time if the socket buffer fills up"""
+    sent = sock.send(data)
+    while sent < len(data):
+        sent += sock.send(memoryview(data)[sent:])
+
+
+class DispatchServer(TimedServer):
+    """
+    A TimedServer answering health checks and static files, and stepping the HID queue. A health check (or a body
+    turned away) is answered from _receive_header_bytes, Server.poll then closes the connection as if nothing came.
+    """
+
+    def poll(self):
+        result = super().poll()
+        HID_QUEUE.step()
+        return result
+
+    def _handle_request(self, request, handler):
+        if handler is None and request.method in (GET, HEAD):
+            return STATIC.response(request)
+        return super()._handle_request(request, handler)
+
+    def _receive_header_bytes(self, sock) -> bytes:
+        header_bytes = super()._receive_header_bytes(sock)
+        if HEALTH.matches(header_bytes):
+            HEALTH.answer(sock)
+            return b""
+        header_end = header_bytes.find(b"\r\n\r\n")
+        rejection = body_rejection(content_length(header_bytes, header_end)) if header_end >= 0 else None
+        if rejection is not None:
+            send_bytes(sock, rejection)
+            return b""
+        return header_bytes
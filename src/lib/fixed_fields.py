@@ -0,0 +1,23 @@
+"""
+Preformatted JSON with fixed width fields, rewritten in place (health checks, job progress events), so sending one
+allocates nothing. Values are right aligned and space padded, whitespace is valid JSON.
+"""
+
+
+def field_end(buffer, name: bytes, last_end: int) -> int:
+    """The offset in buffer just past the value of field `name`, last_end for the last field (no comma after it)"""
+    end = buffer.find(b",", buffer.find(b'"' + name + b'":'))
+    return end if end > 0 else last_end
+
+
+def put_int(buffer: bytearray, end: int, width: int, value: int):
+    """Writes value right aligned (space padded) into buffer[end - width:end], clamped to what fits"""
+    start = end - width
+    value = min(value, 10 ** width - 1)
+    buffer[end - 1] = 0x30 + value % 10
+    value //= 10
+    end -= 1
+    while end > start:
+        end -= 1
+        buffer[end] = 0x30 + value % 10 if value else 0x20
+        value //= 10
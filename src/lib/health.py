@@ -0,0 +1,89 @@
+"""
+A health/readiness check for load balancers and monitoring, answered straight from the server's poll loop.
+
+The request is recognised from its request line before anything is parsed (no Request, no route lookup, no JSON),
+and answered from a response preformatted at start up, with only its fixed width fields rewritten in place:
+
+    HTTP/1.1 200 OK                     (503 Service Unavailable while the network link or USB is down)
+    {"ready":1,"link":1,"usb":1,"depth":    0,"mem_free":   81234}
+
+so polling it allocates nothing past the bytes of the request itself, and cannot set off a garbage collection in
+the middle of typing. It is not logged, timed or recorded, and the HID queue is stepped as usual around it.
+"""
+
+import gc
+
+import supervisor
+
+from fixed_fields import field_end, put_int
+from hid_queue import HID_QUEUE
+
+_mem_free = getattr(gc, "mem_free", lambda: None)
+
+_BODY = b'{"ready":0,"link":0,"usb":0,"depth":    0,"mem_free":       0}'
+_DEPTH_WIDTH = 5
+_MEM_FREE_WIDTH = 8
+_NULL = b"    null"  # mem_free where gc cannot tell (off CircuitPython)
+
+
+_READY, _LINK, _USB, _DEPTH, _MEM_FREE = (
+    field_end(_BODY, name, len(_BODY) - 1) for name in (b"ready", b"link", b"usb", b"depth", b"mem_free")
+)
+_HEADERS = (
+    "HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nCache-Control: no-store\r\n"
+    "Connection: {}\r\n\r\n"
+)
+
+
+class HealthCheck:
+    """Answers GET <path> on a socket without allocating. `link` is set by the board's server module."""
+
+    def __init__(self):
+        self.request_line = b""
+        self.link = None  # returns True while the network link is up, left None where the board cannot tell
+        # indexed by ready * 2 + keep_alive
+        self._responses = [
+            bytearray(_HEADERS.format(status, len(_BODY), connection).encode() + _BODY)
+            for status in ("503 Service Unavailable", "200 OK") for connection in ("close", "keep-alive")
+        ]
+
+    def set_path(self, path: str):
+        """Answers GET requests for path from now on"""
+        self.request_line = b"GET " + path.encode() + b" "
+
+    def matches(self, raw_request: bytes) -> bool:
+        """True if raw_request is a health check"""
+        return bool(self.request_line) and raw_request.startswith(self.request_line)
+
+    @staticmethod
+    def keep_alive(raw_request: bytes) -> bool:
+        """Whether the client asks for the connection to be kept open (HTTP/1.1 unless it says close)"""
+        header_end = raw_request.find(b"\r\n\r\n")
+        if raw_request.find(b" HTTP/1.1\r\n", 0, header_end) > 0:
+            return raw_request.find(b"onnection: close", 0, header_end) < 0 \
+                and raw_request.find(b"onnection: Close", 0, header_end) < 0
+        return raw_request.find(b"eep-alive", 0, header_end) > 0
+
+    def answer(self, sock, keep_alive: bool = False):
+        """Fills in the current state and sends the response"""
+        link = self.link() if self.link is not None else True
+        usb = supervisor.runtime.usb_connected
+        ready = 1 if link and usb else 0
+        response = self._responses[ready * 2 + (1 if keep_alive else 0)]
+        body = len(response) - len(_BODY)
+        response[body + _READY - 1] = 0x30 + ready
+        response[body + _LINK - 1] = 0x31 if link else 0x30
+        response[body + _USB - 1] = 0x31 if usb else 0x30
+        put_int(response, body + _DEPTH, _DEPTH_WIDTH, len(HID_QUEUE))
+        mem_free = _mem_free()
+        if mem_free is None:
+            response[body + _MEM_FREE - _MEM_FREE_WIDTH:body + _MEM_FREE] = _NULL
+        else:
+            put_int(response, body + _MEM_FREE, _MEM_FREE_WIDTH, mem_free)
+        sent = sock.send(response)
+        while sent < len(response):
+            # only a full socket buffer gets here, the rest of the response is sent as a slice
+            sent += sock.send(memoryview(response)[sent:])
+
+
+HEALTH = HealthCheck()
@@ -0,0 +1,359 @@
+"""
+A single queue for everything sent to the USB HID devices.
+
+A request turns its HID output into a Job: a generator that yields at every safe report boundary (all keys
+released). The queue advances the job at its head one yield at a time, so the server can keep servicing other
+connections in between. A job can yield a delay (in seconds) to pace its output without blocking the server loop.
+
+Jobs have a priority. The highest priority job always runs next, so a short key combo (PRIORITY_HIGH) preempts a long
+text job at its next report boundary: the text job's keys are released, the combo runs and the text job then resumes
+where it left off. A combo therefore waits for at most one step of the running job (a single character, a handful of
+reports) plus any high priority jobs queued ahead of it.
+
+The queue also does admission control. Every job carries an estimate of its cost in HID reports, a job is turned
+away (see admit) while the queue already holds more than max_cost worth of reports or free memory is below
+min_free_memory, with a retry time based on how quickly the queue has been draining. The server checks a request's
+Content-Length against max_request_size and free memory (see memory_low) before reading its body at all.
+
+A job with an execute_at time (device time, time.monotonic_ns()) waits in a timer list, sorted by that time, until it
+is due. It then goes to the front of the queue as a high priority job, so it starts at the first report boundary
+after its time, whatever else is running. Together with /api/clock this lets several boards start a job within a
+few ms of each other.
+"""
+
+import gc
+import time
+
+from adafruit_httpserver import Response
+
+from pyhid_watchdog import WATCHDOG
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Lower runs first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+# Drain rate (reports/s) assumed until one has been measured, a report per 8 ms USB poll
+_INITIAL_DRAIN_RATE = 125.0
+# How long the queue has to be busy for before the drain rate estimate is updated
+_DRAIN_WINDOW_NS = 1_000_000_000
+# Finished jobs kept for find(), so their outcome can still be looked up (see job_events.py)
+_RECENT_JOBS = 8
+
+_mem_free = getattr(gc, "mem_free", lambda: None)
+
+
+class Job:  # pylint: disable=too-many-instance-attributes
+    """
+    HID output for a single request. `steps` is a generator, its return value is kept as the job result.
+    `error_status` is the response status used if the job raises. `release` is called (if given) when the job is
+    preempted by a higher priority one, to make sure none of its keys are left held down.
+    `cost` is the estimated number of HID reports the job sends, `step_cost` how many of those each step sends.
+    """
+
+    _next_id = 1
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, steps, route: str = "", error_status=None, *, priority: int = PRIORITY_NORMAL, release=None,
+        cost: int = 0, step_cost: int = 0,
+    ):
+        self.id = Job._next_id
+        Job._next_id += 1
+        self.route = route
+        self.error_status = error_status
+        self.priority = priority
+        self.release = release
+        self.cost = cost
+        self.step_cost = step_cost
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.steps_done = 0
+        self.resume_at_ns = 0
+        self.execute_at = None  # device time (ns) the job is scheduled for, if any
+        self.started_ns = 0
+        self._steps = steps
+
+    @property
+    def finished(self) -> bool:
+        """True once the job is done or has failed"""
+        return self.state in (DONE, FAILED)
+
+    @property
+    def remaining_cost(self) -> int:
+        """Estimated number of reports still to be sent"""
+        return max(0, int(self.cost - self.steps_done * self.step_cost))
+
+    def step(self, now_ns: int):
+        """Runs the job up to its next report boundary."""
+        if not self.started_ns:
+            self.started_ns = now_ns
+        self.state = RUNNING
+        try:
+            delay = next(self._steps)
+        except StopIteration as stop:
+            self.result = stop.value
+            self.state = DONE
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            WATCHDOG.reraise_timeout(exc)
+            self.error = exc
+            self.state = FAILED
+            return
+        self.steps_done += 1
+        if delay:
+            self.resume_at_ns = now_ns + int(delay * 1_000_000_000)
+
+
+class HIDQueue:  # pylint: disable=too-many-instance-attributes
+    """
+    Queue of jobs, only one of which produces HID output at a time: the oldest job of the highest priority.
+    A limit of 0 turns that admission check off.
+    """
+
+    def __init__(self, max_cost: int = 0, min_free_memory: int = 0, max_request_size: int = 0):
+        self._jobs = []
+        self._timers = []  # scheduled jobs that are not due yet, soonest first
+        self._current = None  # the job that last produced output
+        self._recent = []  # the last few jobs to finish, oldest first
+        self.preemptions = 0
+        self.rejected = 0
+        self.max_cost = max_cost
+        self.min_free_memory = min_free_memory
+        self.max_request_size = max_request_size
+        self.drain_rate = _INITIAL_DRAIN_RATE
+        self._window_ns = 0
+        self._window_cost = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs) + len(self._timers)
+
+    def validate(self, max_cost: int = None, min_free_memory: int = None, max_request_size: int = None) -> dict:
+        """
+        The 'queue' section of pyhid_config.json merged with the current limits and converted. Raises ValueError if
+        any value is bad, nothing is changed.
+        """
+        max_cost = self.max_cost if max_cost is None else int(max_cost)
+        min_free_memory = self.min_free_memory if min_free_memory is None else int(min_free_memory)
+        max_request_size = self.max_request_size if max_request_size is None else int(max_request_size)
+        if max_cost < 0 or min_free_memory < 0 or max_request_size < 0:
+            raise ValueError("Queue limits must be positive integers (or 0 for no limit)")
+        return {"max_cost": max_cost, "min_free_memory": min_free_memory, "max_request_size": max_request_size}
+
+    def configure(self, max_cost: int = None, min_free_memory: int = None, max_request_size: int = None):
+        """Validates the 'queue' section of pyhid_config.json and only then applies it."""
+        settings = self.validate(max_cost, min_free_memory, max_request_size)
+        self.max_cost, self.min_free_memory = settings["max_cost"], settings["min_free_memory"]
+        self.max_request_size = settings["max_request_size"]
+
+    @property
+    def busy(self) -> bool:
+        """True while a job is running or ready to run, scheduled jobs that are not due yet do not count"""
+        return bool(self._jobs)
+
+    @property
+    def queued_cost(self) -> int:
+        """Estimated number of reports still to be sent by every queued job"""
+        return sum(job.remaining_cost for job in self._jobs) + sum(job.cost for job in self._timers)
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is expected to have drained, at the current drain rate (at least 1)"""
+        return max(1, int(self.queued_cost / self.drain_rate + 0.999))
+
+    def memory_low(self, needed: int = 0) -> bool:
+        """True if free memory (after a collection, if it looks low) is below min_free_memory plus `needed` bytes"""
+        if not self.min_free_memory:
+            return False
+        free = _mem_free()
+        if free is not None and free < self.min_free_memory + needed:
+            gc.collect()
+            free = _mem_free()
+        return free is not None and free < self.min_free_memory + needed
+
+    def admit(self, job: Job) -> int:
+        """
+        Returns 0 if the job can be queued, otherwise the number of seconds after which it is worth retrying.
+        An empty queue takes a job of any cost (the request size limits still apply), so a big job is not turned away
+        forever. High priority jobs are short by definition, they are only turned away when memory is low. Free
+        memory is checked however empty the queue is.
+        """
+        over_cost = job.priority > PRIORITY_HIGH and self.max_cost and (self._jobs or self._timers) \
+            and self.queued_cost + job.cost > self.max_cost
+        if not over_cost and not self.memory_low():
+            return 0
+        self.rejected += 1
+        return self.retry_after()
+
+    def submit(self, job: Job) -> Job:
+        """Adds a job to the back of the queue, or to the timer list if it is scheduled."""
+        if job.execute_at is not None:
+            index = len(self._timers)
+            while index and self._timers[index - 1].execute_at > job.execute_at:
+                index -= 1
+            self._timers.insert(index, job)
+            return job
+        self._start_window()
+        self._jobs.append(job)
+        return job
+
+    def _start_window(self):
+        if not self._jobs:
+            self._window_ns = time.monotonic_ns()
+            self._window_cost = 0
+
+    def _release_due(self, now_ns: int):
+        """Moves scheduled jobs whose time has come to the front of the queue, with high priority"""
+        while self._timers and self._timers[0].execute_at <= now_ns:
+            job = self._timers.pop(0)
+            job.priority = PRIORITY_HIGH
+            self._start_window()
+            self._jobs.insert(0, job)
+
+    def _measure(self, now_ns: int, cost: int):
+        """Adds the cost of a step to the drain rate window, updating the estimate once the window is long enough"""
+        self._window_cost += cost
+        elapsed_ns = now_ns - self._window_ns
+        if elapsed_ns >= _DRAIN_WINDOW_NS or (not self._jobs and elapsed_ns and self._window_cost):
+            rate = self._window_cost * 1_000_000_000 / elapsed_ns
+            self.drain_rate = max(1.0, (self.drain_rate + rate) / 2)
+            self._window_ns = now_ns
+            self._window_cost = 0
+
+    def status(self) -> dict:
+        """Queue state, for clients that want to throttle themselves"""
+        return {
+            "depth": len(self._jobs),
+            "scheduled": len(self._timers),
+            "queued_cost": self.queued_cost,
+            "max_cost": self.max_cost,
+            "drain_rate": round(self.drain_rate, 1),
+            "retry_after": self.retry_after() if len(self) else 0,
+            "mem_free": _mem_free(),
+            "min_free_memory": self.min_free_memory,
+            "max_request_size": self.max_request_size,
+            "preemptions": self.preemptions,
+            "rejected": self.rejected,
+        }
+
+    def _next(self) -> Job:
+        job = self._jobs[0]
+        for candidate in self._jobs:
+            if candidate.priority < job.priority:
+                job = candidate
+        return job
+
+    def _switch_to(self, job: Job):
+        """Releases the keys of a job that is being preempted, before `job` gets to send anything."""
+        current = self._current
+        if current is not None and current is not job and not current.finished and current.release is not None:
+            self.preemptions += 1
+            try:
+                current.release()
+            except Exception as exc:  # pylint: disable=broad-except
+                WATCHDOG.reraise_timeout(exc)
+        self._current = job
+
+    def step(self) -> bool:
+        """
+        Advances the next job to its next report boundary, unless it is pacing itself.
+        Returns False once the queue (scheduled jobs included) is empty.
+        """
+        now_ns = time.monotonic_ns()
+        if self._timers:
+            self._release_due(now_ns)
+        if not self._jobs:
+            return bool(self._timers)
+        job = self._next()
+        if job.resume_at_ns > now_ns:
+            return True
+        self._switch_to(job)
+        WATCHDOG.crumb("hid", job.route)
+        job.step(now_ns)
+        WATCHDOG.feed()
+        if job.finished:
+            self._jobs.remove(job)
+            self._current = None
+            self._recent.append(job)
+            if len(self._recent) > _RECENT_JOBS:
+                self._recent.pop(0)
+            self._measure(time.monotonic_ns(), 0)
+        else:
+            self._measure(time.monotonic_ns(), job.step_cost)
+        return bool(self._jobs) or bool(self._timers)
+
+    def find(self, job_id: int) -> Job:
+        """The queued, scheduled or recently finished job with id job_id, None if there is none"""
+        for jobs in (self._jobs, self._timers, self._recent):
+            for job in jobs:
+                if job.id == job_id:
+                    return job
+        return None
+
+    def cost_until_done(self, job: Job) -> int:
+        """Estimated reports sent before `job` has finished, its own included (jobs submitted later not counted)"""
+        if job.finished:
+            return 0
+        if job not in self._jobs:
+            return job.cost  # scheduled, the queue makes way for it when it is due
+        index = self._jobs.index(job)
+        return sum(
+            other.remaining_cost for position, other in enumerate(self._jobs)
+            if other.priority < job.priority or (other.priority == job.priority and position <= index)
+        )
+
+    def wait(self, job: Job) -> Job:
+        """
+        Steps the queue until `job` has finished, sleeping through any delays and until scheduled jobs are due
+        (feeding the watchdog, a scheduled job can be further away than its timeout). For callers that have to block.
+        """
+        while not job.finished:
+            self.step()
+            due_ns = self.next_due_ns()
+            if due_ns is not None:
+                wait_ns = due_ns - time.monotonic_ns()
+                if wait_ns > 0:
+                    WATCHDOG.sleep(wait_ns / 1_000_000_000)
+        return job
+
+    def next_due_ns(self) -> int:
+        """When (time.monotonic_ns()) the queue next has something to do, None if it is empty"""
+        due_ns = self._next().resume_at_ns if self._jobs else None
+        if self._timers and (due_ns is None or self._timers[0].execute_at < due_ns):
+            due_ns = self._timers[0].execute_at
+        return due_ns
+
+
+HID_QUEUE = HIDQueue()
+
+
+class DeferredResponse(Response):
+    """
+    Returned in place of a response while the request's HID job is queued. `resolve(job)` builds the real response
+    once the job has finished.
+
+    A server that holds connections open (ConcurrentServer) waits for the job before sending. Any other server calls
+    _send straight away, which runs the queue until the job has finished, so the request blocks as it always has.
+    """
+
+    def __init__(self, request, job: Job, resolve):
+        super().__init__(request)
+        self.job = job
+        self._resolve = resolve
+
+    def resolve(self) -> Response:
+        """Builds the response for the finished job, carrying over any headers set on this one (e.g. by the server)"""
+        response = self._resolve(self.job)
+        for name, value in self._headers.items():
+            response._headers.setdefault(name, value)
+        self._status = response._status
+        return response
+
+    def _send(self):
+        HID_QUEUE.wait(self.job)
+        response = self.resolve()
+        response._send()
+        self._size = response._size
@@ -0,0 +1,197 @@
+"""
+Scripts of HID ops (compiled from DuckyScript on the host, see host/pyhid_client/ducky.py) run by a small
+interpreter on the board, so a whole script is a single request and its delays are kept by the board's clock.
+
+The request body (POST /api/script) is a header then a sequence of ops, numbers little endian:
+
+    header      b"PHB1", layout name length (1 byte), layout name (ASCII, empty for the default layout)
+    0x01 TEXT           length (2 bytes), UTF-8 text           types the text with the layout, as /api/type does
+    0x02 COMBO          count (1 byte), that many keycodes     presses the keys together, then releases them all
+    0x03 PRESS          count (1 byte), that many keycodes     presses keys and keeps them held
+    0x04 RELEASE        count (1 byte), that many keycodes     releases held keys, every key if count is 0
+    0x05 DELAY          ms (4 bytes)                           pauses
+    0x06 DEFAULT_DELAY  ms (2 bytes)                           pauses after every following op
+    0x07 CHAR_DELAY     ms (2 bytes)                           pauses after every character of following TEXT ops
+    0x08 LOOP           count (2 bytes), length (2 bytes)      runs the `length` bytes of ops that follow count times
+
+Keycodes are the adafruit_hid Keycode values (one byte each). The whole script is checked before anything is typed,
+the text of every TEXT op included (characters the layout has no key for need the default unicode method).
+Pauses are kept against deadlines rather than from whenever the op ended: resuming a few ms late (the server loop
+was busy) is made up by the next pause, so they do not add up over a script. A longer hold up (a preempting key
+combo) is not made up for. Keys held with PRESS stay held through the TEXT and COMBO ops that follow (HOLD SHIFT then
+STRING abc types ABC), they are released at the end of the script at the latest.
+"""
+
+import time
+
+from hid_queue import Job
+
+MAGIC = b"PHB1"
+TEXT = 0x01
+COMBO = 0x02
+PRESS = 0x03
+RELEASE = 0x04
+DELAY = 0x05
+DEFAULT_DELAY = 0x06
+CHAR_DELAY = 0x07
+LOOP = 0x08
+# op -> (size of the fields after the op byte, whether its first field is the length of data following them)
+_OPS = {
+    TEXT: (2, True), COMBO: (1, True), PRESS: (1, True), RELEASE: (1, True),
+    DELAY: (4, False), DEFAULT_DELAY: (2, False), CHAR_DELAY: (2, False), LOOP: (4, False),
+}
+_MAX_DEPTH = 4
+# How late a pause can resume and still be made up for by the next one
+_CATCH_UP_NS = 50_000_000
+
+
+def _uint(body, offset: int, size: int) -> int:
+    return int.from_bytes(bytes(body[offset:offset + size]), "little")
+
+
+def _op_end(body, offset: int, end: int) -> int:
+    """The offset just past the op at offset (which must be in body[:end]), raises ValueError if it is malformed"""
+    op = body[offset]
+    if op not in _OPS:
+        raise ValueError(f"Offset {offset}: unknown op 0x{op:02x}")
+    size, has_length = _OPS[op]
+    op_end = offset + 1 + size + (_uint(body, offset + 1, size) if has_length else 0)
+    if op_end > end:
+        raise ValueError(f"Offset {offset}: op 0x{op:02x} runs past the end of its block")
+    return op_end
+
+
+def layout_name(body) -> str:
+    """The script's layout name (empty for the default layout), raises ValueError if the header is malformed"""
+    if len(body) < len(MAGIC) + 1 or bytes(body[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"A script starts with {MAGIC}")
+    length = body[len(MAGIC)]
+    if len(body) < len(MAGIC) + 1 + length:
+        raise ValueError("Truncated script header")
+    return str(bytes(body[len(MAGIC) + 1:len(MAGIC) + 1 + length]), "ascii")
+
+
+def _ops_start(body) -> int:
+    return len(MAGIC) + 1 + body[len(MAGIC)]
+
+
+def check_script(body, text_cost, start: int = None, end: int = None, depth: int = 0) -> tuple:
+    """
+    Checks the ops of a script, raises ValueError if any is malformed or has text the layout cannot type. Returns the
+    estimated (reports, steps) it takes, `text_cost(text)` being the reports typing text takes (it raises ValueError
+    for characters the layout has no key for and no fallback).
+    """
+    if start is None:
+        start, end = _ops_start(body), len(body)
+    if depth > _MAX_DEPTH:
+        raise ValueError(f"Offset {start}: loops nested more than {_MAX_DEPTH} deep")
+    cost = steps = 0
+    offset = start
+    while offset < end:
+        op, op_end = body[offset], _op_end(body, offset, end)
+        if op == TEXT:
+            text = str(bytes(body[offset + 3:op_end]), "utf-8")
+            cost, steps = cost + text_cost(text), steps + len(text)
+        elif op == COMBO:
+            cost, steps = cost + 2, steps + 1
+        elif op in (PRESS, RELEASE):
+            cost, steps = cost + 1, steps + 1
+        elif op == DELAY:
+            steps += 1
+        elif op == LOOP:
+            count, length = _uint(body, offset + 1, 2), _uint(body, offset + 3, 2)
+            op_end += length
+            if op_end > end:
+                raise ValueError(f"Offset {offset}: loop runs past the end of its block")
+            loop_cost, loop_steps = check_script(body, text_cost, offset + 5, op_end, depth + 1)
+            cost, steps = cost + count * loop_cost, steps + count * loop_steps
+        offset = op_end
+    return cost, steps
+
+
+class _ScriptRun:
+    """The interpreter's state while running a script"""
+
+    def __init__(self, body, keyboard, text_steps):
+        self.body = body
+        self.keyboard = keyboard
+        self.text_steps = text_steps
+        self.default_delay_ns = 0
+        self.char_delay_ns = 0
+        self.held = b""
+        self._deadline_ns = 0
+
+    def pause(self, delay_ns: int):
+        """Seconds to wait for the next deadline, delay_ns after the last one. None if there is nothing to wait."""
+        if not delay_ns:
+            return None
+        now_ns = time.monotonic_ns()
+        deadline_ns = self._deadline_ns if now_ns - self._deadline_ns <= _CATCH_UP_NS else now_ns
+        self._deadline_ns = deadline_ns + delay_ns
+        return (self._deadline_ns - now_ns) / 1_000_000_000 if self._deadline_ns > now_ns else None
+
+    def key_op(self, op: int, keycodes: bytes):
+        """Runs a COMBO, PRESS or RELEASE op"""
+        keyboard, held = self.keyboard, self.held
+        if op == COMBO:
+            try:
+                keyboard.press(*keycodes)
+            finally:
+                keyboard.release(*(code for code in keycodes if code not in held))
+        elif op == PRESS:
+            keyboard.press(*keycodes)
+            self.held = held + bytes(code for code in keycodes if code not in held)
+        elif keycodes:
+            keyboard.release(*keycodes)
+            self.held = bytes(code for code in held if code not in keycodes)
+        else:
+            keyboard.release_all()
+            self.held = b""
+
+    def run(self, start: int, end: int):
+        """Runs the ops in body[start:end], one step per character, key op or pause"""
+        body = self.body
+        offset = start
+        while offset < end:
+            op, op_end = body[offset], _op_end(body, offset, end)
+            if op == TEXT:
+                for _ in self.text_steps(str(bytes(body[offset + 3:op_end]), "utf-8")):
+                    if self.held:  # typing a character releases every key
+                        self.keyboard.press(*self.held)
+                    yield self.pause(self.char_delay_ns)
+            elif op in (COMBO, PRESS, RELEASE):
+                self.key_op(op, bytes(body[offset + 2:op_end]))
+            elif op == DELAY:
+                yield self.pause(_uint(body, offset + 1, 4) * 1_000_000)
+            elif op == DEFAULT_DELAY:
+                self.default_delay_ns = _uint(body, offset + 1, 2) * 1_000_000
+            elif op == CHAR_DELAY:
+                self.char_delay_ns = _uint(body, offset + 1, 2) * 1_000_000
+            elif op == LOOP:
+                op_end += _uint(body, offset + 3, 2)
+                for _ in range(_uint(body, offset + 1, 2)):
+                    yield from self.run(offset + 5, op_end)
+            if op in (COMBO, PRESS, RELEASE) or (op == TEXT and self.default_delay_ns):
+                yield self.pause(self.default_delay_ns)
+            offset = op_end
+
+
+def _script_steps(body, keyboard, text_steps):
+    try:
+        yield from _ScriptRun(body, keyboard, text_steps).run(_ops_start(body), len(body))
+    finally:
+        if any(keyboard.report):
+            keyboard.release_all()
+
+
+def script_job(request, body, keyboard, text_steps, text_cost) -> Job:
+    """
+    Checks a script (a memoryview of the request body) and returns the Job that runs it. `text_steps(text)` returns
+    the steps typing text with the script's layout, one per character, `text_cost(text)` the reports those send.
+    Raises ValueError if the script is malformed or has text the layout cannot type.
+    """
+    cost, steps = check_script(body, text_cost)
+    return Job(
+        _script_steps(body, keyboard, text_steps), request.path, release=keyboard.release_all,
+        cost=cost, step_cost=cost / steps if steps else 0,
+    )
@@ -0,0 +1,149 @@
+"""
+Server-sent events following a HID job, so a client can watch a long paste rather than block on it or poll.
+
+Any HID request can be queued with ?detach=1, which answers at once with 202 {"job": <id>}. Then
+
+    GET /api/events?job=<id>[&interval=<ms>]
+
+holds the connection open and streams text/event-stream until the job has finished:
+
+    event: progress
+    data: {"job":       12,"state":"running","steps":      120,"reports":      240,"cost":     1000,"eta_ms":     6080}
+
+    event: done                 (or error, with the "error" and "status" the request would have been answered with)
+    data: {"job": 12, "state": "done", "steps": 500, "reports": 1000, "cost": 1000}
+
+`steps` are the characters typed (combos pressed, script steps run), `reports` and `cost` the HID reports sent and
+estimated for the whole job, `eta_ms` when the job should finish at the queue's current drain rate, jobs queued
+ahead of it included. A progress event is written at most every interval ms (250 by default) and only when
+something changed (or every 10 s, to keep the connection alive), into one reused buffer with fixed width fields as
+the health check does, so following a job does not add to the garbage the typing loop leaves. The last few finished
+jobs are remembered (see HIDQueue.find), a stream opened just after its job finished gets the final event at once.
+The concurrent server sends one event per poll at most, ConcurrentServer.max_connections bounds how many streams can
+be open.
+"""
+
+import errno
+import json
+import time
+
+from adafruit_httpserver import JSONResponse
+from adafruit_httpserver.status import BAD_REQUEST_400, NOT_FOUND_404
+
+from fixed_fields import field_end, put_int
+from hid_queue import HID_QUEUE, DONE, FAILED
+from pyhid_watchdog import WATCHDOG
+from streamed_response import StreamedResponse
+
+DEFAULT_INTERVAL_MS = 250
+MIN_INTERVAL_MS = 50
+_KEEP_ALIVE_NS = 10_000_000_000
+_NUMBER_WIDTH = 9
+_STATE_WIDTH = len('"running"')
+# The client has gone. CircuitPython's errno does not have EPIPE on every port, its value is the same everywhere.
+_GONE = (errno.ECONNRESET, getattr(errno, "EPIPE", 32))
+
+_EVENT = bytearray(
+    b'event: progress\ndata: {"job":' + b" " * _NUMBER_WIDTH + b',"state":' + b" " * _STATE_WIDTH
+    + b"".join(b',"' + name + b'":' + b" " * _NUMBER_WIDTH for name in (b"steps", b"reports", b"cost", b"eta_ms"))
+    + b"}\n\n"
+)
+
+
+_JOB, _STATE, _STEPS, _REPORTS, _COST, _ETA = (
+    field_end(_EVENT, name, len(_EVENT) - 3) for name in (b"job", b"state", b"steps", b"reports", b"cost", b"eta_ms")
+)
+
+
+def _eta_ms(job) -> int:
+    """Milliseconds until the job is expected to have finished"""
+    eta_ms = HID_QUEUE.cost_until_done(job) * 1000 // max(1, int(HID_QUEUE.drain_rate))
+    if job.execute_at is not None and not job.started_ns:
+        eta_ms += max(0, (job.execute_at - time.monotonic_ns()) // 1_000_000)
+    return eta_ms
+
+
+def _progress_event(job) -> bytearray:
+    """Fills _EVENT in with the job's current progress"""
+    state = b'"' + job.state.encode() + b'"'
+    _EVENT[_STATE - _STATE_WIDTH:_STATE] = state + b" " * (_STATE_WIDTH - len(state))  # whitespace is valid JSON
+    put_int(_EVENT, _JOB, _NUMBER_WIDTH, job.id)
+    put_int(_EVENT, _STEPS, _NUMBER_WIDTH, job.steps_done)
+    put_int(_EVENT, _REPORTS, _NUMBER_WIDTH, job.cost - job.remaining_cost)
+    put_int(_EVENT, _COST, _NUMBER_WIDTH, job.cost)
+    put_int(_EVENT, _ETA, _NUMBER_WIDTH, _eta_ms(job))
+    return _EVENT
+
+
+def _final_event(job) -> bytes:
+    """The done or error event, written once per stream"""
+    data = {
+        "job": job.id, "state": job.state, "steps": job.steps_done, "reports": job.cost - job.remaining_cost,
+        "cost": job.cost,
+    }
+    if job.state == FAILED:
+        data["error"] = repr(job.error)
+        data["status"] = job.error_status.code if job.error_status else 500
+    return b"event: " + (b"done" if job.state == DONE else b"error") + b"\ndata: " + json.dumps(data).encode() + b"\n\n"
+
+
+class JobEventStream(StreamedResponse):
+    """Streams a job's progress events until it has finished. It has no length, the connection is closed after."""
+
+    length_known = False
+
+    def __init__(self, request, job, interval_ms: int):
+        super().__init__(
+            request, headers={"Cache-Control": "no-store", "Connection": "close"}, content_type="text/event-stream"
+        )
+        self.job = job
+        self._interval_ns = interval_ms * 1_000_000
+        self._sent_ns = None  # when the last event was sent, None until the headers are
+        self._sent = None  # (state, reports until the job is done) in the last progress event
+
+    def _write(self, data) -> bool:
+        """Sends data, False if the client has gone"""
+        try:
+            self._send_bytes(self._request.connection, data)
+        except OSError as error:
+            if error.errno in _GONE:
+                return False
+            raise
+        return True
+
+    def send_step(self) -> bool:
+        job = self.job
+        now_ns = time.monotonic_ns()
+        if self._sent_ns is None:
+            self._send_headers(None, self._content_type)
+        elif job.finished:
+            if self._sent is None or self._sent[0] != job.state:
+                self._write(_progress_event(job))
+            self._write(_final_event(job))
+            return True
+        elif now_ns - self._sent_ns < self._interval_ns:
+            return False
+        sent = (job.state, HID_QUEUE.cost_until_done(job))  # moves on with the jobs ahead of a queued one too
+        if sent == self._sent and now_ns - self._sent_ns < _KEEP_ALIVE_NS:
+            return False
+        self._sent_ns, self._sent = now_ns, sent
+        return not self._write(_progress_event(job))
+
+    def idle(self):
+        # Sent in one go the stream holds the server loop: the queue has to be stepped here for the job to go on, and
+        # the watchdog fed while a scheduled job is not due yet
+        HID_QUEUE.step()
+        WATCHDOG.feed()
+
+
+def job_event_stream(request):
+    """The event stream for GET ?job=<id>[&interval=<ms>], a 400 or 404 JSONResponse if there is no such job"""
+    try:
+        job_id = int(request.query_params.get("job"))
+        interval_ms = max(MIN_INTERVAL_MS, int(request.query_params.get("interval", DEFAULT_INTERVAL_MS)))
+    except (TypeError, ValueError):
+        return JSONResponse(request, {"error": "job must be a job id, interval a number of ms"}, status=BAD_REQUEST_400)
+    job = HID_QUEUE.find(job_id)
+    if job is None:
+        return JSONResponse(request, {"error": f"No queued or recently finished job {job_id}"}, status=NOT_FOUND_404)
+    return JobEventStream(request, job, interval_ms)
@@ -0,0 +1,147 @@
+"""
+Keys held down across requests (/api/keys/press, /api/keys/release), rather than pressed and released in one go.
+
+Held keys are tracked in a 256 bit bitmap, a bit per keycode, next to the keyboard's own 8 byte boot report: the
+modifiers byte and at most six other keys. Pressing a seventh non modifier key is refused rather than rolling the
+oldest one out of the report as adafruit_hid would.
+
+Every held key can have an auto-release deadline, a safety net for a client that goes away mid hold. Deadlines are
+checked from the main loop (see poll) and only acted on while the HID queue is idle, anything running or queued
+sends its own reports and releases every key when it is done or preempted. That also means held keys do not survive
+other HID output: typing, a key combo or raw reports release them, state() only reports keys that are still down.
+"""
+
+import time
+
+from adafruit_hid.keycode import Keycode
+
+from hid_queue import HID_QUEUE, Job, PRIORITY_HIGH
+
+_MAX_KEYS = 6
+
+
+class KeyState:
+    """The keys held down through the key state API, and when each of them is due to be released."""
+
+    def __init__(self):
+        self._held = bytearray(32)  # bit n set: keycode n is held
+        self._deadlines = {}  # keycode -> time.monotonic_ns() it is released at
+        self._next_deadline = None
+        self.auto_released = 0
+
+    def __bool__(self) -> bool:
+        return any(self._held)
+
+    def is_held(self, keycode: int) -> bool:
+        """True if keycode is held down through the key state API"""
+        return bool(self._held[keycode >> 3] & (1 << (keycode & 7)))
+
+    def _set(self, keycode: int, held: bool):
+        if held:
+            self._held[keycode >> 3] |= 1 << (keycode & 7)
+        else:
+            self._held[keycode >> 3] &= ~(1 << (keycode & 7)) & 0xFF
+            self._deadlines.pop(keycode, None)
+
+    def held(self) -> list:
+        """The held keycodes, lowest first"""
+        return [keycode for keycode in range(256) if self._held[keycode >> 3] & (1 << (keycode & 7))]
+
+    def sync(self, keyboard):
+        """Forgets held keys that are no longer in the keyboard's report, released by other HID output"""
+        if not self:
+            return
+        report = keyboard.report
+        for keycode in self.held():
+            modifier = Keycode.modifier_bit(keycode)
+            if not (report[0] & modifier if modifier else keycode in report[2:]):
+                self._set(keycode, False)
+        self._update_next_deadline()
+
+    def _update_next_deadline(self):
+        self._next_deadline = min(self._deadlines.values()) if self._deadlines else None
+
+    def press(self, keyboard, keycodes: list, hold_ns: int = 0):
+        """
+        Presses keycodes and keeps them held, for hold_ns (0: until released). Raises ValueError, pressing nothing,
+        if that would make more than six non modifier keys held.
+        """
+        self.sync(keyboard)
+        keys = set(keyboard.report[2:]) | set(keycode for keycode in keycodes if not Keycode.modifier_bit(keycode))
+        keys.discard(0)
+        if len(keys) > _MAX_KEYS:
+            raise ValueError(f"At most {_MAX_KEYS} keys (plus modifiers) can be held at once")
+        keyboard.press(*keycodes)
+        deadline = time.monotonic_ns() + hold_ns if hold_ns else None
+        for keycode in keycodes:
+            self._set(keycode, True)
+            if deadline:
+                self._deadlines[keycode] = deadline
+            else:
+                self._deadlines.pop(keycode, None)
+        self._update_next_deadline()
+
+    def release(self, keyboard, keycodes: list = None):
+        """Releases keycodes, every key if None"""
+        if keycodes is None:
+            keyboard.release_all()
+            self._held = bytearray(32)
+            self._deadlines = {}
+        else:
+            keyboard.release(*keycodes)
+            for keycode in keycodes:
+                self._set(keycode, False)
+        self._update_next_deadline()
+
+    def poll(self, get_keyboard):
+        """
+        Releases keys past their deadline, unless an HID job is running (a job only scheduled for later does not hold
+        them up). Cheap enough for every pass of the main loop, get_keyboard is only called once a key is due.
+        """
+        if self._next_deadline is None or HID_QUEUE.busy or time.monotonic_ns() < self._next_deadline:
+            return
+        keyboard = get_keyboard()
+        self.sync(keyboard)
+        now_ns = time.monotonic_ns()
+        due = [keycode for keycode, deadline in self._deadlines.items() if deadline <= now_ns]
+        if due:
+            self.release(keyboard, due)
+            self.auto_released += len(due)
+
+    def state(self, keyboard) -> dict:
+        """The held keys (Keycode names), when any of them will be released (ms from now) and the keyboard report"""
+        self.sync(keyboard)
+        names = {getattr(Keycode, name): name for name in dir(Keycode) if name.isupper()} if self else {}
+        now_ns = time.monotonic_ns()
+        return {
+            "held": [names.get(keycode, keycode) for keycode in self.held()],
+            "release_in_ms": {
+                names.get(keycode, keycode): max(0, (deadline - now_ns) // 1_000_000)
+                for keycode, deadline in self._deadlines.items()
+            },
+            "report": bytes(keyboard.report).hex(),
+            "auto_released": self.auto_released,
+        }
+
+
+KEY_STATE = KeyState()
+
+
+def _press_step(keyboard, keycodes: list, hold_ns: int):
+    KEY_STATE.press(keyboard, keycodes, hold_ns)
+    yield None
+
+
+def _release_step(keyboard, keycodes: list):
+    KEY_STATE.release(keyboard, keycodes)
+    yield None
+
+
+def press_job(request, keyboard, keycodes: list, hold_ns: int, error_status) -> Job:
+    """A single report job pressing keycodes, queued ahead of any text being typed"""
+    return Job(_press_step(keyboard, keycodes, hold_ns), request.path, error_status, priority=PRIORITY_HIGH, cost=1)
+
+
+def release_job(request, keyboard, keycodes: list = None) -> Job:
+    """A single report job releasing keycodes (every key if None), queued ahead of any text being typed"""
+    return Job(_release_step(keyboard, keycodes), request.path, priority=PRIORITY_HIGH, cost=1)
@@ -0,0 +1,182 @@
+"""
+A fixed size, in-RAM ring buffer of compact binary log records.
+
+Writing a record is a single struct.pack_into on a preallocated bytearray, nothing is formatted or printed on the
+request path. Records are only turned into something human readable when the buffer is read, and then streamed out a
+few at a time (see LogResponse) from a copy of the records, rather than built into one big JSON document.
+"""
+
+import json
+import struct
+import time
+
+from streamed_response import StreamedResponse
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+LEVEL_NAMES = {value: key for key, value in LEVELS.items()}
+
+# timestamp (ms, wraps), level, tag index, status, duration (us)
+_RECORD = "<IBBHI"
+_RECORD_SIZE = struct.calcsize(_RECORD)
+# Tags (routes/messages) are interned, the last index is shared by anything that did not fit in the table.
+_MAX_TAGS = 255
+_OVERFLOW_TAG = "<tag table full>"
+# Records formatted and sent per step of a LogResponse
+_STEP_RECORDS = 8
+_RECORD_JSON = '{{"t_ms": {}, "level": "{}", "route": {}, "status": {}, "duration_us": {}}}'
+
+
+class RingLog:
+    """Stores the most recent `capacity` records, older records are overwritten (and counted as dropped)."""
+
+    def __init__(self, capacity: int = 128, level: int = INFO):
+        self.level = level
+        self._tags = []
+        self._tag_ids = {}
+        self.resize(capacity)
+
+    def resize(self, capacity: int):
+        """(Re)allocates the record buffer, any existing records are discarded."""
+        self._buf = bytearray(max(1, int(capacity)) * _RECORD_SIZE)
+        self.clear()
+
+    @property
+    def _capacity(self) -> int:
+        return len(self._buf) // _RECORD_SIZE
+
+    def validate(self, capacity: int = None, level=None) -> dict:
+        """
+        The 'log' section of pyhid_config.json merged with the current settings and converted, level can be a name or
+        a number. Raises ValueError if any value is bad, nothing is changed.
+        """
+        if isinstance(level, str):
+            if level.upper() not in LEVELS:
+                raise ValueError(f"Log level must be one of {tuple(LEVELS)} or a number")
+            level = LEVELS[level.upper()]
+        return {
+            "capacity": self._capacity if capacity is None else int(capacity),
+            "level": self.level if level is None else int(level),
+        }
+
+    def configure(self, capacity: int = None, level=None):
+        """Validates the 'log' section of pyhid_config.json and only then applies it."""
+        settings = self.validate(capacity, level)
+        self.level = settings["level"]
+        if settings["capacity"] != self._capacity:
+            self.resize(settings["capacity"])
+
+    def clear(self):
+        """Empties the buffer, the tag table is kept as routes rarely change."""
+        self._head = 0
+        self._count = 0
+        self._dropped = 0
+
+    def _tag_id(self, tag: str) -> int:
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            if len(self._tags) >= _MAX_TAGS:
+                return _MAX_TAGS
+            tag_id = len(self._tags)
+            self._tags.append(tag)
+            self._tag_ids[tag] = tag_id
+        return tag_id
+
+    def log(self, level: int, tag: str, status: int = 0, duration_us: int = 0):
+        """Stores a single record, anything below the configured level is ignored."""
+        if level < self.level:
+            return
+        struct.pack_into(
+            _RECORD,
+            self._buf,
+            self._head * _RECORD_SIZE,
+            (time.monotonic_ns() // 1_000_000) & 0xFFFFFFFF,
+            level,
+            self._tag_id(tag),
+            status & 0xFFFF,
+            min(max(duration_us, 0), 0xFFFFFFFF)
+        )
+        self._head = (self._head + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+        else:
+            self._dropped += 1
+
+    def request(self, route: str, status: int, start_ns: int):
+        """Records a handled request, 5xx responses are logged as errors and 4xx as warnings."""
+        if status >= 500:
+            level = ERROR
+        elif status >= 400:
+            level = WARNING
+        else:
+            level = INFO
+        self.log(level, route, status, (time.monotonic_ns() - start_ns) // 1000)
+
+    def _tag_name(self, tag_id: int) -> str:
+        return self._tags[tag_id] if tag_id < len(self._tags) else _OVERFLOW_TAG
+
+    def _snapshot(self) -> bytes:
+        """The buffered records, oldest first, copied so they can be sent while new ones are logged"""
+        first = (self._head - self._count) % self._capacity
+        end = first + self._count
+        if end <= self._capacity:
+            return bytes(self._buf[first * _RECORD_SIZE:end * _RECORD_SIZE])
+        return bytes(self._buf[first * _RECORD_SIZE:]) + bytes(self._buf[:(end - self._capacity) * _RECORD_SIZE])
+
+    def format_record(self, records: bytes, index: int) -> bytes:
+        """A record of a snapshot as JSON"""
+        timestamp, level, tag_id, status, duration_us = struct.unpack_from(_RECORD, records, index * _RECORD_SIZE)
+        return _RECORD_JSON.format(
+            timestamp, LEVEL_NAMES.get(level, str(level)), json.dumps(self._tag_name(tag_id)), status, duration_us
+        ).encode()
+
+    def response(self, request, clear: bool = True):
+        """
+        The buffered records (oldest first) as a LogResponse, optionally clearing the buffer: what is logged while
+        it is sent goes to the next one.
+        """
+        response = LogResponse(request, self, self._snapshot(), self._dropped)
+        if clear:
+            self.clear()
+        return response
+
+
+class LogResponse(StreamedResponse):
+    """
+    {"error": "OK", "logs": [...], "dropped": <n>, "capacity": <n>}, sent a few records per step. The records are
+    formatted twice, once to know the Content-Length, so only a step's worth of them is ever held as JSON.
+    """
+
+    def __init__(self, request, log: RingLog, records: bytes, dropped: int):
+        super().__init__(request, content_type="application/json")
+        self._log = log
+        self._records = records
+        self._start = b'{"error": "OK", "logs": ['
+        self._end = f'], "dropped": {dropped}, "capacity": {log._capacity}}}'.encode()
+        count = len(records) // _RECORD_SIZE
+        self._length = len(self._start) + len(self._end) + max(0, count - 1) + sum(
+            len(log.format_record(records, index)) for index in range(count)
+        )
+        self._next = None  # the next record to send, None until the headers are
+
+    def send_step(self) -> bool:
+        if self._next is None:
+            self._send_headers(self._length, self._content_type)
+            self._send_bytes(self._request.connection, self._start)
+            self._next = 0
+        count = len(self._records) // _RECORD_SIZE
+        end = min(count, self._next + _STEP_RECORDS)
+        if self._next < end:
+            chunk = b",".join(self._log.format_record(self._records, index) for index in range(self._next, end))
+            self._send_bytes(self._request.connection, (b"," if self._next else b"") + chunk)
+            self._next = end
+            return False
+        self._send_bytes(self._request.connection, self._end)
+        return True
+
+
+LOG = RingLog()
@@ -0,0 +1,144 @@
+"""
+Feeds the hardware watchdog from the server loop and keeps a breadcrumb (last route, last phase) of what the board
+was doing, so a stall can be reported after the reset it causes.
+
+The breadcrumb lives in RAM and is only written to non-volatile memory when the watchdog fires (RAISE mode), one
+flash write per stall rather than one per request. In RESET mode the hardware resets the board directly, so only
+the reset reason survives.
+
+Nothing here imports CircuitPython modules, the watchdog/nvm objects are handed in, so the whole thing can be driven
+by SimulatedWatchDog on CPython.
+"""
+
+import time
+
+_MAGIC = b"pyHIDwdt"
+_NVM_SIZE = 64
+# Watchdog.sleep feeds this many times per timeout
+_SLEEP_SLICES = 4
+
+
+class Watchdog:
+    """Wraps microcontroller.watchdog (or a SimulatedWatchDog) and the breadcrumb for the current request."""
+
+    def __init__(self):
+        self.route = ""
+        self.phase = "boot"
+        self.last_stall = None
+        self.reset_reason = None
+        self._wdt = None
+        self._nvm = None
+        self._timeout_error = None
+
+    @property
+    def enabled(self) -> bool:
+        """True once a watchdog has been started"""
+        return self._wdt is not None
+
+    def load(self, nvm, reset_reason: str = None):
+        """Sets where breadcrumbs persist to, loading (and clearing) any stall persisted before the last reset."""
+        self._nvm = nvm
+        self.reset_reason = reset_reason
+        self.last_stall = self._load()
+
+    def start(self, wdt, timeout: float, mode, timeout_error=None):
+        """
+        Starts the watchdog. `timeout_error` is the exception raised in RAISE mode, which must not be swallowed by
+        request handlers.
+        """
+        self._timeout_error = timeout_error
+        wdt.timeout = timeout
+        wdt.mode = mode
+        wdt.feed()
+        self._wdt = wdt
+
+    def feed(self):
+        """Resets the watchdog countdown, a no-op until started."""
+        if self._wdt is not None:
+            self._wdt.feed()
+
+    def sleep(self, seconds: float):
+        """
+        time.sleep(seconds) for waits that can outlast the watchdog timeout (a scheduled job up to
+        max_schedule_ahead away), in slices of at most a quarter of the timeout with a feed after each.
+        """
+        if self._wdt is None:
+            time.sleep(seconds)
+            return
+        slice_seconds = self._wdt.timeout / _SLEEP_SLICES
+        while seconds > 0:
+            time.sleep(min(seconds, slice_seconds))
+            seconds -= slice_seconds
+            self._wdt.feed()
+
+    def crumb(self, phase: str, route: str = None):
+        """Records what the board is about to do, kept in RAM until the watchdog fires."""
+        self.phase = phase
+        if route is not None:
+            self.route = route
+
+    def reraise_timeout(self, exc: Exception):
+        """Re-raises exc if it is a watchdog timeout, for use in broad exception handlers."""
+        if self._timeout_error is not None and isinstance(exc, self._timeout_error):
+            raise exc
+
+    def persist(self):
+        """Writes the current breadcrumb to nvm, called once the watchdog has fired."""
+        if self._nvm is None:
+            return
+        data = _MAGIC + f"{self.route}\0{self.phase}".encode("utf-8")[:_NVM_SIZE - len(_MAGIC) - 1] + b"\0"
+        self._nvm[0:len(data)] = data
+
+    def _load(self):
+        if self._nvm is None or bytes(self._nvm[0:len(_MAGIC)]) != _MAGIC:
+            return None
+        route, phase = bytes(self._nvm[len(_MAGIC):_NVM_SIZE]).split(b"\0")[:2]
+        self._nvm[0:len(_MAGIC)] = bytes(len(_MAGIC))
+        return {"route": route.decode("utf-8"), "phase": phase.decode("utf-8")}
+
+    def status(self) -> dict:
+        """Returns the watchdog settings, the reset reason and the stall (if any) that caused the last reset."""
+        return {
+            "enabled": self.enabled,
+            "timeout": self._wdt.timeout if self._wdt is not None else None,
+            "mode": str(self._wdt.mode) if self._wdt is not None else None,
+            "reset_reason": self.reset_reason,
+            "last_stall": self.last_stall,
+            "route": self.route,
+            "phase": self.phase
+        }
+
+
+class SimulatedWatchDogTimeout(Exception):
+    """Raised by SimulatedWatchDog.check once the timeout has passed without a feed."""
+
+
+class SimulatedWatchDog:
+    """A stand-in for microcontroller.watchdog on CPython, the clock can be replaced to drive it from a test."""
+
+    def __init__(self, clock=time.monotonic):
+        self.timeout = None
+        self.mode = None
+        self.clock = clock
+        self._fed_at = clock()
+
+    def feed(self):
+        """Resets the countdown"""
+        self._fed_at = self.clock()
+
+    def expired(self) -> bool:
+        """True if the timeout has passed since the last feed"""
+        return self.mode is not None and self.clock() - self._fed_at > self.timeout
+
+    def check(self):
+        """Raises SimulatedWatchDogTimeout if the watchdog would have fired, it then stops as the hardware's does"""
+        if self.expired():
+            self.deinit()
+            raise SimulatedWatchDogTimeout(f"Watchdog not fed for more than {self.timeout}s")
+
+    def deinit(self):
+        """Stops the watchdog"""
+        self.mode = None
+
+
+WATCHDOG = Watchdog()
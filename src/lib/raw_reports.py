@@ -0,0 +1,98 @@
+"""
+Raw HID reports, computed on the host and pumped straight through to the USB HID devices.
+
+The request body is a sequence of fixed size records, no parsing beyond a length check and two bytes per record:
+
+    byte 0      device: 0 = keyboard, 1 = mouse, 2 = absolute pointer (if enabled, see absolute_mouse.py)
+    byte 1      delay after the report, in ms (0-255)
+    bytes 2-9   keyboard: an 8 byte boot keyboard report (modifiers, reserved (0), 6 keycodes)
+                mouse: a 4 byte mouse report (buttons, x, y, wheel) followed by 4 bytes of padding
+                absolute pointer: a 6 byte report (buttons, x, y, wheel) followed by 2 bytes of padding
+
+Reports are sent from memoryview slices of the body, nothing is copied.
+"""
+
+from hid_queue import Job
+from absolute_mouse import REPORT_LENGTH as ABSOLUTE_REPORT_LENGTH
+
+RECORD_SIZE = 10
+KEYBOARD = 0
+MOUSE = 1
+ABSOLUTE_MOUSE = 2
+
+# Reports sent back to back without a delay are still handed back to the queue every so often, so the server keeps
+# answering (and a key combo can preempt the stream) during a long burst.
+_BATCH = 16
+
+
+def count_steps(body, max_device: int = MOUSE) -> int:
+    """
+    Checks the structure of a raw report body, raises ValueError if it is malformed (or has reports for a device
+    above max_device). Returns the number of steps the reports are sent in (see _send_reports_steps).
+    """
+    if not body or len(body) % RECORD_SIZE:
+        raise ValueError(f"Body must be a non-empty multiple of {RECORD_SIZE} byte records, got {len(body)} bytes")
+    steps = 0
+    run = 0
+    for offset in range(0, len(body), RECORD_SIZE):
+        device = body[offset]
+        if device > max_device:
+            raise ValueError(f"Record {offset // RECORD_SIZE}: unknown device {device}")
+        if device == KEYBOARD and body[offset + 3]:
+            raise ValueError(f"Record {offset // RECORD_SIZE}: reserved keyboard report byte must be 0")
+        run += 1
+        if body[offset + 1] or run == _BATCH:
+            steps += 1
+            run = 0
+    return steps + (1 if run else 0)
+
+
+def _send_reports_steps(body, keyboard, mouse, absolute=None):
+    """
+    Sends every report in body, stepping after each report with a delay and after every _BATCH reports.
+    Keys or buttons still held at the end (or on an error) are released.
+    """
+    last_keyboard = last_mouse = last_absolute = -1
+    run = 0
+    try:
+        for offset in range(0, len(body), RECORD_SIZE):
+            device = body[offset]
+            if device == KEYBOARD:
+                keyboard._keyboard_device.send_report(body[offset + 2:offset + 10])
+                last_keyboard = offset
+            elif device == MOUSE:
+                mouse._mouse_device.send_report(body[offset + 2:offset + 6])
+                last_mouse = offset
+            else:
+                absolute._device.send_report(body[offset + 2:offset + 2 + ABSOLUTE_REPORT_LENGTH])
+                last_absolute = offset
+            run += 1
+            delay = body[offset + 1]
+            if delay or run == _BATCH:
+                run = 0
+                yield delay / 1000 if delay else None
+    finally:
+        # The Keyboard/Mouse objects do not know about the raw reports, their release_all sends an all clear report.
+        # Keys the Keyboard thinks are held (see key_state.py) were overridden by the raw reports, that clears them.
+        if last_keyboard >= 0 and (any(body[last_keyboard + 2:last_keyboard + 10]) or any(keyboard.report)):
+            keyboard.release_all()
+        if last_mouse >= 0 and body[last_mouse + 2]:
+            mouse.release_all()
+        if last_absolute >= 0:
+            # Keeps the pointer where the reports left it
+            absolute.report[:] = body[last_absolute + 2:last_absolute + 2 + ABSOLUTE_REPORT_LENGTH]
+            if absolute.report[0]:
+                absolute.release_all()
+
+
+def raw_reports_job(request, body, keyboard, mouse, absolute=None) -> Job:
+    """
+    Validates a raw report body and returns the Job that sends it. `body` should be a memoryview. `absolute` is the
+    AbsoluteMouse, None if it is not enabled.
+    """
+    steps = count_steps(body, MOUSE if absolute is None else ABSOLUTE_MOUSE)
+    reports = len(body) // RECORD_SIZE
+    return Job(
+        _send_reports_steps(body, keyboard, mouse, absolute), request.path, release=keyboard.release_all,
+        cost=reports, step_cost=reports / steps,
+    )
@@ -0,0 +1,93 @@
+"""
+Per-request phase timing, returned to the client in a Server-Timing response header.
+
+Timing is off by default and can be switched on at runtime (see /api/timing). When off, every call below returns
+after a single attribute check.
+"""
+
+import time
+
+from adafruit_httpserver import Server
+
+
+class PhaseTimer:
+    """Collects (phase, duration) pairs for the request currently being handled."""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._phases = []
+        # 0 means no request is being timed, the next mark() starts the clock instead of recording a phase.
+        self._last_ns = 0
+        # The response write happens after the headers are built, so it is reported with the following request.
+        self._prev_write_ns = None
+
+    def begin(self, start_ns: int = None):
+        """Starts timing a new request, any phases from a previous request are discarded."""
+        if not self.enabled:
+            return
+        self._phases = []
+        self._last_ns = time.monotonic_ns() if start_ns is None else start_ns
+
+    def mark(self, phase: str):
+        """Records the time since the previous mark as `phase`."""
+        if not self.enabled:
+            return
+        now = time.monotonic_ns()
+        if self._last_ns:
+            self._phases.append((phase, now - self._last_ns))
+        self._last_ns = now
+
+    def save(self):
+        """Returns the timing state of the current request, so it can be restored once its HID job has finished."""
+        if not self.enabled:
+            return None
+        return self._phases, self._last_ns
+
+    def restore(self, state):
+        """Makes a request saved with save() the current request again."""
+        if self.enabled and state is not None:
+            self._phases, self._last_ns = state
+
+    def header(self) -> str:
+        """Formats the recorded phases as a Server-Timing header value (durations in ms)."""
+        parts = [f"{phase};dur={duration_ns / 1_000_000:.3f}" for phase, duration_ns in self._phases]
+        parts.append(f"total;dur={sum(duration_ns for _, duration_ns in self._phases) / 1_000_000:.3f}")
+        if self._prev_write_ns is not None:
+            parts.append(f"prev_write;dur={self._prev_write_ns / 1_000_000:.3f}")
+        return ", ".join(parts)
+
+    def attach(self, response):
+        """Adds the Server-Timing header to a response and times how long it takes to be written."""
+        if not self.enabled:
+            return response
+        self.mark("respond")
+        response._headers["Server-Timing"] = self.header()
+        self._phases = []
+        self._last_ns = 0
+        send = response._send
+
+        def _timed_send():
+            start_ns = time.monotonic_ns()
+            try:
+                return send()
+            finally:
+                self._prev_write_ns = time.monotonic_ns() - start_ns
+
+        response._send = _timed_send
+        return response
+
+
+TIMER = PhaseTimer()
+
+
+class TimedServer(Server):
+    """A Server that starts the request timer before the request is read from the socket."""
+
+    def _receive_request(self, sock, client_address):
+        if not TIMER.enabled:
+            return super()._receive_request(sock, client_address)
+        start_ns = time.monotonic_ns()
+        request = super()._receive_request(sock, client_address)
+        TIMER.begin(start_ns)
+        TIMER.mark("recv")
+        return request
@@ -0,0 +1,144 @@
+"""
+Records the API requests that reach the board (method, route, query string, body and the time since the previous
+request) in a compact binary log, so a session can be downloaded and replayed against a board or the simulator
+(host/replay.py).
+
+Recording is off until started through /api/session/record, the buffer is only allocated then. Records are appended
+to a fixed size bytearray with a single struct.pack_into and a slice copy of the body. Once the buffer is full,
+requests are counted as dropped rather than recorded: the log holds the start of a session exactly, download it (which
+clears it) to keep recording. Query strings are recorded as they were sent (percent-encoded), up to 255 bytes.
+
+The log, as downloaded (little endian):
+
+    b"PHS1", route count (u8), then per route: length (u8), route (utf-8)
+    per request: gap since the previous request (or the start) in us (u32, saturates), flags (u8: bit 0 POST,
+                 bit 1 binary body, bit 2 query string), route index (u8), body length (u16),
+                 with bit 2 set: query string length (u8), query string (without the ?), then the body
+"""
+
+import struct
+import time
+
+MAGIC = b"PHS1"
+POST = 1
+BINARY = 2
+QUERY = 4
+
+_HEADER = "<IBBH"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_MAX_ROUTES = 255
+_MAX_QUERY = 255
+
+
+def _query_string(raw_request: bytes):
+    """The query string of a request's target as it was sent (a memoryview), empty if there is none"""
+    target_end = raw_request.find(b" HTTP/")
+    start = raw_request.find(b"?", 0, target_end)
+    return memoryview(raw_request)[start + 1:target_end] if start >= 0 else b""
+
+
+class SessionRecorder:  # pylint: disable=too-many-instance-attributes
+    """The request log, and whether requests are being added to it."""
+
+    def __init__(self, capacity: int = 16384):
+        self.capacity = capacity
+        self.skip = ()  # routes that are never recorded, the session routes themselves
+        self.recording = False
+        self.recorded = 0
+        self.dropped = 0
+        self._buf = None
+        self._used = 0
+        self._last_ns = 0
+        self._routes = []
+        self._route_ids = {}
+
+    def validate(self, capacity: int = None) -> dict:
+        """
+        The 'session' section of pyhid_config.json merged with the current settings and converted. Raises ValueError
+        if any value is bad, nothing is changed.
+        """
+        capacity = self.capacity if capacity is None else int(capacity)
+        if capacity < 1:
+            raise ValueError("Session capacity must be a positive number of bytes")
+        return {"capacity": capacity}
+
+    def configure(self, capacity: int = None):
+        """Validates the 'session' section of pyhid_config.json and only then applies it, used from the next start."""
+        self.capacity = self.validate(capacity)["capacity"]
+
+    def start(self, capacity: int = None) -> dict:
+        """Starts a new recording, anything not downloaded yet is discarded."""
+        self._buf = bytearray(int(capacity or self.capacity))
+        self._used = 0
+        self.recorded = 0
+        self.dropped = 0
+        self._routes = []
+        self._route_ids = {}
+        self._last_ns = time.monotonic_ns()
+        self.recording = True
+        return self.status()
+
+    def stop(self) -> dict:
+        """Stops recording, the log is kept until it is downloaded."""
+        self.recording = False
+        return self.status()
+
+    def _route_id(self, route: str) -> int:
+        route_id = self._route_ids.get(route)
+        if route_id is None:
+            if len(self._routes) >= _MAX_ROUTES:
+                return None
+            route_id = self._route_ids[route] = len(self._routes)
+            self._routes.append(route)
+        return route_id
+
+    def record(self, request, binary: bool = False):
+        """Adds a request to the log, if recording. Cheap enough to call for every request."""
+        if not self.recording or request.path in self.skip:
+            return
+        body = request.body or b""
+        query = _query_string(request.raw_request)
+        size = _HEADER_SIZE + (1 + len(query) if query else 0) + len(body)
+        route_id = self._route_id(request.path)
+        if route_id is None or len(body) > 0xFFFF or len(query) > _MAX_QUERY or self._used + size > len(self._buf):
+            self.dropped += 1
+            return
+        now_ns = time.monotonic_ns()
+        gap_us = min((now_ns - self._last_ns) // 1000, 0xFFFFFFFF)
+        self._last_ns = now_ns
+        flags = (POST if request.method == "POST" else 0) | (BINARY if binary else 0) | (QUERY if query else 0)
+        struct.pack_into(_HEADER, self._buf, self._used, gap_us, flags, route_id, len(body))
+        offset = self._used + _HEADER_SIZE
+        if query:
+            self._buf[offset] = len(query)
+            self._buf[offset + 1:offset + 1 + len(query)] = query
+            offset += 1 + len(query)
+        self._buf[offset:self._used + size] = body
+        self._used += size
+        self.recorded += 1
+
+    def download(self) -> bytes:
+        """Returns the log and clears it. The buffer is freed too, unless still recording."""
+        routes = [route.encode() for route in self._routes]
+        log = MAGIC + bytes((len(routes),)) + b"".join(bytes((len(route),)) + route for route in routes)
+        if self._buf is not None:
+            log += self._buf[:self._used]
+        self._used = 0
+        self.recorded = 0
+        self.dropped = 0
+        if not self.recording:
+            self._buf = None
+        return log
+
+    def status(self) -> dict:
+        """Whether a session is being recorded, and how much of the buffer it has used"""
+        return {
+            "recording": self.recording,
+            "capacity": len(self._buf) if self._buf is not None else self.capacity,
+            "used": self._used,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+        }
+
+
+RECORDER = SessionRecorder()
@@ -0,0 +1,52 @@
+"""Timestamps each phase of start up, so the time to first request can be measured (see /api/startup)."""
+
+import gc
+import time
+
+# Not available on CPython, where the phases are still timed
+_mem_free = getattr(gc, "mem_free", lambda: None)
+
+
+class StartupProfiler:
+    """Records how long each named start up phase took, and the free heap once it finished."""
+
+    def __init__(self):
+        # monotonic time keeps counting across soft reloads, so this also shows how long ago the board powered on
+        self._start_ns = time.monotonic_ns()
+        self._last_ns = self._start_ns
+        self._phases = []
+        self._marked = set()
+
+    def mark(self, phase: str):
+        """Ends the current phase, naming it `phase`."""
+        now = time.monotonic_ns()
+        self._phases.append((phase, now - self._last_ns, now - self._start_ns, _mem_free()))
+        self._marked.add(phase)
+        self._last_ns = now
+
+    def imports(self, names):
+        """
+        Imports modules one at a time, each as a phase of its own ("import <name>", including whatever it imports
+        that had not been yet), so the cost of each one shows. Importing them again afterwards costs nothing.
+        """
+        for name in names:
+            __import__(name)
+            self.mark("import " + name)
+
+    def mark_once(self, phase: str):
+        """As mark, but only the first call for a given phase is recorded (e.g. the first request)."""
+        if phase not in self._marked:
+            self.mark(phase)
+
+    def report(self) -> dict:
+        """Returns the recorded phases, times are in ms."""
+        return {
+            "code_start_ms": self._start_ns // 1_000_000,
+            "phases": [
+                {"phase": phase, "ms": duration_ns / 1_000_000, "at_ms": at_ns / 1_000_000, "mem_free": mem_free}
+                for phase, duration_ns, at_ns, mem_free in self._phases
+            ]
+        }
+
+
+PROFILE = StartupProfiler()
@@ -0,0 +1,131 @@
+"""
+The web console (see host/console), served from the server's static directory as files gzipped ahead of time.
+
+host/build_console.py writes the gzipped files and a manifest.json next to them, giving for each URL path the file,
+its content type, a strong ETag (a hash of the gzipped bytes) and how long browsers may cache it:
+
+    {"files": {"/": {"file": "index.html.gz", "type": "text/html", "etag": "\\"3f9a...\\"", "cache": "no-cache"}}}
+
+The manifest is read once at start up. A request whose If-None-Match carries the file's ETag is answered with a 304
+without touching the flash, others get the gzipped bytes as they are (Content-Encoding: gzip), sent a chunk per poll
+by the concurrent server. There is no uncompressed copy on the board, a client whose Accept-Encoding rules gzip out
+gets a 406 (one that sends no Accept-Encoding takes any encoding, as HTTP has it, and gets gzip). The page is
+revalidated on every visit, the assets it loads are named with their ETag (?v=...) and cached for a year. Only the
+files in the manifest are served, other GET requests without a route are a 404.
+"""
+
+import json
+import os
+
+from adafruit_httpserver import Response, HEAD
+from adafruit_httpserver.status import Status, NOT_FOUND_404
+
+from streamed_response import StreamedResponse
+
+MANIFEST = "manifest.json"
+_NOT_MODIFIED_304 = Status(304, "Not Modified")
+_NOT_ACCEPTABLE_406 = Status(406, "Not Acceptable")
+# Reused by every file being sent, each chunk is read and sent within a single step
+_CHUNK = bytearray(1024)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """True if an If-None-Match header value lists etag (or is *)"""
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or any(tag.strip() == etag for tag in if_none_match.split(","))
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """True if an Accept-Encoding header value allows gzip, or there is none (anything goes)"""
+    if accept_encoding is None:
+        return True
+    any_coding = False
+    for coding in accept_encoding.split(","):
+        coding, _, params = coding.partition(";")
+        coding, params = coding.strip().lower(), params.replace(" ", "").lower()
+        try:
+            accepted = float(params[2:]) > 0 if params.startswith("q=") else True
+        except ValueError:
+            continue
+        if coding in ("gzip", "x-gzip"):
+            return accepted
+        if coding == "*":
+            any_coding = accepted
+    return any_coding
+
+
+class _StaticFileResponse(StreamedResponse):
+    """Sends the headers, then a chunk of the file per step"""
+
+    def __init__(self, request, path: str, length: int, **kwargs):
+        super().__init__(request, **kwargs)
+        self._path = path
+        self._length = length
+        self._file = None
+
+    def send_step(self) -> bool:
+        if self._file is None:
+            self._send_headers(self._length, self._content_type)
+            if self._request.method == HEAD:
+                return True
+            self._file = open(self._path, "rb")  # pylint: disable=consider-using-with
+            return False
+        length = self._file.readinto(_CHUNK)
+        if not length:
+            return True
+        self._send_bytes(self._request.connection, memoryview(_CHUNK)[:length])
+        return False
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StaticFiles:
+    """The files listed in a static directory's manifest, looked up by URL path"""
+
+    def __init__(self):
+        self.root = None
+        self._files = {}  # URL path -> (file path, content type, ETag, Cache-Control, length)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def load(self, root: str) -> int:
+        """Reads root's manifest, returns the number of files served. Without one (no console installed) none are."""
+        self.root = root
+        self._files = {}
+        try:
+            with open(f"{root}/{MANIFEST}", "r", encoding="utf-8") as manifest:
+                files = json.load(manifest)["files"]
+        except OSError:
+            return 0
+        for url_path, entry in files.items():
+            path = f"{root}/{entry['file']}"
+            try:
+                length = os.stat(path)[6]
+            except OSError:
+                continue
+            self._files[url_path] = (path, entry["type"], entry["etag"], entry["cache"], length)
+        return len(self._files)
+
+    def response(self, request) -> Response:
+        """The response to a GET or HEAD request for a static file"""
+        entry = self._files.get(request.path)
+        if entry is None:
+            return Response(request, "File not found", status=NOT_FOUND_404)
+        path, content_type, etag, cache_control, length = entry
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if _etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(request, headers=headers, status=_NOT_MODIFIED_304)
+        if not _accepts_gzip(request.headers.get("Accept-Encoding")):
+            return Response(
+                request, "Only available gzip encoded", headers={"Vary": "Accept-Encoding"}, status=_NOT_ACCEPTABLE_406
+            )
+        headers["Content-Encoding"] = "gzip"
+        return _StaticFileResponse(request, path, length, headers=headers, content_type=content_type)
+
+
+STATIC = StaticFiles()
@@ -0,0 +1,36 @@
+"""
+Responses sent a piece at a time, so a long response (a file, an event stream) does not hold up the other
+connections or the HID queue while it is being written.
+
+ConcurrentServer calls send_step() once per poll until it returns True, then close(). A server serving one
+connection at a time (Server.poll) sends the whole response in one go, as it would any other.
+"""
+
+from adafruit_httpserver import Response
+
+
+class StreamedResponse(Response):
+    """
+    A Response whose send_step() writes the next piece of it (the headers first), True once it is all sent.
+    A response sent without a Content-Length sets length_known False, its connection is then closed after it.
+    """
+
+    length_known = True
+
+    def send_step(self) -> bool:
+        """Sends the next piece of the response, returns True once there is nothing left to send"""
+        raise NotImplementedError
+
+    def close(self):
+        """Frees whatever the response holds (an open file), called once it is sent or its connection is dropped"""
+
+    def idle(self):
+        """Called between steps when the response is sent in one go, for whatever it is waiting on to make progress"""
+
+    def _send(self):
+        try:
+            while not self.send_step():
+                self.idle()
+        finally:
+            self.close()
+        self._close_connection()
@@ -1,18 +1,111 @@
-"""Contains a dict of supported keyboards and their layouts."""
-
-from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
-from keyboard_layout_win_uk import KeyboardLayout as KeyboardLayoutUK
-from keyboard_layout_win_ca import KeyboardLayout as KeyboardLayoutCA
-from keyboard_layout_win_es import KeyboardLayout as KeyboardLayoutES
-from keyboard_layout_win_fr import KeyboardLayout as KeyboardLayoutFR
-from keyboard_layout_win_de import KeyboardLayout as KeyboardLayoutDE
-
-
-SUPPORTED_KEYBOARDS = {
-    "en-US": KeyboardLayoutUS,
-    "en-GB": KeyboardLayoutUK,
-    "fr-CA": KeyboardLayoutCA,
-    "es-ES": KeyboardLayoutES,
-    "de-DE": KeyboardLayoutDE,
-    "fr-FR": KeyboardLayoutFR
+"""
+Contains a dict of supported keyboards and their layouts.
+
+Layout modules are large, so each one is only imported the first time it is asked for: SUPPORTED_KEYBOARDS maps
+each name to its layout class as it always has, but looking a name up (or get_layout) is what imports it. Listing
+the names, or checking one is supported, imports nothing.
+"""
+
+
+def _en_us():
+    from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+    return KeyboardLayoutUS
+
+
+def _en_gb():
+    from keyboard_layout_win_uk import KeyboardLayout as KeyboardLayoutUK
+    return KeyboardLayoutUK
+
+
+def _fr_ca():
+    from keyboard_layout_win_ca import KeyboardLayout as KeyboardLayoutCA
+    return KeyboardLayoutCA
+
+
+def _es_es():
+    from keyboard_layout_win_es import KeyboardLayout as KeyboardLayoutES
+    return KeyboardLayoutES
+
+
+def _de_de():
+    from keyboard_layout_win_de import KeyboardLayout as KeyboardLayoutDE
+    return KeyboardLayoutDE
+
+
+def _fr_fr():
+    from keyboard_layout_win_fr import KeyboardLayout as KeyboardLayoutFR
+    return KeyboardLayoutFR
+
+
+# layout name -> function that imports and returns the layout class
+_LOADERS = {
+    "en-US": _en_us,
+    "en-GB": _en_gb,
+    "fr-CA": _fr_ca,
+    "es-ES": _es_es,
+    "de-DE": _de_de,
+    "fr-FR": _fr_fr
 }
+
+# Estimated HID reports per character typed, for admission control: a press and a release. Layouts with dead keys
+# (COMBINED_KEYS) send two of each for accented characters, so they are costed a little higher.
+_REPORTS_PER_CHAR = {"en-US": 2, "en-GB": 2}
+_DEAD_KEY_REPORTS_PER_CHAR = 3
+
+_LOADED_KEYBOARDS = {}
+
+
+def get_layout(name: str):
+    """Returns the keyboard layout class for a supported layout name, importing it on first use."""
+    layout = _LOADED_KEYBOARDS.get(name)
+    if layout is None:
+        layout = _LOADED_KEYBOARDS[name] = _LOADERS[name]()
+    return layout
+
+
+class _SupportedKeyboards:
+    """A read only dict of layout name -> layout class, whose classes are imported as they are looked up"""
+
+    def __contains__(self, name) -> bool:
+        return name in _LOADERS
+
+    def __iter__(self):
+        return iter(_LOADERS)
+
+    def __len__(self) -> int:
+        return len(_LOADERS)
+
+    def __getitem__(self, name: str):
+        return get_layout(name)
+
+    def get(self, name: str, default=None):
+        """The layout class for name, default if it is not supported"""
+        return get_layout(name) if name in _LOADERS else default
+
+    def keys(self):
+        """The supported layout names, nothing is imported"""
+        return _LOADERS.keys()
+
+    def values(self):
+        """Every layout class, all of them imported"""
+        return [get_layout(name) for name in _LOADERS]
+
+    def items(self):
+        """(name, layout class) for every layout, all of them imported"""
+        return [(name, get_layout(name)) for name in _LOADERS]
+
+
+SUPPORTED_KEYBOARDS = _SupportedKeyboards()
+
+
+def layout_cost(name: str) -> int:
+    """Returns the estimated number of HID reports sent per character typed with a layout."""
+    return _REPORTS_PER_CHAR.get(name, _DEAD_KEY_REPORTS_PER_CHAR)
+
+
+def load_all_layouts(mark=None):
+    """Imports every supported layout up front, calling mark("layout <name>") after each one if given"""
+    for name in _LOADERS:
+        get_layout(name)
+        if mark:
+            mark("layout " + name)
@@ -0,0 +1,122 @@
+"""
+Types characters a keyboard layout has no key for through the host OS's Unicode entry method, chosen per request
+("unicode" in /api/type, or the default in pyhid_config.json):
+
+    windows      Alt held, the code point in decimal on the numeric keypad (Alt+0<n> below 256). Code points above
+                 255 need an app that takes Unicode Alt codes (RichEdit, Office). Num Lock is switched on for the
+                 text if the host has it off.
+    windows_hex  Alt held, keypad +, the code point in hex. Works in any app, needs the EnableHexNumpad registry
+                 value ("1" in HKEY_CURRENT_USER\\Control Panel\\Input Method) and a log off.
+    linux        Ctrl+Shift+U, the code point in hex, Space (GTK apps and IBus).
+    macos        Option held, the code point in hex as UTF-16 code units (4 digits each), for the "Unicode Hex Input"
+                 input source, which lays out the keys as US.
+
+The reports for a character are built once and cached, and sent back to back as a single step, so nothing is
+interleaved with an entry sequence and every key is released at its end.
+"""
+
+from adafruit_hid.keycode import Keycode
+
+UNICODE_METHODS = ("windows", "windows_hex", "linux", "macos")
+# Estimated reports per character, for admission control
+METHOD_COST = {"windows": 14, "windows_hex": 16, "linux": 20, "macos": 20}
+
+_CTRL = 0x01
+_SHIFT = 0x02
+_ALT = 0x04
+_ALTGR = 0x40
+_KEYPAD_DIGITS = (
+    Keycode.KEYPAD_ZERO, Keycode.KEYPAD_ONE, Keycode.KEYPAD_TWO, Keycode.KEYPAD_THREE, Keycode.KEYPAD_FOUR,
+    Keycode.KEYPAD_FIVE, Keycode.KEYPAD_SIX, Keycode.KEYPAD_SEVEN, Keycode.KEYPAD_EIGHT, Keycode.KEYPAD_NINE,
+)
+# Hex digits on a US layout (Unicode Hex Input on macOS, and the Windows hex method, whose keys are read as US)
+_US_HEX = {
+    "0": Keycode.ZERO, "1": Keycode.ONE, "2": Keycode.TWO, "3": Keycode.THREE, "4": Keycode.FOUR, "5": Keycode.FIVE,
+    "6": Keycode.SIX, "7": Keycode.SEVEN, "8": Keycode.EIGHT, "9": Keycode.NINE, "a": Keycode.A, "b": Keycode.B,
+    "c": Keycode.C, "d": Keycode.D, "e": Keycode.E, "f": Keycode.F,
+}
+# Characters whose reports are kept, the cache is emptied when it fills up
+_CACHE_SIZE = 64
+_CACHE = {}
+
+
+def _report(modifiers: int, keycode: int = 0) -> bytes:
+    return bytes((modifiers, 0, keycode, 0, 0, 0, 0, 0))
+
+
+def typable(layout, char: str) -> bool:
+    """True if the layout has keys for char (layout.write would not raise)"""
+    code = ord(char)
+    if code < len(layout.ASCII_TO_KEYCODE):
+        return bool(layout.ASCII_TO_KEYCODE[code]) or code in layout.COMBINED_KEYS
+    return code in layout.HIGHER_ASCII or char in layout.HIGHER_ASCII or code in layout.COMBINED_KEYS
+
+
+def _layout_key(layout, char: str) -> tuple:
+    """(modifiers, keycode) typing char on the host's layout, for Linux where the hex digits go through it"""
+    keycode = layout.ASCII_TO_KEYCODE[ord(char)]
+    modifiers = (_SHIFT if keycode & layout.SHIFT_FLAG else 0) | (_ALTGR if char in layout.NEED_ALTGR else 0)
+    return modifiers, keycode & ~layout.SHIFT_FLAG
+
+
+def _held(modifiers: int, keys) -> list:
+    """Each key pressed then released with modifiers held throughout"""
+    reports = [_report(modifiers)]
+    for keycode in keys:
+        reports.append(_report(modifiers, keycode))
+        reports.append(_report(modifiers))
+    return reports
+
+
+def _sequence(method: str, layout, code: int) -> list:
+    if method == "windows":
+        digits = ("0" if code < 256 else "") + str(code)
+        return _held(_ALT, [_KEYPAD_DIGITS[ord(digit) - 0x30] for digit in digits]) + [_report(0)]
+    if method == "windows_hex":
+        keys = [Keycode.KEYPAD_PLUS] + [_US_HEX[digit] for digit in f"{code:x}"]
+        return _held(_ALT, keys) + [_report(0)]
+    if method == "macos":
+        units = [code] if code < 0x10000 else [0xD800 + ((code - 0x10000) >> 10), 0xDC00 + (code & 0x3FF)]
+        return _held(_ALT, [_US_HEX[digit] for unit in units for digit in f"{unit:04x}"]) + [_report(0)]
+    reports = [_report(_CTRL | _SHIFT, Keycode.U), _report(0)]
+    for digit in f"{code:x}":
+        modifiers, keycode = _layout_key(layout, digit)
+        reports += [_report(modifiers, keycode), _report(0)]
+    return reports + [_report(0, Keycode.SPACE), _report(0)]
+
+
+def entry_reports(method: str, layout, char: str) -> tuple:
+    """The keyboard reports typing char with method, all keys released at the end. Cached per layout and method."""
+    key = (method, type(layout) if method == "linux" else None, char)
+    reports = _CACHE.get(key)
+    if reports is None:
+        if len(_CACHE) >= _CACHE_SIZE:
+            _CACHE.clear()
+        reports = _CACHE[key] = tuple(_sequence(method, layout, ord(char)))
+    return reports
+
+
+def check_text(layout, text: str, method: str = None) -> tuple:
+    """
+    Scans text before anything is typed. Returns (the characters the layout has no keys for, how many times they
+    occur), raises ValueError if there are any and no method to fall back on (or one the method cannot type either).
+    """
+    missing = {char for char in text if not typable(layout, char)}
+    if not missing:
+        return missing, 0
+    if method is None:
+        raise ValueError(
+            f"No keycode available for {''.join(sorted(missing))!r}, set unicode to one of {UNICODE_METHODS} to type "
+            "them with the host's Unicode input"
+        )
+    control = [char for char in missing if ord(char) < 0x20]
+    if control:
+        raise ValueError(f"Control characters {control} cannot be typed as Unicode input")
+    return missing, sum(1 for char in text if char in missing)
+
+
+def send_entry(keyboard, method: str, layout, char: str):
+    """Types char with method, straight to the keyboard device"""
+    device = keyboard._keyboard_device
+    for report in entry_reports(method, layout, char):
+        device.send_report(report)
@@ -8,16 +8,105 @@ import usb_hid
 from adafruit_hid.keyboard import Keyboard, Keycode
 from adafruit_hid.mouse import Mouse
 
-from adafruit_httpserver import JSONResponse
-from adafruit_httpserver.status import BAD_REQUEST_400, INTERNAL_SERVER_ERROR_500
+from adafruit_httpserver import Response, JSONResponse
+from adafruit_httpserver.status import (
+    OK_200, ACCEPTED_202, BAD_REQUEST_400, TOO_MANY_REQUESTS_429, INTERNAL_SERVER_ERROR_500
+)
 
 # Keyboard Layouts
-from supported_keyboards import SUPPORTED_KEYBOARDS
+from supported_keyboards import SUPPORTED_KEYBOARDS, get_layout, layout_cost
 
+from pyhid_log import LOG
+from server_timing import TIMER
+from startup_profile import PROFILE
+from pyhid_watchdog import WATCHDOG
+from hid_queue import HID_QUEUE, FAILED, PRIORITY_HIGH, PRIORITY_NORMAL, Job, DeferredResponse
+from raw_reports import RECORD_SIZE, raw_reports_job
+from hid_script import layout_name, script_job
+from key_state import KEY_STATE, press_job, release_job
+from unicode_input import UNICODE_METHODS, METHOD_COST, check_text, send_entry
+from caps_lock import caps_affects, write_case_swapped
+from absolute_mouse import AbsoluteMouse, find_absolute_mouse
+from session_recorder import RECORDER
 
-# Create Keyboard and Mouse objects
-kbd = Keyboard(usb_hid.devices)
-mouse = Mouse(usb_hid.devices)
+
+# Keyboard and Mouse objects, created on first use by get_keyboard/get_mouse. Creating a Keyboard sends a report
+# and waits for USB to be ready, which should not hold up the network coming up in fast boot mode.
+_HID_DEVICES = {}
+
+
+def get_keyboard() -> Keyboard:
+    """Returns the USB HID keyboard, creating it on first use."""
+    kbd = _HID_DEVICES.get("keyboard")
+    if kbd is None:
+        kbd = _HID_DEVICES["keyboard"] = Keyboard(usb_hid.devices)
+    return kbd
+
+
+def get_mouse() -> Mouse:
+    """Returns the USB HID mouse, creating it on first use."""
+    mouse = _HID_DEVICES.get("mouse")
+    if mouse is None:
+        mouse = _HID_DEVICES["mouse"] = Mouse(usb_hid.devices)
+    return mouse
+
+
+def get_absolute_mouse() -> AbsoluteMouse:
+    """Returns the absolute pointer, None if boot.py did not enable it (see absolute_mouse.py)."""
+    if "absolute_mouse" not in _HID_DEVICES:
+        hid_device = find_absolute_mouse(usb_hid.devices)
+        _HID_DEVICES["absolute_mouse"] = AbsoluteMouse(hid_device) if hid_device is not None else None
+    return _HID_DEVICES["absolute_mouse"]
+
+# Used when a request does not say otherwise, swapped in by set_defaults (see the "defaults" section of
+# pyhid_config.json). A limit of 0 means unlimited.
+# Keycode requests of at most priority_combos combos jump ahead of text being typed, 0 turns this off.
+# Jobs can be scheduled (execute_at) up to max_schedule_ahead seconds ahead, their connection is held open until then.
+# Keys held through /api/keys/press are released after max_hold seconds at the latest, 0 holds them until released.
+# caps_lock is how text is typed while the host has Caps Lock on, one of CAPS_LOCK_MODES (see _type_chars_steps).
+# unicode is how characters the layout has no key for are typed, one of UNICODE_METHODS (see unicode_input.py), null
+# rejects text with any of them.
+DEFAULTS = {
+    "layout": "en-US", "wait": None, "max_chars": 0, "max_keycodes": 0, "max_reports": 0, "priority_combos": 4,
+    "max_schedule_ahead": 60, "max_hold": 30, "caps_lock": "invert", "unicode": None,
+}
+CAPS_LOCK_MODES = ("invert", "toggle", "ignore")
+# Caps Lock (or Num Lock) off and back on again, two reports each
+_CAPS_LOCK_TOGGLE_COST = 4
+
+
+def validate_defaults(defaults: dict) -> dict:
+    """Merges a (partial) set of defaults with the current ones, raises ValueError if any value is bad."""
+    new_defaults = DEFAULTS.copy()
+    new_defaults.update(defaults)
+    if new_defaults["layout"] not in SUPPORTED_KEYBOARDS:
+        raise ValueError(f"Unsupported default keyboard layout: {new_defaults['layout']}")
+    if new_defaults["wait"] is not None and not isinstance(new_defaults["wait"], (int, float)):
+        raise ValueError("Default wait must be a number or null")
+    if new_defaults["caps_lock"] not in CAPS_LOCK_MODES:
+        raise ValueError(f"caps_lock must be one of {CAPS_LOCK_MODES}")
+    if new_defaults["unicode"] is not None and new_defaults["unicode"] not in UNICODE_METHODS:
+        raise ValueError(f"unicode must be one of {UNICODE_METHODS} or null")
+    for limit in ("max_chars", "max_keycodes", "max_reports", "priority_combos", "max_schedule_ahead", "max_hold"):
+        if not isinstance(new_defaults[limit], int) or new_defaults[limit] < 0:
+            raise ValueError(f"{limit} must be a positive integer (or 0 for unlimited)")
+    return new_defaults
+
+
+def set_defaults(defaults: dict) -> dict:
+    """Validates a (partial) set of defaults and only then applies all of them, returns the defaults now in use."""
+    DEFAULTS.update(validate_defaults(defaults))
+    return DEFAULTS
+
+
+def _over_limit(request, length: int, limit_key: str):
+    """Returns a 400 JSONResponse if length is over the configured limit, otherwise None."""
+    limit = DEFAULTS[limit_key]
+    if limit and length > limit:
+        return JSONResponse(
+            request, {"error": f"Input too long: {length} > {limit_key} ({limit})"}, status=BAD_REQUEST_400
+        )
+    return None
 
 
 def validate_dict(input_data: dict, required_keys: dict, optional_keys: dict = None) -> dict:
@@ -38,91 +127,491 @@ def validate_dict(input_data: dict, required_keys: dict, optional_keys: dict = N
     return bad_input_data
 
 
-def _press_keys(_keyboard, _keys, wait):
-    """Calls the USB HID keyboard press method to input a list of keycodes."""
-    added_prefix_keys = [getattr(Keycode, _key.upper()) for _key in _keys]
+def _press_keys(_keyboard, keycodes: tuple):
+    """Calls the USB HID keyboard press method to input a combo of keycodes, then releases them."""
     try:
-        _keyboard.press(*added_prefix_keys)
+        _keyboard.press(*keycodes)
     finally:
         _keyboard.release_all()
-    if wait:
-        time.sleep(wait)
+
+
+def caps_lock_on(keyboard) -> bool:
+    """True if the host has the keyboard's Caps Lock LED on."""
+    return keyboard.led_on(Keyboard.LED_CAPS_LOCK)
+
+
+def keyboard_leds() -> dict:
+    """Returns the keyboard LED state last sent by the host."""
+    keyboard = get_keyboard()
+    return {
+        "num_lock": keyboard.led_on(Keyboard.LED_NUM_LOCK),
+        "caps_lock": keyboard.led_on(Keyboard.LED_CAPS_LOCK),
+        "scroll_lock": keyboard.led_on(Keyboard.LED_SCROLL_LOCK),
+        "compose": keyboard.led_on(Keyboard.LED_COMPOSE),
+    }
+
+
+def _type_chars_steps(layout, data: str, wait, caps_lock: str = "ignore", unicode: str = None):
+    """
+    Types one character per step, layout.write releases all keys after each one.
+
+    While the host has Caps Lock on, "invert" types the letters Caps Lock changes (see caps_lock.py) with their case
+    swapped, so the shift layout.write adds (or leaves off) undoes Caps Lock. That costs no extra reports, shift is a
+    bit in the same report, and the LED state is checked before every letter. "toggle" switches Caps Lock off for the
+    text and back on afterwards, four more reports, for hosts where shift does not undo Caps Lock (macOS).
+
+    The characters the layout has no key for (see unicode_input.check_text, the first step fails if there are any and
+    no method) are typed with the host's `unicode` input method, Num Lock on for the Windows Alt codes.
+    """
+    keyboard = layout.keyboard
+    missing = check_text(layout, data, unicode)[0]
+    toggled = num_lock = False
+    try:
+        if caps_lock == "toggle" and caps_lock_on(keyboard) and any(caps_affects(layout, char) for char in data):
+            keyboard.send(Keycode.CAPS_LOCK)
+            toggled = True
+            yield None
+        if missing and unicode == "windows" and not keyboard.led_on(Keyboard.LED_NUM_LOCK):
+            keyboard.send(Keycode.KEYPAD_NUMLOCK)
+            num_lock = True
+            yield None
+        for char in data:
+            if char in missing:
+                send_entry(keyboard, unicode, layout, char)
+            elif caps_lock == "invert" and caps_affects(layout, char) and caps_lock_on(keyboard):
+                write_case_swapped(layout, char)
+            else:
+                layout.write(char)
+            yield wait
+    except Exception:
+        try:
+            # Try to release all keys, just in case. Little hideous, but safety first.
+            layout.release_all()
+        except:  # pylint: disable=bare-except
+            pass
+        raise
+    finally:
+        if toggled:
+            keyboard.send(Keycode.CAPS_LOCK)
+        if num_lock:
+            keyboard.send(Keycode.KEYPAD_NUMLOCK)
+
+
+# Loops in /api/keycodes data can be nested this deep
+_MAX_LOOP_DEPTH = 4
+
+
+def _combo_sequence(data: list, depth: int = 0) -> tuple:
+    """
+    Resolves /api/keycodes data (key names, combos and loops, see type_keycodes) into (items, combos): items are
+    tuples of keycodes (a combo) and [count, items] loops, combos how many combos they type once expanded. A loop's
+    data is always a sequence, each key name in it a combo of its own. Raises ValueError for unknown keys, a
+    malformed loop or one whose data types nothing (it would spin through its count without a step to yield).
+    Nothing is expanded, so this takes as long as the data does.
+    """
+    items, combos = [], 0
+    for element in data:
+        if isinstance(element, dict):
+            count, loop_data = element.get("repeat"), element.get("data")
+            if depth >= _MAX_LOOP_DEPTH:
+                raise ValueError(f"Loops can be nested at most {_MAX_LOOP_DEPTH} deep")
+            if not isinstance(count, int) or count < 0 or not isinstance(loop_data, list) or len(element) != 2:
+                raise ValueError(f"A loop is {{\"repeat\": <count>, \"data\": [...]}}, got {element}")
+            loop_items, loop_combos = _combo_sequence(loop_data, depth + 1)
+            if not loop_combos:
+                raise ValueError(f"A loop has to type at least one combo, got {element}")
+            items.append([count, loop_items])
+            combos += count * loop_combos
+        elif not isinstance(element, (str, list)):
+            raise ValueError(f"Expected a key name, a list of them or a loop, got {element}")
+        else:
+            items.append(tuple(_keycodes([element] if isinstance(element, str) else element)))
+            combos += 1
+    return items, combos
+
+
+def _type_keycodes_steps(_keyboard, items: list, wait):
+    """Presses (then releases) one key combo per step, expanding loops as it goes."""
+    for item in items:
+        if isinstance(item, tuple):
+            _press_keys(_keyboard, item)
+            yield wait
+        else:
+            count, loop_items = item
+            for _ in range(count):
+                yield from _type_keycodes_steps(_keyboard, loop_items, wait)
+
+
+def _text_cost(layout, char_cost: int, text: str, unicode: str = None) -> int:
+    """
+    Scans text with check_text (raising ValueError if the layout cannot type it) and returns the reports typing it
+    takes, the characters typed with the unicode method included.
+    """
+    fallbacks = check_text(layout, text, unicode)[1]
+    cost = len(text) * char_cost
+    if fallbacks:
+        cost += fallbacks * (METHOD_COST[unicode] - char_cost) + (_CAPS_LOCK_TOGGLE_COST if unicode == "windows" else 0)
+    return cost
 
 
 def type_chars(request, input_data: dict):
-    """Type into the device via a simple input string. If no layout is specified, en-US is used."""
+    """
+    Type into the device via a simple input string. If no layout is specified, the default layout is used. The text
+    is scanned first: characters the layout has no key for are a 400 unless a unicode input method is given.
+    """
+    too_long = _over_limit(request, len(input_data["data"]), "max_chars")
+    if too_long:
+        return too_long
     requested_layout = input_data.get("layout", None)
     all_supported_kbds = tuple(SUPPORTED_KEYBOARDS.keys())
     if requested_layout is None:
-        _keyboard = SUPPORTED_KEYBOARDS["en-US"]
+        requested_layout = DEFAULTS["layout"]
     elif requested_layout not in all_supported_kbds:
         return JSONResponse(
             request,
             {"error": f"Unsupported keyboard layout: {requested_layout}. Available layouts: {all_supported_kbds}"},
             status=BAD_REQUEST_400
         )
-    else:
-        _keyboard = SUPPORTED_KEYBOARDS[requested_layout]
+    caps_lock = input_data.get("caps_lock", DEFAULTS["caps_lock"])
+    if caps_lock not in CAPS_LOCK_MODES:
+        return JSONResponse(request, {"error": f"caps_lock must be one of {CAPS_LOCK_MODES}"}, status=BAD_REQUEST_400)
+    unicode = input_data.get("unicode", DEFAULTS["unicode"])
+    if unicode is not None and unicode not in UNICODE_METHODS:
+        return JSONResponse(request, {"error": f"unicode must be one of {UNICODE_METHODS}"}, status=BAD_REQUEST_400)
 
-    layout = _keyboard(kbd)
-    wait = input_data.get("wait", None)
+    layout = get_layout(requested_layout)(get_keyboard())
+    TIMER.mark("layout")
+    char_cost = layout_cost(requested_layout)
     try:
-        if wait:
-            wait = float(wait)
-            for char in input_data["data"]:
-                layout.write(char)
-                time.sleep(wait)
-        else:
-            layout.write(input_data["data"])
-    except Exception as exc:  # pylint: disable=broad-except
-        try:
-            # Try to release all keys, just in case. Little hideous, but safety first.
-            layout.release_all()
-        except:  # pylint: disable=bare-except
-            pass
-        return JSONResponse(request, {"error": repr(exc)}, status=BAD_REQUEST_400)
+        cost = _text_cost(layout, char_cost, input_data["data"], unicode)
+    except ValueError as error:
+        return JSONResponse(request, {"error": str(error)}, status=BAD_REQUEST_400)
+    wait = input_data.get("wait", DEFAULTS["wait"])
+    wait = float(wait) if wait else None
+    cost += _CAPS_LOCK_TOGGLE_COST if caps_lock == "toggle" else 0
+    return Job(
+        _type_chars_steps(layout, input_data["data"], wait, caps_lock, unicode), request.path, BAD_REQUEST_400,
+        release=get_keyboard().release_all, cost=cost, step_cost=char_cost,
+    )
 
 
-def type_keycodes(_, input_data: dict):
+def type_keycodes(request, input_data: dict):
     """
-    Types into the connected device via keycodes, maximum of six pressed at one time.
+    Types into the connected device via keycodes, maximum of six pressed at one time. Loops,
+    {"repeat": <count>, "data": [...]}, are expanded one combo at a time as they are typed, max_keycodes applies to
+    the expanded number of combos. Short requests (see DEFAULTS["priority_combos"]) preempt any text being typed.
     """
-    wait = input_data.get("wait", None)
-    # Review, might need better error handling for invalid keycodes
-    if any(isinstance(x, list) for x in input_data["data"]) or input_data.get("separate", False):
-        for keycodes in input_data["data"]:
-            _press_keys(kbd, [keycodes] if isinstance(keycodes, str) else keycodes, wait)
+    data = input_data["data"]
+    if any(isinstance(x, (list, dict)) for x in data) or input_data.get("separate", False):
+        sequence = data
     else:
-        _press_keys(kbd, input_data["data"], wait)
+        sequence = [data]
+    try:
+        items, combos = _combo_sequence(sequence)
+    except ValueError as exc:
+        return JSONResponse(request, {"error": str(exc)}, status=BAD_REQUEST_400)
+    too_long = _over_limit(request, combos, "max_keycodes")
+    if too_long:
+        return too_long
+    wait = input_data.get("wait", DEFAULTS["wait"])
+    priority = PRIORITY_HIGH if combos <= DEFAULTS["priority_combos"] else PRIORITY_NORMAL
+    _keyboard = get_keyboard()
+    # A press and a release report per combo
+    return Job(
+        _type_keycodes_steps(_keyboard, items, wait), request.path, INTERNAL_SERVER_ERROR_500,
+        priority=priority, release=_keyboard.release_all, cost=2 * combos, step_cost=2,
+    )
 
 
-def json_resp(request, _callable, validator_kwargs: dict) -> JSONResponse:
+# Button names taken by place_pointer
+_POINTER_BUTTONS = {
+    "LEFT": AbsoluteMouse.LEFT_BUTTON, "RIGHT": AbsoluteMouse.RIGHT_BUTTON, "MIDDLE": AbsoluteMouse.MIDDLE_BUTTON
+}
+
+
+def _place_pointer_steps(pointer: AbsoluteMouse, x: float, y: float, buttons: int):
+    pointer.move_to(x, y)
+    if buttons:
+        yield None
+        pointer.click(buttons)
+    yield None
+
+
+def place_pointer(request, input_data: dict):
     """
-    A wrapper that handles json input validation and returns a JSONResponse object.
+    Places the pointer at x, y (fractions of the screen, 0.0 to 1.0) with a single absolute pointer report,
+    then clicks "click" (LEFT, RIGHT or MIDDLE) there if given.
     """
+    pointer = get_absolute_mouse()
+    if pointer is None:
+        return JSONResponse(
+            request,
+            {"error": "The absolute pointer is not enabled, set absolute_mouse in pyhid_config.json and reset"},
+            status=BAD_REQUEST_400,
+        )
+    x, y = input_data["x"], input_data["y"]
+    if not (0 <= x <= 1 and 0 <= y <= 1):
+        return JSONResponse(request, {"error": "x and y must be between 0 and 1"}, status=BAD_REQUEST_400)
+    click = input_data.get("click")
+    if click is not None and click.upper() not in _POINTER_BUTTONS:
+        return JSONResponse(
+            request, {"error": f"click must be one of {tuple(_POINTER_BUTTONS)}"}, status=BAD_REQUEST_400
+        )
+    buttons = _POINTER_BUTTONS[click.upper()] if click else 0
+    return Job(
+        _place_pointer_steps(pointer, x, y, buttons), request.path, release=pointer.release_all,
+        cost=3 if buttons else 1, step_cost=1,
+    )
+
+
+def _keycodes(names: list) -> list:
+    """Returns the Keycode values of a list of names, raises ValueError listing any that are not keycodes."""
+    unknown = [name for name in names if not isinstance(name, str) or not hasattr(Keycode, name.upper())]
+    if unknown:
+        raise ValueError(f"Unknown keycodes: {unknown}")
+    return [getattr(Keycode, name.upper()) for name in names]
+
+
+def hold_keys(request, input_data: dict):
+    """
+    Presses keys and keeps them held until they are released, or for "hold" seconds. Held keys are released after
+    max_hold seconds whatever "hold" says, unless max_hold is 0.
+    """
+    hold = input_data.get("hold", 0)
+    if hold < 0:
+        return JSONResponse(request, {"error": "hold must not be negative"}, status=BAD_REQUEST_400)
+    try:
+        keycodes = _keycodes(input_data["data"])
+    except ValueError as exc:
+        return JSONResponse(request, {"error": str(exc)}, status=BAD_REQUEST_400)
+    max_hold = DEFAULTS["max_hold"]
+    if max_hold:
+        hold = min(hold, max_hold) if hold else max_hold
+    return press_job(request, get_keyboard(), keycodes, int(hold * 1_000_000_000), BAD_REQUEST_400)
+
+
+def release_keys(request, input_data: dict):
+    """Releases held keys, every key if no "data" is given."""
+    try:
+        keycodes = _keycodes(input_data["data"]) if "data" in input_data else None
+    except ValueError as exc:
+        return JSONResponse(request, {"error": str(exc)}, status=BAD_REQUEST_400)
+    return release_job(request, get_keyboard(), keycodes)
+
+
+def key_state() -> dict:
+    """Returns the keys held through /api/keys/press, see KeyState.state."""
+    return KEY_STATE.state(get_keyboard())
+
+
+def send_reports(request, body):
+    """
+    Sends raw keyboard/mouse reports computed on the host (see raw_reports.py for the body format).
+    No layouts or keycode names are involved, the reports are passed through as they are.
+    """
+    too_long = _over_limit(request, len(body) // RECORD_SIZE, "max_reports")
+    if too_long:
+        return too_long
+    return raw_reports_job(request, body, get_keyboard(), get_mouse(), get_absolute_mouse())
+
+
+def run_script(request, body):
+    """
+    Runs a compiled script of HID ops (see hid_script.py for the format) with the layout named in its header, or the
+    default layout. Text is typed as /api/type types it, the default caps_lock and unicode modes included, and is
+    checked the same way before anything is typed. The estimated number of reports is limited by max_reports.
+    """
+    name = layout_name(body) or DEFAULTS["layout"]
+    if name not in SUPPORTED_KEYBOARDS:
+        raise ValueError(f"Unsupported keyboard layout: {name}. Available layouts: {tuple(SUPPORTED_KEYBOARDS)}")
+    keyboard = get_keyboard()
+    layout = get_layout(name)(keyboard)
+    caps_lock, unicode, char_cost = DEFAULTS["caps_lock"], DEFAULTS["unicode"], layout_cost(name)
+    job = script_job(
+        request, body, keyboard, lambda text: _type_chars_steps(layout, text, None, caps_lock, unicode),
+        lambda text: _text_cost(layout, char_cost, text, unicode),
+    )
+    return _over_limit(request, job.cost, "max_reports") or job
+
+
+def _response_status(response) -> int:
+    """Returns the status code of a response built by us or by one of the wrapped callables."""
+    status = getattr(response, "_status", OK_200)
+    return getattr(status, "code", OK_200.code)
+
+
+def _json_resp(request, _callable, validator_kwargs: dict) -> JSONResponse:
+    TIMER.mark("dispatch")
     try:
         request_json = request.json()
     except:  # pylint: disable=bare-except
         return JSONResponse(request, {"error": "Invalid json data."}, status=BAD_REQUEST_400)
+    TIMER.mark("json")
     try:
         bad_input_data = validate_dict(request_json, **validator_kwargs)
+        TIMER.mark("validate")
         if bad_input_data:
             return JSONResponse(request, {"error": bad_input_data}, status=BAD_REQUEST_400)
         res = _callable(request, request_json)
+        if isinstance(res, Job):
+            return _schedule(request, res, request_json.get("execute_at"))
         if isinstance(res, JSONResponse):
             return res
-        return JSONResponse(request, {"error": "OK"})
+        body = {"error": "OK"}
+        if isinstance(res, dict):
+            body.update(res)
+        return JSONResponse(request, body)
     except Exception as exc:  # pylint: disable=broad-except
+        WATCHDOG.reraise_timeout(exc)
         return JSONResponse(request, {"error": repr(exc)}, status=INTERNAL_SERVER_ERROR_500)
 
 
-def json_resp_get(request, _callable) -> JSONResponse:
-    """A wrapper that will always a return a JSONResponse object, but handles no input data."""
+def _schedule(request, job: Job, execute_at: int):
+    """
+    Schedules a job for execute_at (device time, ns, see /api/clock) if given. Returns the job, or a 400 JSONResponse
+    if that is further ahead than max_schedule_ahead.
+    """
+    if execute_at is None:
+        return job
+    ahead = DEFAULTS["max_schedule_ahead"]
+    if ahead and execute_at - time.monotonic_ns() > ahead * 1_000_000_000:
+        return JSONResponse(
+            request, {"error": f"execute_at is more than max_schedule_ahead ({ahead}s) away"}, status=BAD_REQUEST_400
+        )
+    job.execute_at = execute_at
+    return job
+
+
+def _finish(request, response, start_ns: int):
+    """Logs a finished request and adds its Server-Timing header (if enabled)."""
+    WATCHDOG.crumb("respond")
+    LOG.request(request.path, _response_status(response), start_ns)
+    return TIMER.attach(response)
+
+
+def _job_resolver(request, start_ns: int):
+    """Returns a function that builds the response for a finished HID job, as json_resp would have."""
+    timing = TIMER.save()
+
+    def resolve(job):
+        TIMER.restore(timing)
+        TIMER.mark("hid")
+        if job.state == FAILED:
+            response = JSONResponse(
+                request, {"error": repr(job.error)}, status=job.error_status or INTERNAL_SERVER_ERROR_500
+            )
+        elif isinstance(job.result, JSONResponse):
+            response = job.result
+        elif job.execute_at is not None:
+            # When the job actually started, so the client can tell how closely boards kept to the schedule
+            response = JSONResponse(request, {
+                "error": "OK", "execute_at": job.execute_at, "started_ns": job.started_ns,
+                "late_us": (job.started_ns - job.execute_at) // 1000,
+            })
+        else:
+            response = JSONResponse(request, {"error": "OK"})
+        return _finish(request, response, start_ns)
+
+    return resolve
+
+
+def json_resp(request, _callable, validator_kwargs: dict) -> JSONResponse:
+    """
+    A wrapper that handles json input validation and returns a JSONResponse object.
+    When server timing is enabled, the time spent in each phase is returned in a Server-Timing header.
+    If the callable returns a dict, it is merged into the response body.
+
+    If the callable returns a Job, it is queued for the HID devices and a DeferredResponse is returned, the
+    JSONResponse is built once the job has finished. A 429 is returned instead if the queue is too full for it.
+    With ?detach=1 a 202 with the job's id is returned as soon as it is queued, see job_events.py.
+    """
+    start_ns = time.monotonic_ns()
+    PROFILE.mark_once("first_request")
+    WATCHDOG.crumb("handler", request.path)
+    RECORDER.record(request)
+    response = _json_resp(request, _callable, validator_kwargs)
+    if isinstance(response, Job):
+        return _queue_job(request, response, start_ns)
+    return _finish(request, response, start_ns)
+
+
+def _queue_job(request, job: Job, start_ns: int):
+    """Queues a job if the HID queue will take it, otherwise returns a 429 telling the client when to retry."""
+    retry_after = HID_QUEUE.admit(job)
+    if not retry_after:
+        HID_QUEUE.submit(job)
+        if request.query_params.get("detach") in ("1", "true"):
+            response = JSONResponse(request, {"error": "OK", "job": job.id}, status=ACCEPTED_202)
+            return _finish(request, response, start_ns)
+        return DeferredResponse(request, job, _job_resolver(request, start_ns))
+    response = JSONResponse(
+        request,
+        {"error": "HID queue full, retry later", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)},
+        status=TOO_MANY_REQUESTS_429,
+    )
+    return _finish(request, response, start_ns)
+
+
+def _binary_resp(request, _callable) -> JSONResponse:
+    TIMER.mark("dispatch")
+    try:
+        res = _callable(request, memoryview(request.body))
+        TIMER.mark("validate")
+        if isinstance(res, Job):
+            execute_at = request.query_params.get("execute_at")
+            return _schedule(request, res, None if execute_at is None else int(execute_at))
+        return res
+    except ValueError as exc:
+        return JSONResponse(request, {"error": str(exc)}, status=BAD_REQUEST_400)
+    except Exception as exc:  # pylint: disable=broad-except
+        WATCHDOG.reraise_timeout(exc)
+        return JSONResponse(request, {"error": repr(exc)}, status=INTERNAL_SERVER_ERROR_500)
+
+
+def binary_resp(request, _callable) -> JSONResponse:
+    """
+    As json_resp, for requests with a binary body. The callable gets a memoryview of the body, a ValueError raised
+    by it is returned as a 400. A job can be scheduled with an execute_at query parameter.
+    """
+    start_ns = time.monotonic_ns()
+    PROFILE.mark_once("first_request")
+    WATCHDOG.crumb("handler", request.path)
+    RECORDER.record(request, binary=True)
+    response = _binary_resp(request, _callable)
+    if isinstance(response, Job):
+        return _queue_job(request, response, start_ns)
+    return _finish(request, response, start_ns)
+
+
+def _json_resp_get(request, _callable) -> JSONResponse:
+    TIMER.mark("dispatch")
     try:
         # a little copy/pasta here. NOTE: can we do less bad?
         res = _callable()
-        if isinstance(res, JSONResponse):
+        TIMER.mark("handler")
+        if isinstance(res, Response):
             return res
-        return JSONResponse(request, {"error": "OK"})
+        if isinstance(res, bytes):
+            return Response(request, res, content_type="application/octet-stream")
+        body = {"error": "OK"}
+        if isinstance(res, dict):
+            body.update(res)
+        return JSONResponse(request, body)
     except Exception as exc:  # pylint: disable=broad-except
+        WATCHDOG.reraise_timeout(exc)
         return JSONResponse(request, {"error": repr(exc)}, status=INTERNAL_SERVER_ERROR_500)
+
+
+def json_resp_get(request, _callable) -> JSONResponse:
+    """
+    A wrapper that will always a return a JSONResponse object, but handles no input data.
+    If the callable returns a dict, it is merged into the response body. Bytes are returned as they are, as
+    application/octet-stream, and a Response (e.g. a StreamedResponse) is returned as it is.
+    """
+    start_ns = time.monotonic_ns()
+    PROFILE.mark_once("first_request")
+    WATCHDOG.crumb("handler", request.path)
+    RECORDER.record(request)
+    response = _json_resp_get(request, _callable)
+    return _finish(request, response, start_ns)
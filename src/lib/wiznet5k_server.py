@@ -2,15 +2,31 @@
 
 import adafruit_wiznet5k.adafruit_wiznet5k_socket as socket
 
-from adafruit_httpserver import Server
-
 from wiznet5keth import NetworkConfig, config_eth
-from config_utils import get_config_from_json_file
+from config_files import read_config
+
+from health import HEALTH
+
+from dispatch_server import DispatchServer
+from concurrent_server import ConcurrentServer
 
 
-def get_server(config_file_path: str, static_file_path: str = "/static", debug: bool = True) -> tuple:
-    """Returns a server object and IP"""
-    eth_config = config_eth(NetworkConfig(**get_config_from_json_file(config_file_path)))
+def get_server(
+    config_file_path: str, static_file_path: str = "/static", debug: bool = False, max_connections: int = 1,
+    keep_alive_timeout: float = 0,
+) -> tuple:
+    """
+    Returns a server object and IP. With max_connections > 1, connections are serviced concurrently and can be kept
+    alive between requests (for up to keep_alive_timeout seconds, 0 closes them after every response).
+    """
+    eth_config = config_eth(NetworkConfig(**read_config(config_file_path)))
     socket.set_interface(eth_config)
-    server = Server(socket, static_file_path, debug=debug)
+    HEALTH.link = lambda: eth_config.link_status
+    if max_connections > 1:
+        server = ConcurrentServer(
+            socket, static_file_path, debug=debug, max_connections=max_connections,
+            keep_alive_timeout=keep_alive_timeout,
+        )
+    else:
+        server = DispatchServer(socket, static_file_path, debug=debug)
     return server, str(eth_config.pretty_ip(eth_config.ip_address))